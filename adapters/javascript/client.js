@@ -1,12 +1,37 @@
 const axios = require('axios');
 const fs = require('fs');
 const path = require('path');
+const zlib = require('zlib');
+const crypto = require('crypto');
+const { Readable } = require('stream');
 require('dotenv').config();
 
+// Snapshots at least this big are streamed gzip-compressed to /upload instead of posted as JSON
+const STREAM_THRESHOLD = parseInt(process.env.DEFLAKE_STREAM_THRESHOLD || String(256 * 1024), 10);
+
+// multipart/form-data body that gzips the snapshot file on the fly, so it is never fully in memory
+function multipartStream(boundary, fields, snapshotPath) {
+    async function* parts() {
+        // Text fields go first: the server needs error_log to prune the snapshot while it streams in
+        for (const [name, value] of Object.entries(fields)) {
+            if (value === null || value === undefined) continue;
+            yield `--${boundary}\r\nContent-Disposition: form-data; name="${name}"\r\n\r\n`;
+            yield Buffer.from(String(value), 'utf8');
+            yield '\r\n';
+        }
+        yield `--${boundary}\r\nContent-Disposition: form-data; name="html_snapshot"; filename="${path.basename(snapshotPath)}.gz"\r\n`;
+        yield 'Content-Type: text/html\r\nContent-Encoding: gzip\r\n\r\n';
+        yield* fs.createReadStream(snapshotPath).pipe(zlib.createGzip());
+        yield `\r\n--${boundary}--\r\n`;
+    }
+    return Readable.from(parts());
+}
+
 class DeFlakeClient {
     constructor(apiUrl, apiKey) {
         this.apiUrl = apiUrl || process.env.DEFLAKE_API_URL || 'http://localhost:8000/api/deflake';
         this.apiKey = apiKey || process.env.DEFLAKE_API_KEY;
+        this.uploadUrl = this.apiUrl.replace(/\/+$/, '') + '/upload';
 
         if (!this.apiKey) {
             console.error("❌ Security Error: DEFLAKE_API_KEY is missing.");
@@ -27,21 +52,25 @@ class DeFlakeClient {
                 throw new Error(`HTML file not found: ${htmlPath}`);
             }
 
-            // 2. Read Files
+            // 2. Read Files (big snapshots are streamed instead)
             const logContent = fs.readFileSync(logPath, 'utf8');
-            const htmlContent = fs.readFileSync(htmlPath, 'utf8');
+            const fields = {
+                error_log: logContent,
+                failing_line: failureLocation ? `Line ${failureLocation.rootLine}` : null,
+                source_code: sourceCode
+            };
 
             // 3. Send securely to API
             console.log(`🔒 Authenticating with API Key: ${this.apiKey.substring(0, 4)}***`);
+
+            if (fs.statSync(htmlPath).size >= STREAM_THRESHOLD) {
+                return await this.uploadStream(fields, htmlPath);
+            }
+
             console.log(`📤 Sending context to: ${this.apiUrl}`);
 
             // Prepare payload
-            const payload = {
-                error_log: logContent,
-                html_snapshot: htmlContent,
-                failing_line: failureLocation ? `Line ${failureLocation.rootLine}` : null,
-                source_code: sourceCode
-            };
+            const payload = { ...fields, html_snapshot: fs.readFileSync(htmlPath, 'utf8') };
 
             const response = await axios.post(this.apiUrl, payload, {
                 headers: {
@@ -64,6 +93,19 @@ class DeFlakeClient {
             process.exit(1);
         }
     }
+
+    async uploadStream(fields, htmlPath) {
+        console.log(`📤 Streaming compressed snapshot to: ${this.uploadUrl}`);
+        const boundary = `deflake-${crypto.randomBytes(12).toString('hex')}`;
+        const response = await axios.post(this.uploadUrl, multipartStream(boundary, fields, htmlPath), {
+            headers: {
+                'Content-Type': `multipart/form-data; boundary=${boundary}`,
+                'X-API-KEY': this.apiKey
+            },
+            maxBodyLength: Infinity
+        });
+        return response.data;
+    }
 }
 
 module.exports = DeFlakeClient;
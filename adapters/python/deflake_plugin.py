@@ -1,8 +1,177 @@
 import sys
 import pytest
 import os
-import subprocess
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+# DeFlake root (where the `core` package lives), relative to this plugin
+DEFLAKE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# We assume the user wants Mock Mode for now based on recent conversation
+# In production, we'd check an env var or config
+MOCK_MODE = True
+AUTO_APPLY = True # Auto-patch for demo
+HEAL_CONCURRENCY = int(os.getenv("DEFLAKE_CONCURRENCY", 8))
+CONTEXT_DIR = os.path.join(os.getcwd(), "deflake_context")
+
+_core = None
+_queue = None
+_writer = None
+_worker_failures = [] # Failures collected from xdist workers (controller side)
+
+def load_core():
+    """Imports the DeFlake core once per session (instead of one interpreter per failure)."""
+    global _core
+    if _core is None:
+        if DEFLAKE_ROOT not in sys.path:
+            sys.path.append(DEFLAKE_ROOT)
+        from core.analyzer import ErrorAnalyzer
+        from core.llm_client import LLMClient
+        from core.patcher import SourcePatcher, group_edits
+        from core.batch import heal_batch
+        from core.history import HistoryStore
+        from core.artifact_store import ArtifactStore
+        from core.validator import VALIDATE_ENABLED, FixValidator, describe
+        _core = {
+            "ArtifactStore": ArtifactStore,
+            "ErrorAnalyzer": ErrorAnalyzer,
+            "LLMClient": LLMClient,
+            "SourcePatcher": SourcePatcher,
+            "group_edits": group_edits,
+            "heal_batch": heal_batch,
+            "HistoryStore": HistoryStore,
+            "FixValidator": FixValidator if VALIDATE_ENABLED else None,
+            "describe": describe,
+        }
+    return _core
+
+def get_writer():
+    """Background artifact writer for this process (cheap import: no LLM stack)."""
+    global _writer
+    if _writer is None:
+        if DEFLAKE_ROOT not in sys.path:
+            sys.path.append(DEFLAKE_ROOT)
+        from core.capture import ArtifactWriter
+        _writer = ArtifactWriter(CONTEXT_DIR)
+    return _writer
+
+def prepare_failure(failure, written=None):
+    """Reads + prunes the captured artifacts. Runs on the background worker while tests keep going."""
+    core = load_core()
+    if written is not None:
+        entry = written.result()  # artifacts still being written by the capture thread
+    else:
+        # Captured by an xdist worker; it flushed its writer before reporting
+        entry = core["ArtifactStore"](CONTEXT_DIR).get(failure["artifact"])
+    failure = {**failure, "log_path": entry["log_path"], "html_path": entry["html_path"]}
+    analyzer = core["ErrorAnalyzer"](failure["log_path"], failure["html_path"])
+    item = {
+        "id": failure["id"],
+        "error_log": analyzer.read_log(),
+        "html_snapshot": analyzer.read_html(),
+    }
+    location = None
+    file_path, line_number = analyzer.extract_location()
+    if file_path and line_number:
+        try:
+            item["failing_line"] = core["SourcePatcher"]().read_line(file_path, line_number)
+            item["test_file"] = file_path
+            location = (file_path, line_number)
+        except Exception as e:
+            print(f"\n⚠️  [DeFlake] Could not read source file: {e}")
+    return item, location, failure
+
+class HealQueue:
+    """
+    Failures are prepared in the background as they happen and healed in one batch
+    at session finish, so the test run is never blocked on the LLM.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="deflake")
+        self.pending = []
+
+    def submit(self, failure, written=None):
+        self.pending.append(self.executor.submit(prepare_failure, failure, written))
+
+    def heal_all(self):
+        prepared = []
+        for future in self.pending:
+            try:
+                prepared.append(future.result())
+            except Exception as e:
+                print(f"\n❌ [DeFlake] Could not prepare failure: {e}")
+        self.executor.shutdown(wait=False)
+        if not prepared:
+            return
+
+        core = load_core()
+        print(f"\n\n🧠 [DeFlake] Healing {len(prepared)} failure(s) in one batch...")
+        client = core["LLMClient"](mock=MOCK_MODE)
+        patcher = core["SourcePatcher"]()
+        history = core["HistoryStore"]()
+        by_id = {item["id"]: (location, failure) for item, location, failure in prepared}
+        items = {item["id"]: item for item, _, _ in prepared}
+        item_lines = {item["id"]: item.get("failing_line") for item, _, _ in prepared}
+        validator = core["FixValidator"]() if AUTO_APPLY and core["FixValidator"] else None
+        fixes = []
+        outcomes = []  # (item id, fix as written or proposed, status), recorded once the writes are done
+
+        for result in core["heal_batch"](client, [item for item, _, _ in prepared], concurrency=HEAL_CONCURRENCY):
+            location, failure = by_id[result["id"]]
+            if result["status"] != "success":
+                print(f"   ❌ {result['id']}: {result['fix']}")
+                continue
+            fix = result["fix"]
+            code = fix.code if AUTO_APPLY and location and fix else None
+            if code and validator is not None:
+                # Only write a fix whose locator actually resolves in the captured page
+                item = items[result["id"]]
+                analyzer = core["ErrorAnalyzer"](failure["log_path"], failure["html_path"])
+                code, verdicts = validator.pick(fix, item["error_log"], item["html_snapshot"], item.get("failing_line"),
+                                                analyzer.read_snapshot(), client.knowledge, item.get("test_file"))
+                if code is None:
+                    print(f"   🛑 {result['id']}: no candidate fix could be verified in the snapshot ({core['describe'](verdicts)})")
+                    outcomes.append((result["id"], fix, "Rejected"))
+                    continue
+            if code:
+                fixes.append((location[0], location[1], code, item_lines[result["id"]]))
+                outcomes.append((result["id"], fix.with_code(code), "Applied"))
+            else:
+                print(f"   💡 {result['id']}: {fix}")
+                outcomes.append((result["id"], fix, "Suggested"))
+
+        # One verified, atomic write per file, however many tests failed in it
+        failed_files = set()
+        for file_path, edits in core["group_edits"](fixes).items():
+            try:
+                patcher.apply_edits(file_path, edits)
+                print(f"   ✅ Patched {file_path} ({len(edits)} edit(s))")
+            except Exception as e:
+                failed_files.add(file_path)
+                print(f"   ❌ Failed to patch {file_path}: {e}")
+
+        # History records what was actually written (only Applied fixes are reused later)
+        for item_id, fix, status in outcomes:
+            location, failure = by_id[item_id]
+            if status == "Applied" and location[0] in failed_files:
+                status = "Failed"
+            history.append(
+                log_path=failure["log_path"],
+                html_path=failure["html_path"],
+                test_file=location[0] if location else None,
+                failing_line=item_lines[item_id],
+                fix=fix,
+                status=status,
+            )
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = HealQueue()
+    return _queue
+
+def is_xdist_worker(config):
+    return hasattr(config, "workerinput")
 
 def pytest_runtest_makereport(item, call):
     """
@@ -14,26 +183,19 @@ def pytest_runtest_makereport(item, call):
         try:
             # 1. Inspect the test item to see if it has a 'page' fixture (Playwright)
             page = item.funcargs.get("page")
-            
+
             if page:
                 print("\n\n🚑 [DeFlake] Failure Detected! Capturing context...")
-                
+
                 # 2. Capture Context
-                timestamp = int(time.time())
-                context_dir = os.path.join(os.getcwd(), "deflake_context")
-                os.makedirs(context_dir, exist_ok=True)
-                
-                log_path = os.path.join(context_dir, f"error_{timestamp}.log")
-                html_path = os.path.join(context_dir, f"snapshot_{timestamp}.html")
-                
                 # Save Error Log
                 # Extract location from the *last* interesting entry in the traceback
                 # call.excinfo.traceback[-1] is usually the failure point
                 # But we want the test file, not the internal library
-                
+
                 failure_path = str(call.excinfo.traceback[-1].path)
                 failure_line = call.excinfo.traceback[-1].lineno + 1 # 0-indexed
-                
+
                 # Iterate back to find the actual test file if the error is deep in a lib
                 for entry in reversed(call.excinfo.traceback):
                     if str(entry.path) == str(item.fspath):
@@ -43,39 +205,47 @@ def pytest_runtest_makereport(item, call):
 
                 log_content = f"Location: {failure_path}:{failure_line}\n"
                 log_content += f"Error: {call.excinfo.value}\n"
-                
-                with open(log_path, "w") as f:
-                    f.write(log_content)
-                
-                # Save HTML Snapshot
-                # We need to run this synchronously to ensure file exists before CLI runs
+
+                # Save HTML Snapshot: only page.content() runs on the test's time;
+                # compressing, hashing and writing happen on the capture thread
                 html_content = page.content()
-                with open(html_path, "w") as f:
-                    f.write(html_content)
-                
-                print(f"   📸 Snapshot saved: {html_path}")
-                print(f"   📜 Log saved: {log_path}")
-                
-                # 3. Invoke DeFlake Core CLI
-                # We assume the user wants Mock Mode for now based on recent conversation
-                # In production, we'd check an env var or config
-                print("   🧠 invoking DeFlake Core...")
-                
-                # Determine path to main.py relative to cwd
-                core_script = os.path.join(os.getcwd(), "core", "main.py")
-                
-                cmd = [
-                    sys.executable, core_script,
-                    "--log", log_path,
-                    "--html", html_path,
-                    "--mock", # Force mock mode for now
-                    "--apply" # Auto-patch for demo
-                ]
-                
-                subprocess.run(cmd)
-                
+                artifact, written = get_writer().capture(log_content, html_content, item.nodeid)
+                print(f"   📸 Snapshot and log queued for the artifact store ({artifact})")
+
+                # 3. Queue for healing at session finish
+                failure = {"id": item.nodeid, "artifact": artifact}
+                if is_xdist_worker(item.config):
+                    # xdist workers only collect; the controller heals everything once
+                    _worker_failures.append(failure)
+                else:
+                    get_queue().submit(failure, written)
+                print("   🧠 Queued for DeFlake healing.")
+
             else:
                 print("\n[DeFlake] Test failed, but no 'page' fixture found. Skipping.")
-                
+
         except Exception as e:
             print(f"\n❌ [DeFlake] Error during healing process: {e}")
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """xdist controller: pick up the failures a worker captured."""
+    for failure in getattr(node, "workeroutput", {}).get("deflake_failures", []):
+        get_queue().submit(failure)
+
+def pytest_sessionfinish(session, exitstatus):
+    if _writer is not None:
+        _writer.flush()
+        if _writer.deduped:
+            print(f"\n📦 [DeFlake] {_writer.deduped} snapshot(s) matched an earlier one and were stored once.")
+    if is_xdist_worker(session.config):
+        # Hand the captured failures to the controller (workeroutput must be JSON-serializable)
+        session.config.workeroutput["deflake_failures"] = list(_worker_failures)
+        return
+    if _queue is not None:
+        _queue.heal_all()
+        # Keep deflake_context/ within its age/count/size budget on long-lived CI agents
+        try:
+            load_core()["ArtifactStore"](CONTEXT_DIR).enforce_retention()
+        except Exception as e:
+            print(f"\n⚠️  [DeFlake] Artifact retention failed: {e}")
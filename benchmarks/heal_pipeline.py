@@ -0,0 +1,302 @@
+"""
+DeFlake heal pipeline benchmark.
+
+Runs the --mock LLM path against the demo artifacts, deflake_context/ and
+synthetically inflated DOMs (1 KB .. 10 MB), and records per-stage latency,
+peak memory and end-to-end throughput of the CLI and the FastAPI endpoint.
+
+    python benchmarks/heal_pipeline.py
+    python benchmarks/heal_pipeline.py --compare benchmarks/results/<baseline>.json
+"""
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+# Sub-millisecond stages are mostly noise; only flag slowdowns bigger than this
+MIN_REGRESSION_MS = 0.5
+SYNTHETIC_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+SYNTHETIC_LOG = (
+    "Location: {source}:3\n"
+    "Error: Page.click: Timeout 2000ms exceeded.\n"
+    "Call log:\n"
+    "  - waiting for locator(\"#submit-button\")\n"
+)
+SOURCE_TEMPLATE = (
+    "from playwright.sync_api import Page\n\n"
+    "def test_login(page: Page):\n"
+    "    page.click(\"#submit-button\")\n"
+)
+
+# Keep the benchmark hermetic: mock LLM, throwaway history/cache, no real API key
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["DEFLAKE_CACHE_BACKEND"] = "off"
+
+
+def inflate_dom(size: int) -> str:
+    """A realistic-ish page of roughly `size` bytes: repeated cards plus scripts/styles to prune."""
+    head = "<!DOCTYPE html><html><head><style>.card{display:flex}</style><script>var x = 1;</script></head><body>"
+    tail = (
+        "<form class=\"login-form\"><button type=\"submit\" class=\"btn-primary-2026\" "
+        "data-testid=\"submit-btn\">Log In</button></form></body></html>"
+    )
+    card = (
+        "<div class=\"card card-{i} shadow-sm\" style=\"margin: 4px\" data-track=\"{i}\">"
+        "<h3 id=\"title-{i}\">Item {i}</h3><p>Lorem ipsum dolor sit amet {i}</p>"
+        "<a href=\"/items/{i}\" class=\"btn btn-link\">Open</a><svg><path d=\"M0 0L10 10\"/></svg></div>"
+    )
+    parts = [head]
+    length = len(head) + len(tail)
+    i = 0
+    while length < size:
+        chunk = card.format(i=i)
+        parts.append(chunk)
+        length += len(chunk)
+        i += 1
+    parts.append(tail)
+    return "".join(parts)
+
+
+def collect_artifacts(workdir: str) -> list:
+    """(name, log_path, html_path) for every artifact the benchmark runs against."""
+    artifacts = []
+    for html_path in sorted(glob.glob(os.path.join(PROJECT_ROOT, "demo-project", "failure-*.html"))):
+        name = os.path.basename(html_path)
+        artifacts.append((f"demo:{name}", os.path.join(PROJECT_ROOT, "demo-project", "complex_error.log"), html_path))
+    for log_path in sorted(glob.glob(os.path.join(PROJECT_ROOT, "deflake_context", "error_*.log"))):
+        stamp = os.path.basename(log_path)[len("error_"):-len(".log")]
+        for suffix in (".html.gz", ".html"):
+            html_path = os.path.join(PROJECT_ROOT, "deflake_context", f"snapshot_{stamp}{suffix}")
+            if os.path.exists(html_path):
+                artifacts.append((f"context:{stamp}", log_path, html_path))
+                break
+
+    source_path = os.path.join(workdir, "test_synthetic.py")
+    with open(source_path, "w") as f:
+        f.write(SOURCE_TEMPLATE)
+    for size in SYNTHETIC_SIZES:
+        log_path = os.path.join(workdir, f"synthetic_{size}.log")
+        html_path = os.path.join(workdir, f"synthetic_{size}.html")
+        with open(log_path, "w") as f:
+            f.write(SYNTHETIC_LOG.format(source=source_path))
+        with open(html_path, "w") as f:
+            f.write(inflate_dom(size))
+        artifacts.append((f"synthetic:{size}", log_path, html_path))
+    return artifacts
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+    }
+
+
+def run_stages(log_path: str, html_path: str, workdir: str) -> dict:
+    """One pass through the heal pipeline with per-stage wall times (seconds)."""
+    from core.analyzer import ErrorAnalyzer
+    from core.llm_client import LLMClient
+    from core.patcher import SourcePatcher
+
+    timings = {}
+    analyzer = ErrorAnalyzer(log_path, html_path)
+
+    start = time.perf_counter()
+    log_content = analyzer.read_log()
+    timings["read_log"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    html_content = analyzer.read_html()
+    timings["read_html"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    file_path, line_number = analyzer.extract_location()
+    timings["extract_location"] = time.perf_counter() - start
+
+    client = LLMClient(mock=True)
+    source_copy = None
+    failing_line = None
+    if file_path and os.path.exists(file_path):
+        source_copy = os.path.join(workdir, "patch_target.py")
+        shutil.copyfile(file_path, source_copy)
+        failing_line = SourcePatcher().read_line(source_copy, line_number)
+
+    try:
+        start = time.perf_counter()
+        prompt, inputs = client.build_prompt(log_content, html_content, failing_line)
+        prompt.format_messages(**inputs)
+        timings["prompt_build"] = time.perf_counter() - start
+    except ImportError:
+        pass  # langchain not installed: the stage is skipped
+
+    fix = client.heal(log_content, html_content, failing_line)
+    if source_copy:
+        start = time.perf_counter()
+        SourcePatcher().replace_line(source_copy, line_number, fix.code or "")
+        timings["patch"] = time.perf_counter() - start
+    return timings
+
+
+def bench_stages(artifacts: list, workdir: str, repeat: int) -> tuple:
+    stages, memory = {}, {}
+    for name, log_path, html_path in artifacts:
+        runs = max(1, repeat if os.path.getsize(html_path) < 1_000_000 else repeat // 5)
+        samples = {}
+        for _ in range(runs):
+            for stage, seconds in run_stages(log_path, html_path, workdir).items():
+                samples.setdefault(stage, []).append(seconds)
+        stages[name] = {stage: summarize(values) for stage, values in samples.items()}
+
+        tracemalloc.start()
+        run_stages(log_path, html_path, workdir)
+        memory[name] = {"peak_kb": round(tracemalloc.get_traced_memory()[1] / 1024, 1)}
+        tracemalloc.stop()
+        click.echo(f"   {name:45s} read_html={stages[name]['read_html']['p50_ms']:9.2f} ms  "
+                   f"peak={memory[name]['peak_kb']:9.1f} KB")
+    return stages, memory
+
+
+def bench_cli(log_path: str, html_path: str, runs: int, env: dict) -> dict:
+    """End-to-end `core/main.py --mock` invocations (includes interpreter startup)."""
+    cmd = [sys.executable, os.path.join(PROJECT_ROOT, "core", "main.py"),
+           "--log", log_path, "--html", html_path, "--mock", "--no-cache"]
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, capture_output=True, check=True)
+        samples.append(time.perf_counter() - start)
+    return {**summarize(samples), "heals_per_sec": round(len(samples) / sum(samples), 2)}
+
+
+def bench_api(log_path: str, html_path: str, requests: int, concurrency: int) -> dict:
+    """POST /api/deflake through the ASGI app in-process, `concurrency` requests at a time."""
+    from fastapi.testclient import TestClient
+    from dashboard.server import app, MASTER_KEY
+
+    with open(log_path) as f:
+        payload = {"error_log": f.read()}
+    with open(html_path) as f:
+        payload["html_snapshot"] = f.read()
+    headers = {"X-API-KEY": MASTER_KEY}
+
+    with TestClient(app) as client:
+        def call(_):
+            start = time.perf_counter()
+            response = client.post("/api/deflake", json=payload, headers=headers)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(call, range(requests)))
+        elapsed = time.perf_counter() - started
+    return {**summarize(samples), "requests_per_sec": round(requests / elapsed, 2), "concurrency": concurrency}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Returns human-readable regressions (p50 slower than baseline by more than `threshold`)."""
+    regressions = []
+    for artifact, stages in current["stages"].items():
+        for stage, stats in stages.items():
+            before = baseline.get("stages", {}).get(artifact, {}).get(stage)
+            if not before or not before["p50_ms"]:
+                continue
+            change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"]
+            if change > threshold and stats["p50_ms"] - before["p50_ms"] > MIN_REGRESSION_MS:
+                regressions.append(f"{artifact} {stage}: {before['p50_ms']} -> {stats['p50_ms']} ms (+{change:.0%})")
+    for target in ("cli", "api"):
+        before = baseline.get("throughput", {}).get(target)
+        after = current.get("throughput", {}).get(target)
+        if before and after and before["p50_ms"]:
+            change = (after["p50_ms"] - before["p50_ms"]) / before["p50_ms"]
+            if change > threshold:
+                regressions.append(f"{target} end-to-end: {before['p50_ms']} -> {after['p50_ms']} ms (+{change:.0%})")
+    return regressions
+
+
+@click.command()
+@click.option('--repeat', default=20, show_default=True, help='Pipeline passes per artifact (large DOMs use fewer).')
+@click.option('--cli-runs', default=5, show_default=True, help='End-to-end CLI invocations.')
+@click.option('--api-requests', default=50, show_default=True, help='Requests sent to /api/deflake.')
+@click.option('--api-concurrency', default=8, show_default=True, help='Concurrent /api/deflake requests.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Where to write the JSON results.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False), help='Baseline results to diff against.')
+@click.option('--threshold', default=0.2, show_default=True, help='Relative p50 slowdown reported as a regression.')
+def main(repeat, cli_runs, api_requests, api_concurrency, output, baseline_path, threshold):
+    """Benchmarks the DeFlake heal pipeline and stores the results as JSON."""
+    workdir = tempfile.mkdtemp(prefix="deflake-bench-")
+    os.environ["DEFLAKE_HISTORY_PATH"] = os.path.join(workdir, "history.db")
+    try:
+        artifacts = collect_artifacts(workdir)
+        click.echo(f"⏱️  Per-stage latency over {len(artifacts)} artifacts")
+        stages, memory = bench_stages(artifacts, workdir, repeat)
+
+        _, log_path, html_path = next(a for a in artifacts if a[0] == "synthetic:100000")
+        throughput = {}
+        if cli_runs:
+            click.echo("🚀 CLI end-to-end")
+            throughput["cli"] = bench_cli(log_path, html_path, cli_runs, dict(os.environ))
+            click.echo(f"   {throughput['cli']}")
+        if api_requests:
+            click.echo("🌐 /api/deflake end-to-end")
+            throughput["api"] = bench_api(log_path, html_path, api_requests, api_concurrency)
+            click.echo(f"   {throughput['api']}")
+
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "stages": stages,
+            "memory": memory,
+            "throughput": throughput,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['meta']['timestamp'].replace(':', '')}-{results['meta']['commit']}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    click.echo(f"📊 Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), threshold)
+        if regressions:
+            click.echo("⚠️  Regressions vs baseline:")
+            for line in regressions:
+                click.echo(f"   {line}")
+            sys.exit(1)
+        click.echo("✅ No regressions vs baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+"""
+DeFlake API load test.
+
+Starts the API server (or targets --url) with its LLM calls going to the scripted stand-in
+from core/llm_standin.py, registers keys through /api/register, then replays payloads built
+from the demo-project and deflake_context artifacts against /api/deflake and /api/history at
+a fixed arrival rate. Reports p50/p95/p99 latency and error rates per endpoint, and checks
+that every key was charged exactly for the heals it was served.
+
+    python benchmarks/load_test.py --rps 20 --concurrency 32 --duration 30
+    python benchmarks/load_test.py --workers 4 --llm-latency 1.5 --llm-error-rate 0.05
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --standin-url http://127.0.0.1:8788
+
+Latency is measured from each request's scheduled start, so time spent waiting for a free
+connection counts: a saturated server shows up as latency, not as a quietly lower send rate.
+"""
+import asyncio
+import glob
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import click
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, "dashboard", "server.py")
+STARTUP_TIMEOUT = 60
+REQUEST_TIMEOUT = 120
+QUOTA_DETAIL_RE = re.compile(r"\((\d+)/(\d+)\)")
+# 402: the key is exhausted; 429: the heal's quota reservation didn't fit
+QUOTA_STATUSES = (402, 429)
+
+
+def build_payloads() -> list:
+    """/api/deflake bodies from the bundled artifacts, shaped like the JS client sends them."""
+    from core.scanner import parse_log
+
+    payloads = []
+    demo = os.path.join(PROJECT_ROOT, "demo-project")
+    for log_path in sorted(glob.glob(os.path.join(demo, "*.log"))):
+        with open(log_path, errors="replace") as f:
+            error_log = f.read()
+        for record in parse_log(log_path):
+            # "DeFlake Complex Challenges › Challenge 1: Dynamic ID" -> failure-Challenge-1:-Dynamic-ID.html
+            title = (record.get("test") or "").split("›")[-1].strip()
+            html_path = os.path.join(demo, f"failure-{title.replace(' ', '-')}.html")
+            if not title or not os.path.exists(html_path):
+                continue
+            with open(html_path) as f:
+                payload = {"error_log": error_log, "html_snapshot": f.read()}
+            source_path = os.path.join(demo, "tests", os.path.basename(record.get("file") or ""))
+            if record.get("line") and os.path.isfile(source_path):
+                with open(source_path) as f:
+                    payload["source_code"] = f.read()
+                payload["failing_line"] = f"Line {record['line']}"
+            payloads.append(payload)
+
+    context = os.path.join(PROJECT_ROOT, "deflake_context")
+    for log_path in sorted(glob.glob(os.path.join(context, "error_*.log"))):
+        html_path = os.path.join(context, f"snapshot_{os.path.basename(log_path)[len('error_'):-len('.log')]}.html")
+        if os.path.exists(html_path):
+            with open(log_path) as f, open(html_path) as g:
+                payloads.append({"error_log": f.read(), "html_snapshot": g.read()})
+    return payloads
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    samples = sorted(samples)
+
+    def at(share):
+        return round(samples[min(len(samples) - 1, int(len(samples) * share))] * 1000, 1)
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": round(samples[-1] * 1000, 1)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class LocalServer:
+    """dashboard/server.py in a subprocess with throwaway databases and the stand-in as its LLM."""
+
+    def __init__(self, workdir: str, llm_url: str, workers: int, local_healers: bool):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, "server.log")
+        env = dict(os.environ)
+        for name in ("DEFLAKE_LLM_PROVIDERS", "DEFLAKE_LLM_FALLBACK_MODELS", "DEFLAKE_DB_INITIALIZED"):
+            env.pop(name, None)
+        env.update({
+            "DEFLAKE_LLM_BASE_URL": f"{llm_url}/v1",
+            "OPENAI_API_KEY": "",
+            "DEFLAKE_USERS_DB_PATH": os.path.join(workdir, "users.db"),
+            "DEFLAKE_HISTORY_PATH": os.path.join(workdir, "history.db"),
+            "DEFLAKE_JOBS_PATH": os.path.join(workdir, "jobs.db"),
+            "DEFLAKE_CACHE_BACKEND": "off",
+            "PYTHONUNBUFFERED": "1",
+        })
+        if not local_healers:
+            # Every heal should reach the (stand-in) LLM, as a first-time failure would
+            env.update({"DEFLAKE_HEURISTICS": "0", "DEFLAKE_KNOWLEDGE": "0"})
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, "--port", str(self.port), "--workers", str(workers)],
+            cwd=PROJECT_ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self):
+        import httpx
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if httpx.get(f"{self.url}/", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        with open(self.log_path) as f:
+            tail = f.read()[-2000:]
+        raise click.ClickException(f"API server did not start:\n{tail}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+
+class LoadRun:
+    """Drives the traffic and keeps every sample: (endpoint, outcome, latency) plus per-key heal counts."""
+
+    def __init__(self, base_url: str, payloads: list, concurrency: int, history_share: float,
+                 unique: bool, seed: int = None):
+        self.base_url = base_url
+        self.payloads = payloads
+        self.concurrency = concurrency
+        self.history_share = history_share
+        self.unique = unique
+        self.random = random.Random(seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.samples = []
+        self.keys = []
+
+    def record(self, endpoint: str, outcome: str, started: float):
+        self.samples.append((endpoint, outcome, time.perf_counter() - started))
+
+    @staticmethod
+    def outcome(response) -> str:
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        try:
+            body = response.json()
+        except ValueError:
+            return "bad_json"
+        # /api/deflake reports LLM failures in the body with a 200
+        if isinstance(body, dict) and body.get("status") == "error":
+            return "heal_error"
+        return "ok"
+
+    async def register(self, client, tier: str, count: int):
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await client.post(f"{self.base_url}/api/register", params={"tier": tier})
+            self.record("register", self.outcome(response), started)
+            response.raise_for_status()
+            body = response.json()
+            self.keys.append({"key": body["api_key"], "tier": tier, "limit": body["limit"],
+                              "served": 0, "rejected": 0})
+
+    async def one(self, client, number: int, started: float):
+        try:
+            if self.random.random() < self.history_share:
+                endpoint = "history"
+                response = await client.get(f"{self.base_url}/api/history", params={"limit": 50})
+            else:
+                endpoint = "deflake"
+                account = self.keys[number % len(self.keys)]
+                payload = dict(self.random.choice(self.payloads))
+                if self.unique:
+                    # A distinct failure per request, so neither the cache nor request coalescing answers it
+                    payload["error_log"] += f"\nRun: {self.run_id}-{number}"
+                response = await client.post(f"{self.base_url}/api/deflake", json=payload,
+                                             headers={"X-API-KEY": account["key"]})
+                if response.status_code == 200 and self.outcome(response) == "ok":
+                    account["served"] += 1
+                elif response.status_code in QUOTA_STATUSES:
+                    account["rejected"] += 1
+            self.record(endpoint, self.outcome(response), started)
+        except Exception as e:
+            self.record(endpoint, f"transport_{type(e).__name__}", started)
+
+    async def drive(self, client, rps: float, duration: float):
+        """Open loop at `rps` (requests are scheduled regardless of earlier ones finishing), or closed loop if 0."""
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(number, scheduled):
+            async with slots:
+                await self.one(client, number, scheduled)
+
+        loop = asyncio.get_running_loop()
+        begin = time.perf_counter()
+        if rps > 0:
+            tasks, number = [], 0
+            while True:
+                due = begin + number / rps
+                if due - begin >= duration:
+                    break
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                tasks.append(loop.create_task(bounded(number, due)))
+                number += 1
+            await asyncio.gather(*tasks)
+        else:
+            counter = iter(range(sys.maxsize))
+
+            async def worker():
+                while time.perf_counter() - begin < duration:
+                    await self.one(client, next(counter), time.perf_counter())
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return time.perf_counter() - begin
+
+    async def usage(self, client):
+        for account in self.keys:
+            response = await client.get(f"{self.base_url}/api/user/usage", headers={"X-API-KEY": account["key"]})
+            account["usage"] = None
+            if response.status_code == 200:
+                account["usage"] = response.json().get("usage")
+            elif response.status_code == 402:
+                # Exhausted keys are turned away by the quota check; the count is in the message
+                match = QUOTA_DETAIL_RE.search(response.json().get("detail", ""))
+                account["usage"] = int(match.group(1)) if match else None
+
+    async def run(self, keys: int, free_keys: int, rps: float, duration: float) -> float:
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT) as client:
+            await self.register(client, "pro", keys)
+            await self.register(client, "free", free_keys)
+            elapsed = await self.drive(client, rps, duration)
+            await self.usage(client)
+        return elapsed
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint in ("register", "deflake", "history"):
+            samples = [s for s in self.samples if s[0] == endpoint]
+            if not samples:
+                continue
+            outcomes = {}
+            for _, outcome, _ in samples:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            # Quota rejections are the server doing its job, not errors
+            failed = sum(n for outcome, n in outcomes.items()
+                         if outcome != "ok" and outcome not in {f"http_{status}" for status in QUOTA_STATUSES})
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "error_rate": round(failed / len(samples), 4),
+                "outcomes": outcomes,
+                **percentiles([latency for _, outcome, latency in samples if outcome == "ok"]),
+            }
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "achieved_rps": round(sum(e["requests"] for n, e in endpoints.items() if n != "register") / elapsed, 2),
+            "endpoints": endpoints,
+            "quota": self.check_quota(),
+        }
+
+    def check_quota(self) -> dict:
+        """
+        Each key must have been charged exactly once per heal it was served, never past its limit,
+        and only turned away (402/429) once the limit was actually reached.
+        """
+        problems = []
+        for account in self.keys:
+            label = f"{account['tier']} key …{account['key'][-6:]}"
+            usage, served, limit = account.get("usage"), account["served"], account["limit"]
+            if usage is None:
+                problems.append(f"{label}: usage could not be read")
+                continue
+            if served > limit:
+                problems.append(f"{label}: served {served} heals on a limit of {limit}")
+            if usage != min(served, limit):
+                problems.append(f"{label}: charged {usage}, served {served}")
+            if account["rejected"] and usage < limit:
+                problems.append(f"{label}: {account['rejected']} request(s) rejected at {usage}/{limit}")
+        return {
+            "keys": [{k: v for k, v in account.items() if k != "key"} for account in self.keys],
+            "problems": problems,
+        }
+
+
+def print_report(results: dict, rps: float):
+    target = f"target {rps:g} req/s" if rps > 0 else "closed loop"
+    click.echo(f"📈 {results['elapsed_s']} s, {results['achieved_rps']} req/s achieved ({target})")
+    click.echo(f"   {'endpoint':10s} {'requests':>8s} {'errors':>7s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for name, stats in results["endpoints"].items():
+        cells = " ".join(f"{stats[k]:>7.1f}ms" if stats[k] is not None else f"{'-':>9s}"
+                         for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms"))
+        click.echo(f"   {name:10s} {stats['requests']:>8d} {stats['error_rate']:>7.1%} {cells}")
+        others = {k: v for k, v in stats["outcomes"].items() if k != "ok"}
+        if others:
+            click.echo(f"   {'':10s} {others}")
+    quota = results["quota"]
+    served = sum(k["served"] for k in quota["keys"])
+    rejected = sum(k["rejected"] for k in quota["keys"])
+    if quota["problems"]:
+        click.echo(f"❌ Quota accounting ({served} heals served, {rejected} rejected):")
+        for problem in quota["problems"]:
+            click.echo(f"   {problem}")
+    else:
+        click.echo(f"🧾 Quota accounting matches: {served} heals served and charged, {rejected} rejected at the limit")
+    llm = results.get("llm")
+    if llm:
+        click.echo(f"🎭 LLM stand-in: {llm['requests']} calls, {llm['errors']} scripted errors, "
+                   f"max {llm['max_in_flight']} in flight")
+
+
+@click.command()
+@click.option('--url', help='Target an already running API instead of starting one.')
+@click.option('--workers', default=1, show_default=True, help='Worker processes for the API started here.')
+@click.option('--rps', default=10.0, show_default=True, help='Arrival rate (requests/s); 0 runs closed loop.')
+@click.option('--concurrency', default=16, show_default=True, help='Max requests in flight.')
+@click.option('--duration', default=20.0, show_default=True, help='Seconds of traffic.')
+@click.option('--keys', default=4, show_default=True, help='Pro keys to register and spread heals over.')
+@click.option('--free-keys', default=2, show_default=True, help='Free keys, which run into their quota.')
+@click.option('--history-share', default=0.2, show_default=True, help='Share of requests that read /api/history.')
+@click.option('--llm-latency', default=0.5, show_default=True, help='Mean stand-in completion latency (s).')
+@click.option('--llm-jitter', default=0.2, show_default=True, help='Stand-in latency varies by +/- this much.')
+@click.option('--llm-error-rate', default=0.0, show_default=True, help='Share of completions the stand-in fails.')
+@click.option('--llm-error-status', default=500, show_default=True, help='HTTP status of scripted failures (e.g. 429).')
+@click.option('--standin-url', help='Stand-in already serving --url (its script is replaced with the --llm-* settings).')
+@click.option('--repeat-payloads', is_flag=True, help='Send identical failures (exercises the cache and coalescing).')
+@click.option('--local-healers', is_flag=True, help='Keep heuristics and the locator knowledge base on.')
+@click.option('--seed', type=int, help='Seed for reproducible traffic and stand-in behavior.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Where to write the JSON results.')
+def main(url, workers, rps, concurrency, duration, keys, free_keys, history_share, llm_latency, llm_jitter,
+         llm_error_rate, llm_error_status, standin_url, repeat_payloads, local_healers, seed, output):
+    """Load-tests the DeFlake API against a scripted LLM stand-in."""
+    import httpx
+    from core.llm_standin import Script, serve
+
+    if keys + free_keys < 1:
+        raise click.UsageError("Register at least one key (--keys / --free-keys).")
+    payloads = build_payloads()
+    if not payloads:
+        raise click.ClickException("No artifacts found in demo-project/ or deflake_context/.")
+    script = {"latency": llm_latency, "jitter": llm_jitter, "error_rate": llm_error_rate,
+              "error_status": llm_error_status, "seed": seed}
+
+    workdir = tempfile.mkdtemp(prefix="deflake-load-")
+    standin, server = None, None
+    try:
+        if standin_url:
+            httpx.post(f"{standin_url}/_script", json=script).raise_for_status()
+        elif not url:
+            standin = serve(port=0, script=Script.from_dict(script))
+            standin_url = f"http://127.0.0.1:{standin.server_address[1]}"
+        if not url:
+            click.echo(f"🚀 Starting the API ({workers} worker(s)) against the stand-in at {standin_url}")
+            server = LocalServer(workdir, standin_url, workers, local_healers)
+            server.wait_ready()
+            url = server.url
+
+        click.echo(f"🔥 {duration:g} s of traffic on {url}: {len(payloads)} payloads, "
+                   f"{keys} pro + {free_keys} free key(s), concurrency {concurrency}")
+        run = LoadRun(url.rstrip("/"), payloads, concurrency, history_share, not repeat_payloads, seed)
+        elapsed = asyncio.run(run.run(keys, free_keys, rps, duration))
+        results = run.report(elapsed)
+        if standin is not None:
+            results["llm"] = dict(standin.stats)
+        elif standin_url:
+            results["llm"] = httpx.get(f"{standin_url}/_stats").json()
+    finally:
+        if server is not None:
+            server.stop()
+        if standin is not None:
+            standin.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results["meta"] = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"url": url if server is None else "local", "workers": workers, "rps": rps,
+                     "concurrency": concurrency, "duration": duration, "llm": script,
+                     "unique_payloads": not repeat_payloads, "local_healers": local_healers},
+    }
+    print_report(results, rps)
+
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"load-{results['meta']['timestamp'].replace(':', '')}-{results['meta']['commit']}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    click.echo(f"📊 Results written to {output}")
+    if results["quota"]["problems"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,56 @@
 import os
-from bs4 import BeautifulSoup
 
-import re
+from core.artifact_store import read_text
+from core.dom_pruner import DomPruner
+from core.scanner import locate
 
 class ErrorAnalyzer:
     def __init__(self, log_path: str, html_path: str):
         self.log_path = log_path
         self.html_path = html_path
 
+    @classmethod
+    def from_store(cls, store, artifact_id: str):
+        """Analyzer for a failure recorded in an ArtifactStore (reads its blobs directly)."""
+        entry = store.get(artifact_id)
+        if entry is None:
+            raise FileNotFoundError(f"Artifact not found: {artifact_id}")
+        return cls(entry["log_path"], entry["html_path"])
+
     def read_log(self) -> str:
         """Reads the error log file."""
         if not os.path.exists(self.log_path):
             raise FileNotFoundError(f"Log file not found: {self.log_path}")
-        with open(self.log_path, 'r') as f:
-            return f.read()
+        return read_text(self.log_path)
 
     def read_html(self, max_length: int = 8000) -> str:
-        """Reads and optionally truncates/cleans the HTML file."""
+        """
+        Reads the HTML snapshot and prunes it down to ~max_length chars.
+        Scripts, styles and attribute noise are dropped, and on large pages only
+        the regions around the selector/text from the error log are kept.
+        """
         if not os.path.exists(self.html_path):
             raise FileNotFoundError(f"HTML file not found: {self.html_path}")
         
-        with open(self.html_path, 'r') as f:
-            content = f.read()
-        
-        # Simple parsing to verify it's HTML, maybe strip scripts later
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # For now, just return the string, maybe truncated if it's massive
-        # In a real app, we'd remove <script>, <style> to save tokens
-        text_content = str(soup)
-        if len(text_content) > max_length:
-            return text_content[:max_length] + "...[TRUNCATED]"
-        return text_content
+        # Store blobs are gzipped; big plain files are mmapped
+        content = read_text(self.html_path)
+
+        error_log = self.read_log() if os.path.exists(self.log_path) else ""
+        pruner = DomPruner(max_tokens=max_length // DomPruner.CHARS_PER_TOKEN)
+        return pruner.prune(content, error_log)
+
+    def read_snapshot(self) -> str:
+        """The full, unpruned HTML snapshot (what fixes are validated against)."""
+        if not os.path.exists(self.html_path):
+            raise FileNotFoundError(f"HTML file not found: {self.html_path}")
+        return read_text(self.html_path)
 
     def extract_location(self) -> tuple[str, int]:
         """
-        Parses the log file to find 'Location: /path/to/file.py:42'
+        Finds where the failure happened: a 'Location: /path/to/file.py:42' line, or the innermost
+        user frame of a Playwright / Cypress / WebdriverIO stack or Python traceback (see core/scanner.py).
         Returns (file_path, line_number) or (None, None)
         """
-        content = self.read_log()
-        match = re.search(r"Location: (.+):(\d+)", content)
-        if match:
-            return match.group(1), int(match.group(2))
-        return None, None
+        if not os.path.exists(self.log_path):
+            raise FileNotFoundError(f"Log file not found: {self.log_path}")
+        return locate(self.log_path)
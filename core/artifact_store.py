@@ -0,0 +1,267 @@
+import glob
+import gzip
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+import click
+
+# Retention defaults for deflake_context/; 0 disables a limit
+MAX_AGE_DAYS = float(os.getenv("DEFLAKE_ARTIFACT_MAX_AGE_DAYS", 30))
+MAX_COUNT = int(os.getenv("DEFLAKE_ARTIFACT_MAX_COUNT", 2000))
+MAX_BYTES = int(os.getenv("DEFLAKE_ARTIFACT_MAX_BYTES", 500 * 1024 * 1024))
+# gzip level for stored blobs; HTML compresses ~10x already at the low levels
+COMPRESS_LEVEL = int(os.getenv("DEFLAKE_SNAPSHOT_COMPRESSLEVEL", 6))
+# Plain files at least this big are read through mmap instead of buffered reads
+MMAP_THRESHOLD = 1024 * 1024
+
+MANIFEST = "manifest.db"
+OBJECTS_DIR = "objects"
+
+
+def read_text(path: str) -> str:
+    """
+    Reads an artifact (blob or loose file), decompressing `.gz` files.
+    Large files are mapped rather than read, so the only full copy made is the decoded text.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ""
+        if path.endswith(".gz") or size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data = gzip.decompress(mapped) if path.endswith(".gz") else memoryview(mapped)
+                try:
+                    return str(data, "utf-8", "replace")
+                finally:
+                    if isinstance(data, memoryview):
+                        data.release()
+        return f.read().decode("utf-8", "replace")
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for failure artifacts under deflake_context/.
+    Logs and snapshots are gzipped blobs named by the sha256 of their content
+    (objects/<sha256>.<kind>.gz), so a DOM captured by fifty failures is stored once.
+    manifest.db maps each failure to its blobs and drives retention.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.objects = os.path.join(directory, OBJECTS_DIR)
+        os.makedirs(self.objects, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS artifacts (
+                id TEXT PRIMARY KEY,
+                test_id TEXT,
+                log_blob TEXT NOT NULL,
+                html_blob TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                raw_size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_artifacts_created ON artifacts (created_at);
+            CREATE INDEX IF NOT EXISTS idx_artifacts_log ON artifacts (log_blob);
+            CREATE INDEX IF NOT EXISTS idx_artifacts_html ON artifacts (html_blob);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, MANIFEST), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, name: str) -> str:
+        return os.path.join(self.objects, name)
+
+    def put_blob(self, content: str, kind: str) -> tuple:
+        """Stores `content` once; returns (blob name, True if it was already stored)."""
+        raw = content.encode("utf-8", "replace")
+        name = f"{hashlib.sha256(raw).hexdigest()}.{kind}.gz"
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM blobs WHERE name=?", (name,)).fetchone():
+            return name, True
+        path = self.blob_path(name)
+        if not os.path.exists(path):
+            _write_atomic(path, gzip.compress(raw, COMPRESS_LEVEL, mtime=0))
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (name, size, raw_size, created_at) VALUES (?, ?, ?, ?)",
+                (name, os.path.getsize(path), len(raw), time.time()),
+            )
+        return name, False
+
+    def put(self, artifact_id: str, log_content: str, html_content: str, test_id: str = None,
+            created_at: float = None) -> dict:
+        """Records one failure; returns its manifest entry (with paths and whether the snapshot was a duplicate)."""
+        log_blob, _ = self.put_blob(log_content, "log")
+        html_blob, duplicate = self.put_blob(html_content, "html")
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (id, test_id, log_blob, html_blob, created_at) VALUES (?, ?, ?, ?, ?)",
+                (artifact_id, test_id, log_blob, html_blob, created_at or time.time()),
+            )
+        entry = self.get(artifact_id)
+        entry["duplicate"] = duplicate
+        return entry
+
+    def get(self, artifact_id: str) -> dict:
+        row = self._conn().execute("SELECT * FROM artifacts WHERE id=?", (artifact_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["log_path"] = self.blob_path(entry["log_blob"])
+        entry["html_path"] = self.blob_path(entry["html_blob"])
+        return entry
+
+    def list(self) -> list:
+        """Every recorded failure, oldest first."""
+        rows = self._conn().execute("SELECT id FROM artifacts ORDER BY created_at, id").fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def read_log(self, artifact_id: str) -> str:
+        return read_text(self.get(artifact_id)["log_path"])
+
+    def read_html(self, artifact_id: str) -> str:
+        return read_text(self.get(artifact_id)["html_path"])
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        artifacts = conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+        blobs, stored, raw = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM blobs").fetchone()
+        logical = conn.execute(
+            "SELECT COALESCE(SUM(b.raw_size), 0) FROM artifacts a JOIN blobs b ON b.name IN (a.log_blob, a.html_blob)"
+        ).fetchone()[0]
+        return {"artifacts": artifacts, "blobs": blobs, "stored_bytes": stored, "raw_bytes": raw, "logical_bytes": logical}
+
+    def enforce_retention(self, max_age_days: float = MAX_AGE_DAYS, max_count: int = MAX_COUNT,
+                          max_bytes: int = MAX_BYTES) -> dict:
+        """
+        Drops the oldest failures until age, count and stored size are within limits,
+        then deletes blobs no remaining failure points to.
+        """
+        conn = self._conn()
+        removed = 0
+        with conn:
+            if max_age_days:
+                removed += conn.execute(
+                    "DELETE FROM artifacts WHERE created_at < ?", (time.time() - max_age_days * 86400,)
+                ).rowcount
+            if max_count:
+                removed += conn.execute(
+                    "DELETE FROM artifacts WHERE id IN (SELECT id FROM artifacts ORDER BY created_at DESC, id DESC LIMIT -1 OFFSET ?)",
+                    (max_count,),
+                ).rowcount
+        freed = self.collect_garbage()
+        if max_bytes:
+            # Size is only known per blob (shared ones count once), so trim oldest-first until it fits
+            while self.stats()["stored_bytes"] > max_bytes:
+                oldest = conn.execute("SELECT id FROM artifacts ORDER BY created_at, id LIMIT 16").fetchall()
+                if not oldest:
+                    break
+                with conn:
+                    conn.executemany("DELETE FROM artifacts WHERE id=?", [(row["id"],) for row in oldest])
+                removed += len(oldest)
+                freed += self.collect_garbage()
+        return {"removed": removed, "freed_bytes": freed}
+
+    def collect_garbage(self) -> int:
+        """Deletes unreferenced blobs and leftover temp files; returns bytes freed."""
+        conn = self._conn()
+        orphans = conn.execute(
+            "SELECT name, size FROM blobs WHERE name NOT IN (SELECT log_blob FROM artifacts) "
+            "AND name NOT IN (SELECT html_blob FROM artifacts)"
+        ).fetchall()
+        freed = 0
+        with conn:
+            for row in orphans:
+                try:
+                    os.remove(self.blob_path(row["name"]))
+                except FileNotFoundError:
+                    pass
+                freed += row["size"]
+                conn.execute("DELETE FROM blobs WHERE name=?", (row["name"],))
+        known = {row["name"] for row in conn.execute("SELECT name FROM blobs")}
+        cutoff = time.time() - 3600
+        for path in glob.glob(os.path.join(self.objects, "*")):
+            name = os.path.basename(path)
+            # Temp files from interrupted writes, and files no manifest entry knows about
+            if name not in known and os.path.getmtime(path) < cutoff:
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+    def import_loose(self) -> int:
+        """Moves loose error_<id>.log + snapshot_<id>.html[.gz] pairs into the store."""
+        from core.batch import find_loose_artifacts
+
+        imported = 0
+        for stem, log_path, html_path in find_loose_artifacts(self.directory):
+            artifact_id = stem[len("error_"):] if stem.startswith("error_") else stem
+            self.put(artifact_id, read_text(log_path), read_text(html_path), created_at=os.path.getmtime(log_path))
+            os.remove(log_path)
+            os.remove(html_path)
+            imported += 1
+        return imported
+
+    def compact(self, **limits) -> dict:
+        """Imports loose files, applies retention, drops orphans and shrinks the manifest."""
+        imported = self.import_loose()
+        result = self.enforce_retention(**limits)
+        conn = self._conn()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        return {"imported": imported, **result}
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+@click.command()
+@click.argument('directory', type=click.Path(file_okay=False), default="deflake_context")
+@click.option('--max-age-days', type=float, default=MAX_AGE_DAYS, show_default=True, help='Drop failures older than this (0 = keep).')
+@click.option('--max-count', type=int, default=MAX_COUNT, show_default=True, help='Keep at most this many failures (0 = no limit).')
+@click.option('--max-bytes', type=int, default=MAX_BYTES, show_default=True, help='Keep stored blobs under this many bytes (0 = no limit).')
+@click.option('--stats', 'stats_only', is_flag=True, help='Only report what the store holds.')
+def main(directory, max_age_days, max_count, max_bytes, stats_only):
+    """
+    Compacts a deflake_context/ directory: imports loose artifacts into the
+    content-addressed store and applies the retention limits.
+    """
+    store = ArtifactStore(directory)
+    if not stats_only:
+        result = store.compact(max_age_days=max_age_days, max_count=max_count, max_bytes=max_bytes)
+        click.echo(f"🧹 Imported {result['imported']} loose failure(s), removed {result['removed']}, "
+                   f"freed {_format_bytes(result['freed_bytes'])}.")
+    stats = store.stats()
+    click.echo(f"📦 {stats['artifacts']} failure(s) in {stats['blobs']} blob(s): "
+               f"{_format_bytes(stats['stored_bytes'])} on disk for {_format_bytes(stats['logical_bytes'])} of artifacts.")
+
+
+if __name__ == '__main__':
+    main()
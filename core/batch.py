@@ -0,0 +1,135 @@
+import glob
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.cache import fingerprint
+from core.cluster import cluster_failures
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for 429s coming back from the provider (openai.RateLimitError or anything that looks like it)."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    text = str(error).lower()
+    return "429" in text or "rate limit" in text or "ratelimit" in type(error).__name__.lower()
+
+
+def heal_with_backoff(client, item: dict, max_retries: int = 4, base_delay: float = 1.0):
+    """Calls client.heal, retrying rate-limited calls with exponential backoff and jitter."""
+    attempt = 0
+    while True:
+        try:
+            return client.heal(
+                item["error_log"],
+                item["html_snapshot"],
+                item.get("failing_line"),
+                item.get("source_code"),
+                test_file=item.get("test_file"),
+                tenant=item.get("tenant", ""),
+            )
+        except Exception as e:
+            if attempt >= max_retries or not is_rate_limited(e):
+                raise
+            delay = base_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+
+
+def group_failures(items: list, cluster: bool = True) -> dict:
+    """
+    {representative fingerprint: {"item": representative, "ids": [item ids]}}.
+    With `cluster`, failures sharing a root cause (see core/cluster.py) form one group;
+    otherwise only identical failures (same fingerprint) do.
+    """
+    ids = [item.get("id") or str(index) for index, item in enumerate(items)]
+    if cluster:
+        clusters = cluster_failures(items)
+    else:
+        by_key = {}
+        for index, item in enumerate(items):
+            key = fingerprint(item["error_log"], item["html_snapshot"], item.get("failing_line"), item.get("source_code"))
+            by_key.setdefault(key, []).append(index)
+        clusters = list(by_key.values())
+
+    groups = {}
+    for members in clusters:
+        item = items[members[0]]
+        key = fingerprint(item["error_log"], item["html_snapshot"], item.get("failing_line"), item.get("source_code"))
+        groups[key] = {"item": item, "ids": [ids[index] for index in members]}
+    return groups
+
+
+def heal_batch(client, items: list, concurrency: int = 8, max_retries: int = 4, base_delay: float = 1.0,
+               cluster: bool = True):
+    """
+    Heals many failures at once and yields one result dict per item as soon as it is ready.
+
+    Items are dicts with error_log, html_snapshot and optional id, failing_line, source_code.
+    Failures with the same root cause are sent to the LLM once and the fix is
+    reported for every member of the cluster. At most `concurrency` LLM calls run at a time.
+    """
+    groups = group_failures(items, cluster)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(heal_with_backoff, client, group["item"], max_retries, base_delay): key
+            for key, group in groups.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            ids = groups[key]["ids"]
+            try:
+                result = {"status": "success", "fix": future.result()}
+            except Exception as e:
+                result = {"status": "error", "fix": str(e)}
+            for position, item_id in enumerate(ids):
+                yield {
+                    "id": item_id,
+                    "fingerprint": key,
+                    "duplicate_of": ids[0] if position else None,
+                    "cluster_size": len(ids),
+                    **result,
+                }
+
+
+def to_ndjson(result: dict) -> str:
+    """One NDJSON line; a FixResult goes out in its compact JSON form (a string, as before)."""
+    return json.dumps({**result, "fix": str(result["fix"])}) + "\n"
+
+
+def find_batch_artifacts(directory: str) -> list:
+    """
+    Every failure in `directory`: those recorded in its artifact store (manifest.db),
+    then loose log/snapshot pairs.
+    """
+    from core.artifact_store import ArtifactStore, MANIFEST
+
+    pairs = []
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        pairs.extend((entry["id"], entry["log_path"], entry["html_path"]) for entry in ArtifactStore(directory).list())
+    return pairs + find_loose_artifacts(directory)
+
+
+def find_loose_artifacts(directory: str) -> list:
+    """
+    Pairs every log in `directory` with its HTML snapshot.
+    Understands the plugin naming (error_<id>.log + snapshot_<id>.html[.gz])
+    as well as plain <name>.log + <name>.html.
+    """
+    pairs = []
+    for log_path in sorted(glob.glob(os.path.join(directory, "*.log"))):
+        stem = os.path.splitext(os.path.basename(log_path))[0]
+        candidates = [f"{stem}.html"]
+        if stem.startswith("error_"):
+            snapshot = f"snapshot_{stem[len('error_'):]}"
+            candidates[:0] = [f"{snapshot}.html.gz", f"{snapshot}.html"]
+        for candidate in candidates:
+            html_path = os.path.join(directory, candidate)
+            if os.path.exists(html_path):
+                pairs.append((stem, log_path, html_path))
+                break
+    return pairs
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Noise that differs between retries of the *same* failure and must not
+# change the fingerprint (ANSI colours, timeouts, dynamic ids, timestamps).
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+TIMEOUT_RE = re.compile(r"\b\d+\s*ms\b")
+HEX_RE = re.compile(r"\b[0-9a-f]{8,}(?:-[0-9a-f]{4,})*\b", re.IGNORECASE)
+NUMBER_RE = re.compile(r"\b\d{6,}\b")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    if not text:
+        return ""
+    text = ANSI_RE.sub("", text)
+    text = TIMEOUT_RE.sub("<ms>", text)
+    text = HEX_RE.sub("<hex>", text)
+    text = NUMBER_RE.sub("<n>", text)
+    return WHITESPACE_RE.sub(" ", text).strip()
+
+
+def fingerprint(error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None) -> str:
+    """
+    Builds a content address for a failure out of
+    (error message, failing line, DOM region, source hash).
+    Two retries of the same broken locator map to the same key.
+    """
+    source_hash = hashlib.sha256((source_code or "").encode()).hexdigest()
+    parts = [
+        normalize_text(error_log),
+        normalize_text(failing_line),
+        WHITESPACE_RE.sub(" ", html_snapshot or "").strip(),
+        source_hash,
+    ]
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            fix, stored_at = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return fix
+
+    def set(self, key: str, fix: str):
+        with self._lock:
+            self._entries[key] = (fix, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """On-disk cache, shared between CLI runs and server restarts."""
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS fixes (
+                                key TEXT PRIMARY KEY,
+                                fix TEXT,
+                                stored_at REAL
+                            )''')
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT fix, stored_at FROM fixes WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            fix, stored_at = row
+            if self.ttl and time.time() - stored_at > self.ttl:
+                self._conn.execute("DELETE FROM fixes WHERE key=?", (key,))
+                self._conn.commit()
+                return None
+            return fix
+
+    def set(self, key: str, fix: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO fixes VALUES (?, ?, ?)", (key, fix, time.time()))
+            self._conn.commit()
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM fixes WHERE key=?", (key,))
+            self._conn.commit()
+            return cur.rowcount > 0
+
+    def clear(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM fixes")
+            self._conn.commit()
+            return cur.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+
+
+class FixCache:
+    """
+    Content-addressed fix cache that sits in front of LLMClient.heal.
+    The backend only needs get/set/delete/clear, so anything dict-like can be plugged in.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None) -> str:
+        return fingerprint(error_log, html_snapshot, failing_line, source_code)
+
+    def get(self, key: str):
+        fix = self.backend.get(key)
+        if fix is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return fix
+
+    def set(self, key: str, fix: str):
+        if fix:
+            self.backend.set(key, fix)
+
+    def invalidate(self, key: str = None) -> int:
+        """Drops a single fingerprint, or the whole cache when no key is given."""
+        if key is None:
+            return self.backend.clear()
+        return 1 if self.backend.delete(key) else 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_from_env(default_path: str = None) -> FixCache:
+    """
+    Builds a FixCache from DEFLAKE_CACHE_BACKEND (memory | sqlite | off),
+    DEFLAKE_CACHE_TTL and DEFLAKE_CACHE_PATH. Returns None when disabled.
+    """
+    backend = os.getenv("DEFLAKE_CACHE_BACKEND", "memory").lower()
+    if backend in ("off", "none", "0"):
+        return None
+
+    ttl = float(os.getenv("DEFLAKE_CACHE_TTL", 3600))
+    if backend == "sqlite":
+        path = os.getenv("DEFLAKE_CACHE_PATH", default_path or ".deflake_cache.db")
+        return FixCache(SQLiteBackend(path, ttl=ttl))
+    return FixCache(MemoryBackend(max_entries=int(os.getenv("DEFLAKE_CACHE_SIZE", 1024)), ttl=ttl))
@@ -0,0 +1,72 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from core.artifact_store import ArtifactStore
+
+# Captures waiting for the writer; past this, capture() blocks instead of growing memory
+MAX_PENDING = int(os.getenv("DEFLAKE_CAPTURE_QUEUE", 64))
+
+_sequence = itertools.count(1)
+
+
+def artifact_id() -> str:
+    """Unique per failure, across xdist workers and machines, and still sortable by time."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sequence)}-{uuid.uuid4().hex[:6]}"
+
+
+class ArtifactWriter:
+    """
+    Writes failure artifacts from a background thread so tests don't wait on disk.
+    Hashing, compression and the manifest update all happen in the ArtifactStore on that thread.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.store = None
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.deduped = 0
+
+    def capture(self, log_content: str, html_content: str, test_id: str = None) -> tuple:
+        """
+        Queues one failure's artifacts and returns (artifact id, future) right away.
+        The future resolves to the manifest entry (log_path, html_path, ...) once stored.
+        """
+        name = artifact_id()
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((name, log_content, html_content, test_id, future))
+        return name, future
+
+    def flush(self):
+        """Blocks until everything captured so far is written."""
+        self._queue.join()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deflake-capture", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            name, log_content, html_content, test_id, future = self._queue.get()
+            try:
+                if self.store is None:
+                    # The store (and its SQLite connection) belongs to the writer thread
+                    self.store = ArtifactStore(self.directory)
+                entry = self.store.put(name, log_content, html_content, test_id)
+                if entry["duplicate"]:
+                    # Same page as an earlier failure: not compressed or written again
+                    self.deduped += 1
+                future.set_result(entry)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
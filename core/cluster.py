@@ -0,0 +1,121 @@
+import hashlib
+import os
+import random
+import re
+
+from core.cache import fingerprint, normalize_text
+from core.dom_pruner import extract_hints
+
+# Two failures in the same location/error block are one root cause if their DOMs are at least this similar
+SIMILARITY_THRESHOLD = float(os.getenv("DEFLAKE_CLUSTER_SIMILARITY", 0.8))
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1729)  # fixed seed: signatures must be comparable across processes
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+LOCATION_RE = re.compile(r"Location: (.+?):(\d+)")
+STACK_FRAME_RE = re.compile(r"at\s+(?:.*? \()?((?:[a-zA-Z]:\\|[/~]|\.?\.?/)[^\s():]+):(\d+)(?::\d+)?\)?")
+ERROR_TYPE_RE = re.compile(r"\b(\w*(?:Error|Exception))\b")
+TAG_RE = re.compile(r"<([a-zA-Z][\w-]*)([^>]*)>")
+ATTR_RE = re.compile(r"\b(id|class|name|role|type|data-testid)=\"([^\"]*)\"")
+DIGITS_RE = re.compile(r"\d+")
+
+
+def failure_location(error_log: str) -> str:
+    """Normalized file:line the failure points at (plugin 'Location:' line or the first user stack frame)."""
+    match = LOCATION_RE.search(error_log or "")
+    if not match:
+        for frame in STACK_FRAME_RE.finditer(error_log or ""):
+            if "node_modules" not in frame.group(1):
+                match = frame
+                break
+    if not match:
+        return ""
+    return f"{os.path.normpath(match.group(1))}:{match.group(2)}"
+
+
+def error_signature(error_log: str) -> str:
+    """
+    Error type plus the selectors/texts the step was waiting for.
+    The rest of the message (test names, timings, test data) varies between members of one root cause.
+    """
+    types = [t for t in ERROR_TYPE_RE.findall(error_log or "") if t != "Error"]
+    hints = sorted(extract_hints(error_log))
+    if not types and not hints:
+        # Nothing structured to go on: fall back to the normalized first line
+        return normalize_text((error_log or "").strip().split("\n")[0])
+    return "\x00".join((types[:1] or ["Error"]) + hints)
+
+
+def code_key(item: dict) -> str:
+    """
+    Short hash of the code that failed: the failing line (whitespace-normalized), else the source
+    sent with it. Literals are kept as they are, since "#item-1" and "#item-2" need different fixes.
+    """
+    code = " ".join((item.get("failing_line") or item.get("source_code") or "").split())
+    return hashlib.sha256(code.encode()).hexdigest()[:16] if code else ""
+
+
+def dom_shingles(html: str) -> set:
+    """Overlapping runs of tags (with their identifying attributes, digits masked) from the snapshot."""
+    tokens = []
+    for tag, attrs in TAG_RE.findall(html or ""):
+        identity = " ".join(f"{k}={DIGITS_RE.sub('0', v)}" for k, v in ATTR_RE.findall(attrs))
+        tokens.append(f"{tag.lower()} {identity}")
+    if len(tokens) < SHINGLE_SIZE:
+        return {"\x00".join(tokens)} if tokens else set()
+    return {"\x00".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingles: set) -> tuple:
+    """MinHash signature; the share of equal positions estimates the Jaccard similarity of two shingle sets."""
+    if not shingles:
+        return ()
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(a: tuple, b: tuple) -> float:
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def cluster_failures(items: list, threshold: float = SIMILARITY_THRESHOLD) -> list:
+    """
+    Groups failures that share a root cause: same normalized stack location, failing code and
+    error signature, and near-identical DOMs (MinHash over tag shingles).
+    Returns clusters as lists of item indexes; the first index is the representative.
+    """
+    blocks = {}
+    for index, item in enumerate(items):
+        error_log = item["error_log"]
+        # One location can hold different code (other branches, other checkouts): one fix can't serve both
+        key = (failure_location(error_log), code_key(item), error_signature(error_log))
+        blocks.setdefault(key, []).append(index)
+
+    clusters = []
+    for indexes in blocks.values():
+        exact = {}
+        block_clusters = []  # [(signature, [indexes])]
+        for index in indexes:
+            item = items[index]
+            key = fingerprint(item["error_log"], item["html_snapshot"], item.get("failing_line"), item.get("source_code"))
+            if key in exact:
+                exact[key].append(index)
+                continue
+            signature = minhash(dom_shingles(item["html_snapshot"]))
+            for leader_signature, members in block_clusters:
+                if similarity(signature, leader_signature) >= threshold:
+                    members.append(index)
+                    exact[key] = members
+                    break
+            else:
+                members = [index]
+                block_clusters.append((signature, members))
+                exact[key] = members
+        clusters.extend(members for _, members in block_clusters)
+    clusters.sort(key=lambda members: members[0])
+    return clusters
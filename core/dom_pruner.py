@@ -0,0 +1,492 @@
+import codecs
+import re
+from html import escape
+from html.parser import HTMLParser
+
+_etree = None
+
+def get_etree():
+    """lxml is optional (the stdlib tokenizer is the fallback) and only imported on first parse."""
+    global _etree
+    if _etree is None:
+        try:
+            from lxml import etree
+            _etree = etree
+        except ImportError:
+            _etree = False
+    return _etree or None
+
+# Tags that never help the LLM find an element. Their content is dropped while parsing.
+DROP_TAGS = {"script", "style", "svg", "noscript", "template", "link", "meta", "iframe", "canvas", "path"}
+# With raw=True (selector evaluation) only content that is never rendered is dropped
+RAW_DROP_TAGS = {"script", "style", "noscript", "template"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+INTERACTIVE_TAGS = {"a", "button", "input", "select", "textarea", "label", "option", "summary"}
+
+# Attributes worth keeping: everything a stable selector could be built from.
+KEEP_ATTRS = {
+    "id", "class", "name", "type", "role", "href", "value", "placeholder", "title", "alt", "for",
+    "aria-label", "aria-labelledby", "aria-hidden", "hidden", "disabled", "checked", "selected",
+    "data-testid", "data-test", "data-test-id", "data-cy", "data-qa",
+}
+# Inline styles are noise, except the bits that explain why an element can't be hit.
+VISIBILITY_STYLE_RE = re.compile(r"(?:display|visibility|z-index|opacity|pointer-events)\s*:\s*[^;]+", re.IGNORECASE)
+MAX_ATTR_LENGTH = 80
+
+# Patterns that pull the failing selector / expected text out of framework logs
+HINT_PATTERNS = [
+    re.compile(r"locator\((['\"`])(.+?)\1"),
+    re.compile(r"(?:click|fill|type|check|hover|press|tap|waitForSelector|querySelector|\$|get|find|contains|"
+               r"getByText|getByRole|getByTestId|getByLabel|getByPlaceholder|find_element)\(\s*(['\"`])(.+?)\1"),
+    re.compile(r"toHaveText\(\s*(['\"`])(.+?)\1"),
+    re.compile(r"\"selector\"\s*:\s*(\")(.+?)\1"),
+    re.compile(r"Expected (?:string|substring|pattern): (['\"])(.+?)\1"),
+]
+TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z0-9]{2,}")
+STOP_TOKENS = {"text", "has", "nth", "child", "not", "visible", "the", "and", "css", "xpath", "page", "old", "new", "legacy"}
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def extract_hints(error_log: str) -> list:
+    """Returns the raw selectors / texts the failing step was looking for."""
+    hints = []
+    for pattern in HINT_PATTERNS:
+        for match in pattern.finditer(error_log or ""):
+            value = match.group(2).strip()
+            if value and value not in hints:
+                hints.append(value)
+    return hints
+
+
+def hint_tokens(hints: list) -> set:
+    tokens = set()
+    for hint in hints:
+        for token in TOKEN_RE.findall(hint):
+            for part in re.split(r"[_\-]", token):
+                part = part.lower()
+                if len(part) >= 3 and part not in STOP_TOKENS:
+                    tokens.add(part)
+    return tokens
+
+
+class Node:
+    __slots__ = ("tag", "attrs", "children", "parent", "index")
+
+    def __init__(self, tag, attrs, parent, index):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+        self.parent = parent
+        self.index = index
+
+    def signature(self) -> str:
+        """Lowercased text the relevance scoring matches hint tokens against."""
+        own_text = " ".join(c for c in self.children if isinstance(c, str))
+        return f"{self.tag} {' '.join(self.attrs.values())} {own_text}".lower()
+
+
+def _clean_attrs(attrs) -> dict:
+    cleaned = {}
+    for key, value in attrs:
+        key = key.lower()
+        value = value if value is not None else ""
+        if key == "style":
+            visibility = "; ".join(m.group(0).strip() for m in VISIBILITY_STYLE_RE.finditer(value))
+            if visibility:
+                cleaned["style"] = visibility
+            continue
+        if key not in KEEP_ATTRS:
+            continue
+        value = WHITESPACE_RE.sub(" ", value).strip()
+        if len(value) > MAX_ATTR_LENGTH:
+            value = value[:MAX_ATTR_LENGTH] + "…"
+        cleaned[key] = value
+    return cleaned
+
+
+class _TreeBuilder:
+    """
+    Parser target shared by lxml and the stdlib tokenizer.
+    Junk subtrees are skipped while streaming, so they never hit memory.
+    """
+
+    def __init__(self, max_nodes: int, raw: bool = False, tokens: set = None):
+        self.root = Node("#root", {}, None, 0)
+        # raw: keep every attribute verbatim, so selectors evaluate as they would in the browser
+        self.raw = raw
+        self.drop_tags = RAW_DROP_TAGS if raw else DROP_TAGS
+        self.current = self.root
+        self.nodes = []
+        self.max_nodes = max_nodes
+        # Hint tokens of the failure: past max_nodes only elements matching them are materialized
+        self.tokens = tokens
+        # Elements opened past max_nodes, innermost last: a Node if materialized, else (tag, attrs)
+        self.beyond = []
+        self.skip_depth = 0
+        self.count = 0
+        self.compacted = False
+        # Streaming mode: on_full(builder) is called whenever len(nodes) reaches compact_at
+        self.compact_at = None
+        self.on_full = None
+
+    def start(self, tag, attrs):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if self.skip_depth or tag in self.drop_tags or not tag:
+            if tag not in VOID_TAGS:
+                self.skip_depth += 1
+            return
+        if len(self.nodes) >= self.max_nodes and not self.tokens:
+            # Bounded work on huge DOMs: stop materializing, keep what we have
+            self.skip_depth += 0 if tag in VOID_TAGS else 1
+            return
+        attrs = attrs.items() if hasattr(attrs, "items") else attrs
+        if len(self.nodes) >= self.max_nodes:
+            # Past the cap the scan goes on, but only elements the failure points at are kept
+            # (the one it needs may come after thousands of table rows)
+            signature = f"{tag} {' '.join(value or '' for _, value in attrs)}".lower()
+            if any(token in signature for token in self.tokens):
+                node = self._add(tag, self._attrs(attrs))
+                if tag not in VOID_TAGS:
+                    self.beyond.append(node)
+            elif tag not in VOID_TAGS:
+                self.beyond.append((tag, list(attrs)))
+            return
+        self._add(tag, self._attrs(attrs))
+
+    def _attrs(self, attrs) -> dict:
+        return {key.lower(): value or "" for key, value in attrs} if self.raw else _clean_attrs(attrs)
+
+    def _add(self, tag, attrs) -> Node:
+        self.count += 1
+        node = Node(tag, attrs, self.current, self.count)
+        self.current.children.append(node)
+        self.nodes.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+        if self.compact_at and len(self.nodes) >= self.compact_at:
+            self.on_full(self)
+        return node
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in VOID_TAGS:
+            return
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        if self.beyond:
+            if self._end_beyond(tag):
+                return
+            # Closes an element opened before the cap, and with it everything opened since
+            self.beyond = []
+        # Tolerate sloppy markup: close up to the matching open tag, ignore stray end tags
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def _end_beyond(self, tag) -> bool:
+        """Closes an element opened past the cap; False if `tag` wasn't opened there."""
+        for position in range(len(self.beyond) - 1, -1, -1):
+            entry = self.beyond[position]
+            if (entry.tag if isinstance(entry, Node) else entry[0]) == tag:
+                closed = self.beyond[position:]
+                del self.beyond[position:]
+                materialized = [entry for entry in closed if isinstance(entry, Node)]
+                if materialized:
+                    self.current = materialized[0].parent
+                return True
+        return False
+
+    def data(self, text):
+        if self.skip_depth:
+            return
+        text = WHITESPACE_RE.sub(" ", text)
+        if not text.strip():
+            return
+        if self.beyond and not isinstance(self.beyond[-1], Node):
+            # Past the cap, text only counts if it names what the failure is looking for
+            lowered = text.lower()
+            if not any(token in lowered for token in self.tokens):
+                return
+            tag, attrs = self.beyond[-1]
+            self.beyond[-1] = self._add(tag, self._attrs(attrs))
+        self.current.children.append(text)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return self.root
+
+    def retain(self, protected: set):
+        """
+        Drops every closed subtree that is neither inside a `protected` node (by id) nor
+        an ancestor of one. Elements that are still open always stay.
+        """
+        needed = set()
+        starts = [node for node in self.nodes if id(node) in protected] + [self.current]
+        for node in starts:
+            while node is not None and id(node) not in needed:
+                needed.add(id(node))
+                node = node.parent
+
+        kept = []
+        stack = [(self.root, False)]
+        while stack:
+            node, inside = stack.pop()
+            inside = inside or id(node) in protected
+            if node is not self.root:
+                kept.append(node)
+            if not inside:
+                node.children = [c for c in node.children if isinstance(c, str) or id(c) in needed]
+            stack.extend((child, inside) for child in node.children if not isinstance(child, str))
+        kept.sort(key=lambda n: n.index)
+        self.nodes = kept
+        self.compacted = True
+
+
+class _StdlibParser(HTMLParser):
+    """Streaming tokenizer used when lxml isn't installed."""
+
+    def __init__(self, builder: _TreeBuilder):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.builder.start(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.builder.end(tag)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+
+def parse(html: str, max_nodes: int = 200000, raw: bool = False, tokens: set = None) -> _TreeBuilder:
+    builder = _TreeBuilder(max_nodes, raw, tokens)
+    etree = get_etree()
+    if etree is not None:
+        parser = etree.HTMLParser(target=builder, remove_comments=True)
+        try:
+            etree.fromstring(html, parser)
+            return builder
+        except (etree.XMLSyntaxError, ValueError):
+            builder = _TreeBuilder(max_nodes, raw, tokens)
+    parser = _StdlibParser(builder)
+    parser.feed(html)
+    parser.close()
+    return builder
+
+
+class StreamingParser:
+    """
+    Incremental parse(): feed() the snapshot chunk by chunk (bytes or str) as it arrives.
+    Only the pruned tree and the first `head_chars` of raw text (for the non-markup
+    fallback) are kept, so memory doesn't grow with the size of the upload.
+    """
+
+    def __init__(self, max_nodes: int = 200000, head_chars: int = 0):
+        self.builder = _TreeBuilder(max_nodes)
+        self.head_chars = head_chars
+        self.head = ""
+        self.size = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        etree = get_etree()
+        if etree is not None:
+            self._parser = etree.HTMLParser(target=self.builder, remove_comments=True)
+            self._errors = (etree.XMLSyntaxError, ValueError)
+        else:
+            self._parser = _StdlibParser(self.builder)
+            self._errors = (ValueError,)
+
+    def feed(self, chunk):
+        text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if not text:
+            return
+        self.size += len(text)
+        if len(self.head) < self.head_chars:
+            self.head += text[:self.head_chars - len(self.head)]
+        self._parser.feed(text)
+
+    def close(self) -> _TreeBuilder:
+        self.feed(self._decoder.decode(b"", final=True))
+        try:
+            self._parser.close()
+        except self._errors:
+            # lxml refuses empty documents; the builder then simply has no nodes
+            pass
+        return self.builder
+
+
+def serialize(node) -> str:
+    if isinstance(node, str):
+        return escape(node, quote=False)
+    inner = "".join(serialize(child) for child in node.children)
+    if node.tag == "#root":
+        return inner
+    attrs = "".join(f' {k}="{escape(v)}"' if v else f" {k}" for k, v in node.attrs.items())
+    if node.tag in VOID_TAGS:
+        return f"<{node.tag}{attrs}>"
+    return f"<{node.tag}{attrs}>{inner}</{node.tag}>"
+
+
+class DomPruner:
+    """
+    Shrinks an HTML snapshot to the parts relevant for a failure:
+    drops script/style/svg/comments, collapses attribute noise, and when the
+    page still doesn't fit the token budget keeps only the subtrees around
+    elements matching the failing selector or expected text.
+    """
+
+    CHARS_PER_TOKEN = 4
+    # Streaming uploads start dropping irrelevant subtrees once this many nodes are held
+    COMPACT_MIN_NODES = 20000
+
+    def __init__(self, max_tokens: int = 2000, context_depth: int = 2, max_nodes: int = 200000):
+        self.max_tokens = max_tokens
+        self.context_depth = context_depth
+        self.max_nodes = max_nodes
+
+    @property
+    def max_chars(self) -> int:
+        return self.max_tokens * self.CHARS_PER_TOKEN
+
+    def prune(self, html: str, error_log: str = "") -> str:
+        tokens = hint_tokens(extract_hints(error_log))
+        return self._prune_tree(parse(html, self.max_nodes, tokens=tokens), html, error_log)
+
+    def stream(self, error_log: str = None) -> StreamingParser:
+        """Parser for prune_stream(); keeps one char more than the budget so truncation still shows."""
+        parser = StreamingParser(self.max_nodes, head_chars=self.max_chars + 1)
+        if error_log is not None:
+            self.watch(parser, error_log)
+        return parser
+
+    def watch(self, parser: StreamingParser, error_log: str):
+        """
+        Once the error log is known, lets the parser periodically drop subtrees that can't
+        make it into the pruned output, so memory stays flat on huge DOMs.
+        """
+        tokens = hint_tokens(extract_hints(error_log))
+        builder = parser.builder
+        builder.tokens = tokens
+        # Every element serializes to at least a few chars, so past this many nodes the
+        # whole page can never fit the budget and only the ranked regions matter
+        builder.compact_at = max(self.COMPACT_MIN_NODES, self.max_chars)
+        builder.on_full = lambda b: self._compact(b, tokens)
+
+    def _compact(self, builder: _TreeBuilder, tokens: set):
+        region_limit = self.max_chars // 4  # more nodes than this can't fit the budget
+        sizes = {}
+        for node in reversed(builder.nodes):
+            sizes[id(node)] = sizes.get(id(node), 0) + 1
+            sizes[id(node.parent)] = sizes.get(id(node.parent), 0) + sizes[id(node)]
+
+        # Each kept region costs at least ~20 chars (markup + separator), so only the top
+        # candidates can ever be selected; keep twice that for duplicates/oversized ones
+        candidates = self.max_chars // 8
+        protected = set()
+        for node in self._rank(builder.nodes, tokens)[:candidates]:
+            region = self._context_root(node)
+            protected.add(id(region if sizes[id(region)] <= region_limit else node))
+        builder.retain(protected)
+        # Don't thrash when most of what's held is relevant
+        builder.compact_at = max(builder.compact_at, 3 * len(builder.nodes))
+
+    def prune_stream(self, chunks, error_log: str = "", parser: StreamingParser = None) -> str:
+        """
+        Like prune(), but consumes an iterable of chunks, so the full snapshot is never held in memory.
+        Pass an already-fed `parser` (and no chunks) when the chunks arrive asynchronously.
+        """
+        parser = parser or self.stream(error_log)
+        for chunk in chunks:
+            parser.feed(chunk)
+        builder = parser.close()
+        return self._prune_tree(builder, parser.head, error_log)
+
+    def _prune_tree(self, builder: _TreeBuilder, raw_text: str, error_log: str) -> str:
+        if not builder.nodes:
+            # Not markup (e.g. Playwright's error-context.md): plain truncation
+            return self._truncate(raw_text)
+
+        bodies = [n for n in builder.nodes if n.tag == "body"]
+        body = bodies[0] if len(bodies) == 1 else builder.root
+        full = serialize(body)
+        # A compacted tree is already missing the irrelevant parts; it never "fits" as a whole page
+        if len(full) <= self.max_chars and not builder.compacted:
+            return full
+
+        tokens = hint_tokens(extract_hints(error_log))
+        ranked = self._rank(builder.nodes, tokens)
+        regions = self._select_regions(ranked)
+        if not regions:
+            return self._truncate(full)
+        regions.sort(key=lambda pair: pair[0].index)
+        return "\n<!-- ... -->\n".join(markup for _, markup in regions)
+
+    def _rank(self, nodes, tokens: set) -> list:
+        scored = []
+        for node in nodes:
+            score = 0
+            if tokens:
+                signature = node.signature()
+                score += 2 * sum(1 for token in tokens if token in signature)
+            if node.tag in INTERACTIVE_TAGS or "role" in node.attrs:
+                score += 1
+            if score:
+                scored.append((score, node))
+        scored.sort(key=lambda pair: (-pair[0], pair[1].index))
+        return [node for _, node in scored]
+
+    def _select_regions(self, ranked: list) -> list:
+        chosen = []
+        kept = set()
+        seen_markup = set()
+        budget = self.max_chars
+        for node in ranked:
+            if self._covered(node, kept):
+                continue
+            region = self._context_root(node)
+            markup = serialize(region)
+            if len(markup) > budget and region is not node:
+                region, markup = node, serialize(node)
+            # Repeated widgets (list rows, cards) only need to be shown once
+            if len(markup) > budget or markup in seen_markup:
+                continue
+            seen_markup.add(markup)
+            chosen = [(r, m) for r, m in chosen if not self._covered(r, {id(region)})]
+            chosen.append((region, markup))
+            kept.add(id(region))
+            budget = self.max_chars - sum(len(m) for _, m in chosen)
+            if budget <= 0:
+                break
+        return chosen
+
+    def _context_root(self, node):
+        region = node
+        for _ in range(self.context_depth):
+            parent = region.parent
+            if parent is None or parent.tag in ("#root", "html", "body"):
+                break
+            region = parent
+        return region
+
+    @staticmethod
+    def _covered(node, kept: set) -> bool:
+        while node is not None:
+            if id(node) in kept:
+                return True
+            node = node.parent
+        return False
+
+    def _truncate(self, text: str) -> str:
+        if len(text) > self.max_chars:
+            return text[:self.max_chars] + "...[TRUNCATED]"
+        return text
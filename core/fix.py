@@ -0,0 +1,182 @@
+import json
+
+# Fields in the order they are serialized; unset ones are left out
+FIELDS = ("code", "line_number", "reason", "confidence", "source", "alternatives", "usage")
+
+
+class FixResult:
+    """
+    One heal answer, parsed once: the code to write, where (line_number), why, how sure the
+    healer is, who produced it (llm, heuristic, knowledge, mock, cache) and the tokens it cost.
+    str() gives the compact JSON form stored in history and returned by the API.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, code: str = None, line_number: int = None, reason: str = None, confidence: float = None,
+                 source: str = None, alternatives: list = None, usage: dict = None):
+        self.code = code
+        self.line_number = line_number
+        self.reason = reason
+        self.confidence = confidence
+        self.source = source
+        self.alternatives = alternatives or []
+        self.usage = usage
+
+    @classmethod
+    def parse(cls, text: str, source: str = None) -> "FixResult":
+        """
+        Reads a model answer or a stored fix: a JSON object ({code, line_number, reason, ...}),
+        optionally inside a Markdown fence, or bare code with or without a fence.
+        """
+        if isinstance(text, FixResult):
+            return text
+        body = _unfence(text)
+        if body.startswith("{"):
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                return cls.from_dict(data, source)
+        return cls(code=body or None, source=source)
+
+    @classmethod
+    def from_dict(cls, data: dict, source: str = None) -> "FixResult":
+        code = data.get("code")
+        line_number = data.get("line_number")
+        if isinstance(line_number, str) and line_number.strip().isdigit():
+            line_number = int(line_number)
+        elif isinstance(line_number, float) and line_number.is_integer():
+            line_number = int(line_number)
+        elif not isinstance(line_number, int) or isinstance(line_number, bool):
+            line_number = None
+        alternatives = data.get("alternatives")
+        return cls(
+            code=code.strip() if isinstance(code, str) and code.strip() else None,
+            line_number=line_number,
+            reason=data.get("reason"),
+            confidence=data.get("confidence"),
+            source=data.get("source") or source,
+            alternatives=[a for a in alternatives if isinstance(a, str)] if isinstance(alternatives, list) else None,
+            usage=data.get("usage"),
+        )
+
+    def with_code(self, code: str) -> "FixResult":
+        """This fix with other code, e.g. the alternative that was actually written."""
+        if code == self.code:
+            return self
+        return FixResult(code=code, line_number=self.line_number, reason=self.reason, confidence=self.confidence,
+                         source=self.source, usage=self.usage)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS if getattr(self, field) not in (None, [], {})}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"), ensure_ascii=False)
+
+    def __str__(self):
+        return self.to_json()
+
+    def __bool__(self):
+        return bool(self.code)
+
+    def __eq__(self, other):
+        return isinstance(other, FixResult) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"FixResult({self.to_dict()!r})"
+
+
+def _unfence(text: str) -> str:
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+
+class FixStreamParser:
+    """
+    Incremental reader for a streamed model answer. feed() each chunk as it arrives; it
+    returns the `code` value the moment its closing quote has been received (once), so the
+    caller can act on the fix before the model has finished writing the reason. close()
+    parses the whole answer into a FixResult.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.code = None
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._key = None
+        self._expect_key = False
+        self._done = False
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return None
+        self.chunks.append(chunk)
+        if self._done:
+            return None
+        self._text += chunk
+        text, pos = self._text, self._pos
+        while pos < len(text):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    found = self._string_end(text[self._string_start:pos])
+                    if found is not None:
+                        self._pos = pos + 1
+                        return found
+            elif char == '"':
+                self._in_string, self._string_start = True, pos + 1
+            elif char in "{[":
+                self._depth += 1
+                self._expect_key = char == "{" and self._depth == 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._done = True
+                    break
+            elif char == "," and self._depth == 1:
+                self._expect_key, self._key = True, None
+            elif char == ":" and self._depth == 1:
+                self._expect_key = False
+            pos += 1
+        self._pos = pos
+        return None
+
+    def _string_end(self, raw: str):
+        """Handles a completed top-level string: remembers keys, reports the code value."""
+        if self._depth != 1:
+            return None
+        if self._expect_key:
+            self._key = raw
+            return None
+        if self._key == "code" and self.code is None:
+            try:
+                code = json.loads(f'"{raw}"').strip()
+            except ValueError:
+                return None
+            if code:
+                self.code = code
+                return code
+        return None
+
+    def close(self, source: str = None) -> FixResult:
+        text = "".join(self.chunks)
+        result = FixResult.parse(text, source)
+        if self.code is not None and result.code != self.code and _unfence(text).startswith("{"):
+            # Truncated JSON: keep the code that did arrive
+            result = FixResult(code=self.code, source=source)
+        return result
@@ -0,0 +1,311 @@
+import math
+import os
+import re
+
+from core.dom_pruner import INTERACTIVE_TAGS, extract_hints, hint_tokens, parse
+from core.fix import FixResult
+
+# Fixes at or above this confidence are returned without asking the LLM
+CONFIDENCE_THRESHOLD = float(os.getenv("DEFLAKE_HEURISTIC_THRESHOLD", 0.75))
+# Below this share of the locator's token weight, a clear lead over the runner-up adds no confidence
+MIN_MATCH_SCORE = 0.6
+
+TEST_ATTRS = ("data-testid", "data-test", "data-test-id", "data-cy", "data-qa")
+INPUT_TAGS = {"input", "textarea", "select"}
+CLICKABLE_ROLES = {"button", "link", "checkbox", "radio", "tab", "menuitem", "option", "switch", "combobox"}
+
+# Quoted string literal (', " or `), honouring backslash escapes
+QUOTED_RE = re.compile(r"(['\"`])((?:\\.|(?!\1).)*)\1")
+# The locator call a quoted string belongs to, e.g. `page.fill(` or `getByTestId(`
+CALL_RE = re.compile(r"(\w+)\(\s*$")
+FILL_RE = re.compile(r"\.(?:fill|type|pressSequentially|setValue|send_keys|selectOption|select|check|uncheck)\(")
+ASSERTION_RE = re.compile(r"toHaveText|toContainText|toHaveValue|have\.text|contain\.text|assert", re.IGNORECASE)
+LINE_REF_RE = re.compile(r"^Line (\d+)$")
+LOCATION_RE = re.compile(r"Location: .+:(\d+)")
+# Generated ids/classes (uuids, hashes, counters) make for flaky selectors
+DYNAMIC_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}|[0-9a-f]{10,}|\d{3,}|^(?:css|sc|jsx|ember|mui)-", re.IGNORECASE)
+SIMPLE_CSS_RE = re.compile(r"^([a-zA-Z][\w-]*)?((?:[#.][\w-]+|\[[\w-]+(?:[*^$~|]?=(['\"]?)[^'\"\]]*\3)?\])*)$")
+CSS_PART_RE = re.compile(r"([#.])([\w-]+)|\[([\w-]+)(?:([*^$~|]?=)(['\"]?)([^'\"\]]*)\5)?\]")
+CSS_IDENT_RE = re.compile(r"^-?[A-Za-z_][\w-]*$")
+
+
+def is_dynamic(value: str) -> bool:
+    return bool(DYNAMIC_RE.search(value or ""))
+
+
+def text_of(node) -> str:
+    parts = []
+    for child in node.children:
+        parts.append(child if isinstance(child, str) else text_of(child))
+    return " ".join(" ".join(parts).split())
+
+
+class DomIndex:
+    """Snapshot DOM indexed by id, test id, role, class, name and text, for O(1) selector checks."""
+
+    def __init__(self, html: str):
+        self.nodes = parse(html).nodes
+        self.by_id = {}
+        self.by_testid = {}
+        self.by_role = {}
+        self.by_class = {}
+        self.by_name = {}
+        self.by_text = {}
+        for node in self.nodes:
+            attrs = node.attrs
+            if attrs.get("id"):
+                self.by_id.setdefault(attrs["id"], []).append(node)
+            for attr in TEST_ATTRS:
+                if attrs.get(attr):
+                    self.by_testid.setdefault((attr, attrs[attr]), []).append(node)
+            if attrs.get("role"):
+                self.by_role.setdefault(attrs["role"], []).append(node)
+            for cls in attrs.get("class", "").split():
+                self.by_class.setdefault(cls, []).append(node)
+            if attrs.get("name"):
+                self.by_name.setdefault(attrs["name"], []).append(node)
+            text = text_of(node)
+            if text and len(text) <= 80:
+                self.by_text.setdefault(text, []).append(node)
+
+    def select(self, selector: str):
+        """
+        Nodes matching a simple compound CSS selector (tag, #id, .class, [attr], [attr=value]).
+        Returns None for anything more complex, which this index can't evaluate.
+        """
+        match = SIMPLE_CSS_RE.match(selector.strip())
+        if not match or not selector.strip():
+            return None
+        tag = (match.group(1) or "").lower()
+        parts = CSS_PART_RE.findall(match.group(2))
+        pool = self.nodes
+        for prefix, ident, *_ in parts:
+            if prefix == "#":
+                pool = self.by_id.get(ident, [])
+                break
+            if prefix == ".":
+                pool = self.by_class.get(ident, [])
+                break
+        return [node for node in pool if (not tag or node.tag == tag) and all(_matches(node, p) for p in parts)]
+
+    def count(self, selector: str) -> int:
+        return len(self.select(selector) or [])
+
+
+def _matches(node, part) -> bool:
+    prefix, ident, attr, op, _, value = part
+    if prefix == "#":
+        return node.attrs.get("id") == ident
+    if prefix == ".":
+        return ident in node.attrs.get("class", "").split()
+    if attr not in node.attrs:
+        return False
+    actual = node.attrs[attr]
+    if not op:
+        return True
+    return {
+        "=": actual == value,
+        "*=": value in actual,
+        "^=": actual.startswith(value),
+        "$=": actual.endswith(value),
+        "~=": value in actual.split(),
+        "|=": actual == value or actual.startswith(value + "-"),
+    }[op]
+
+
+class Locator:
+    """The broken locator in the failing line: its literal, the call it's passed to, and where it sits."""
+
+    def __init__(self, line: str, quote: str, value: str, start: int, end: int, call: str):
+        self.line = line
+        self.quote = quote
+        self.value = value
+        self.start = start
+        self.end = end
+        self.call = call or ""
+
+    @property
+    def kind(self) -> str:
+        call = self.call.lower()
+        if call == "getbytestid":
+            return "testid"
+        if call in ("getbytext", "contains"):
+            return "text"
+        if call in ("getbylabel", "getbyplaceholder", "getbyrole", "getbyalttext", "getbytitle"):
+            return "unsupported"
+        if self.value.startswith(("//", "xpath=", "text=")) or self.value.startswith("("):
+            return "unsupported"
+        return "css"
+
+    def replace(self, new_value: str) -> str:
+        quote = self.quote
+        if quote in new_value:
+            new_value = new_value.replace(quote, "'" if quote == '"' else '"')
+        return f"{self.line[:self.start]}{quote}{new_value}{quote}{self.line[self.end:]}"
+
+
+def find_locator(code_line: str, error_log: str):
+    """Picks the quoted locator out of the failing line, preferring the one the error log names."""
+    hints = extract_hints(error_log)
+    literals = []
+    for match in QUOTED_RE.finditer(code_line):
+        call = CALL_RE.search(code_line[:match.start()])
+        literals.append(Locator(code_line, match.group(1), match.group(2), match.start(), match.end(),
+                                call.group(1) if call else None))
+    for literal in literals:
+        if literal.value in hints:
+            return literal
+    # No hint in the log: the first string passed straight into a call is the usual locator position
+    for literal in literals:
+        if literal.call:
+            return literal
+    return None
+
+
+class HeuristicHealer:
+    """
+    Rule-based healer for the common cases (dynamic ids, renamed classes/attributes):
+    scores the snapshot's elements against the broken locator and proposes a stable
+    selector. Returns None whenever it isn't confident, so the caller falls back to the LLM.
+    """
+
+    def __init__(self, threshold: float = CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+
+    def heal(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None):
+        """Returns a FixResult or None."""
+        proposal = self.propose(error_log, html_snapshot, failing_line, source_code)
+        if proposal is None or proposal["confidence"] < self.threshold:
+            return None
+        return FixResult(
+            code=proposal["code"],
+            line_number=proposal["line_number"],
+            reason=proposal["reason"],
+            confidence=proposal["confidence"],
+            source="heuristic",
+        )
+
+    def propose(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None):
+        """Best candidate fix with its confidence (0..1), regardless of the threshold."""
+        code_line, line_number = self._code_line(error_log or "", failing_line, source_code)
+        if not code_line or ASSERTION_RE.search(code_line):
+            # Assertion failures are about content, not locators
+            return None
+        locator = find_locator(code_line, error_log or "")
+        if locator is None or locator.kind == "unsupported":
+            return None
+
+        index = DomIndex(html_snapshot or "")
+        if not index.nodes:
+            return None
+        if locator.kind == "css" and index.count(locator.value):
+            # The locator still matches: timing/visibility problem, not a selector one
+            return None
+
+        wants_input = bool(FILL_RE.search(code_line))
+        candidates = [node for node in index.nodes if self._compatible(node, wants_input)]
+        ranked = self._score(candidates, hint_tokens([locator.value]))
+        if not ranked:
+            return None
+
+        best_score, best = ranked[0]
+        second_score = ranked[1][0] if len(ranked) > 1 else 0.0
+        confidence = 0.6 * best_score
+        if best_score >= MIN_MATCH_SCORE:
+            confidence += 0.4 * (best_score - second_score) / best_score
+
+        selector = self._stable_selector(best, index, locator, code_line)
+        if selector is None:
+            return None
+        return {
+            "code": locator.replace(selector).strip(),
+            "line_number": line_number,
+            "reason": f"'{locator.value}' no longer matches; closest element is <{best.tag}> matched by {selector}",
+            "confidence": round(confidence, 3),
+            "selector": selector,
+        }
+
+    @staticmethod
+    def _code_line(error_log: str, failing_line: str, source_code: str):
+        """The failing source line and its number. JS clients send 'Line N' plus the source instead."""
+        line_number = None
+        location = LOCATION_RE.search(error_log)
+        if location:
+            line_number = int(location.group(1))
+        if failing_line:
+            line_ref = LINE_REF_RE.match(failing_line.strip())
+            if not line_ref:
+                return failing_line, line_number
+            line_number = int(line_ref.group(1))
+        if source_code and line_number:
+            lines = source_code.splitlines()
+            if 1 <= line_number <= len(lines):
+                return lines[line_number - 1], line_number
+        return None, line_number
+
+    @staticmethod
+    def _compatible(node, wants_input: bool) -> bool:
+        if wants_input:
+            return node.tag in INPUT_TAGS or node.attrs.get("role") in ("textbox", "combobox", "searchbox")
+        return node.tag in INTERACTIVE_TAGS or node.attrs.get("role") in CLICKABLE_ROLES
+
+    @staticmethod
+    def _score(candidates: list, tokens: set) -> list:
+        """
+        Ranks candidates by the share of locator token weight they contain, weighted by rarity.
+        Tokens found on no element count against every candidate as if they were the rarest
+        ('old', 'legacy' and the like are stop tokens and never get here).
+        """
+        signatures = [(node, f"{node.signature()} {text_of(node).lower()}") for node in candidates]
+        weights = {}
+        for token in tokens:
+            df = sum(1 for _, signature in signatures if token in signature)
+            weights[token] = math.log(1 + len(signatures) / max(df, 1))
+        total = sum(weights.values())
+        if not total:
+            return []
+        ranked = []
+        for node, signature in signatures:
+            score = sum(weight for token, weight in weights.items() if token in signature) / total
+            if score:
+                ranked.append((score, node))
+        ranked.sort(key=lambda pair: (-pair[0], pair[1].index))
+        return ranked
+
+    @staticmethod
+    def _stable_selector(node, index: DomIndex, locator: Locator, code_line: str):
+        """Most robust selector that uniquely identifies `node` (test id > id > name > aria-label > class > text)."""
+        attrs = node.attrs
+        if locator.kind == "testid":
+            for attr in TEST_ATTRS:
+                if attrs.get(attr) and len(index.by_testid.get((attr, attrs[attr]), [])) == 1:
+                    return attrs[attr]
+            return None
+        if locator.kind == "text":
+            text = text_of(node)
+            return text if text and len(index.by_text.get(text, [])) == 1 else None
+
+        options = []
+        for attr in TEST_ATTRS:
+            if attrs.get(attr):
+                options.append(f'[{attr}="{attrs[attr]}"]')
+        if attrs.get("id") and not is_dynamic(attrs["id"]):
+            options.append(f"#{attrs['id']}" if CSS_IDENT_RE.match(attrs["id"]) else f'[id="{attrs["id"]}"]')
+        for attr in ("name", "aria-label", "placeholder"):
+            if attrs.get(attr) and not is_dynamic(attrs[attr]):
+                options.append(f'{node.tag}[{attr}="{attrs[attr]}"]')
+        classes = [c for c in attrs.get("class", "").split() if not is_dynamic(c) and CSS_IDENT_RE.match(c)]
+        # Prefer classes the original selector already relied on
+        original = set(locator.value.replace(".", " ").replace("#", " ").split())
+        classes.sort(key=lambda c: c not in original)
+        options.extend(f"{node.tag}.{c}" for c in classes)
+        for selector in options:
+            if index.select(selector) == [node]:
+                return selector
+
+        if "page." in code_line or "locator(" in code_line:
+            # Playwright accepts text selectors anywhere a CSS selector goes
+            text = text_of(node)
+            if text and len(text) <= 50 and len(index.by_text.get(text, [])) == 1 and '"' not in text:
+                return f'text="{text}"'
+        return None
@@ -0,0 +1,146 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_DB = os.getenv("DEFLAKE_HISTORY_PATH", os.path.join(PROJECT_ROOT, "history.db"))
+LEGACY_HISTORY_FILE = os.path.join(PROJECT_ROOT, "history.json")
+
+LOCATION_RE = re.compile(r"Location: (.+?):\d+|at (?:.*? \()?([^\s()]+?\.\w+):\d+(?::\d+)?\)?")
+
+
+def guess_test_file(error_log: str):
+    """Best-effort test file for indexing when the caller didn't send one."""
+    match = LOCATION_RE.search(error_log or "")
+    if match:
+        return match.group(1) or match.group(2)
+    return None
+
+
+class HistoryStore:
+    """
+    Append-only healing history in SQLite.
+    Appends are single indexed INSERTs (no read-modify-write of a JSON file), and reads
+    are cursor-paginated by id with optional tier / test file / time filters.
+    """
+
+    def __init__(self, path: str = HISTORY_DB, legacy_file: str = LEGACY_HISTORY_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                tier TEXT,
+                test_file TEXT,
+                failing_line TEXT,
+                log_path TEXT,
+                html_path TEXT,
+                fix TEXT,
+                status TEXT,
+                tenant TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp);
+            CREATE INDEX IF NOT EXISTS idx_history_tier ON history (tier, id);
+            CREATE INDEX IF NOT EXISTS idx_history_test_file ON history (test_file, id);
+        ''')
+        # Databases created before entries were owned by a tenant (API key hash; '' for local runs)
+        if "tenant" not in {row["name"] for row in conn.execute("PRAGMA table_info(history)")}:
+            conn.execute("ALTER TABLE history ADD COLUMN tenant TEXT")
+            conn.commit()
+        if legacy_file:
+            self._import_legacy(legacy_file)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, legacy_file: str):
+        """One-time import of the old history.json so the dashboard keeps its past entries."""
+        if not os.path.exists(legacy_file):
+            return
+        conn = self._conn()
+        # Write lock first, so concurrent server workers can't both see an empty table and import twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM history LIMIT 1").fetchone():
+                return
+            try:
+                with open(legacy_file, 'r') as f:
+                    entries = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                return
+            # history.json is newest-first; insert oldest first so ids follow time
+            for entry in sorted(entries, key=lambda e: e.get("timestamp", "")):
+                self._insert(conn, entry)
+        finally:
+            conn.commit()
+
+    @staticmethod
+    def _insert(conn, entry: dict) -> int:
+        cur = conn.execute(
+            "INSERT INTO history (timestamp, tier, test_file, failing_line, log_path, html_path, fix, status, tenant) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry.get("timestamp") or datetime.datetime.now().isoformat(),
+                entry.get("tier"),
+                entry.get("test_file"),
+                entry.get("failing_line"),
+                entry.get("log_path"),
+                entry.get("html_path"),
+                # FixResult objects are stored in their compact JSON form
+                str(entry["fix"]) if entry.get("fix") is not None else None,
+                entry.get("status"),
+                entry.get("tenant") or "",
+            ),
+        )
+        return cur.lastrowid
+
+    def append(self, **entry) -> int:
+        """Appends one healed test and returns its id."""
+        conn = self._conn()
+        entry_id = self._insert(conn, entry)
+        conn.commit()
+        return entry_id
+
+    def query(self, limit: int = 50, cursor: int = None, tier: str = None, test_file: str = None,
+              since: str = None, until: str = None):
+        """
+        Returns (entries, next_cursor), newest first.
+        Pass next_cursor back as `cursor` to get the following page; it is None on the last page.
+        """
+        clauses, params = [], []
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        if tier:
+            clauses.append("tier = ?")
+            params.append(tier)
+        if test_file:
+            clauses.append("test_file = ?")
+            params.append(test_file)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT * FROM history {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+
+        entries = [dict(row) for row in rows[:limit]]
+        next_cursor = entries[-1]["id"] if len(rows) > limit else None
+        return entries, next_cursor
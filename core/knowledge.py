@@ -0,0 +1,300 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from core.fix import FixResult
+from core.heuristics import CALL_RE, QUOTED_RE, DomIndex, HeuristicHealer, find_locator
+from core.history import HISTORY_DB, LEGACY_HISTORY_FILE, HistoryStore, guess_test_file
+
+# Set DEFLAKE_KNOWLEDGE=0 to stop reusing fixes from history
+KNOWLEDGE_ENABLED = os.getenv("DEFLAKE_KNOWLEDGE", "1") != "0"
+# A failure counts half as much towards the flakiness score after this many days
+HALF_LIFE_DAYS = float(os.getenv("DEFLAKE_FLAKY_HALF_LIFE_DAYS", 7))
+# Only fixes that were written to a test (or checked against the page) are worth reusing
+LEARNED_STATUSES = ("Applied", "Verified")
+# Answers that did not come from healing the failure itself: replays and test doubles
+UNLEARNED_SOURCES = {"mock", "knowledge", "cache"}
+# Bumped when the tables below change shape; the index is then rebuilt from history
+SCHEMA_VERSION = 2
+
+
+def failing_code(error_log: str, failing_line: str = None, source_code: str = None):
+    """The failing source line itself, resolving the 'Line N' form JS clients send."""
+    code_line, _ = HeuristicHealer._code_line(error_log or "", failing_line, source_code)
+    return code_line or failing_line
+
+
+def replacement_for(locator, fixed_code: str):
+    """The literal that took the locator's place in the fix, if the fix kept the same call."""
+    for line in fixed_code.splitlines():
+        for match in QUOTED_RE.finditer(line):
+            call = CALL_RE.search(line[:match.start()])
+            if call and call.group(1) == locator.call and match.group(2) != locator.value:
+                return match.group(2)
+    return None
+
+
+def _epoch(timestamp: str) -> float:
+    try:
+        return datetime.datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def _decayed(score: float, since: float, now: float) -> float:
+    return score * 0.5 ** (max(0.0, now - since) / (HALF_LIFE_DAYS * 86400))
+
+
+class LocatorKnowledge:
+    """
+    What history says about each (test file, locator): the replacements that healed it,
+    how often each was reused and how often it broke again, and a decaying flakiness score.
+    Built incrementally from history.db (only rows added since the last refresh are read),
+    so a failure seen before is answered by a lookup instead of an LLM call.
+    Everything is kept per tenant (the API key hash; '' for local runs), so one team's
+    fixes are never offered to another.
+    """
+
+    def __init__(self, path: str = HISTORY_DB, legacy_file: str = LEGACY_HISTORY_FILE):
+        self.path = path
+        # Makes sure the history table (and any legacy import) exists before it is read
+        self.history = HistoryStore(path, legacy_file)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS knowledge_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        schema = conn.execute("SELECT value FROM knowledge_state WHERE key='schema'").fetchone()
+        if schema is None or schema["value"] != SCHEMA_VERSION:
+            conn.executescript(f'''
+                DROP TABLE IF EXISTS locator_fixes;
+                DROP TABLE IF EXISTS locator_stats;
+                DELETE FROM knowledge_state;
+                INSERT INTO knowledge_state (key, value) VALUES ('schema', {SCHEMA_VERSION});
+            ''')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS locator_fixes (
+                tenant TEXT NOT NULL,
+                test_file TEXT NOT NULL,
+                locator TEXT NOT NULL,
+                call TEXT NOT NULL,
+                replacement TEXT NOT NULL,
+                original_line TEXT,
+                fixed_line TEXT,
+                uses INTEGER NOT NULL DEFAULT 0,
+                broke INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (tenant, test_file, locator, replacement)
+            );
+            CREATE TABLE IF NOT EXISTS locator_stats (
+                tenant TEXT NOT NULL,
+                test_file TEXT NOT NULL,
+                locator TEXT NOT NULL,
+                failures INTEGER NOT NULL DEFAULT 0,
+                score REAL NOT NULL DEFAULT 0,
+                first_failed REAL NOT NULL,
+                last_failed REAL NOT NULL,
+                PRIMARY KEY (tenant, test_file, locator)
+            );
+            CREATE INDEX IF NOT EXISTS idx_locator_fixes_locator ON locator_fixes (tenant, locator, last_used);
+            CREATE INDEX IF NOT EXISTS idx_locator_fixes_replacement ON locator_fixes (tenant, test_file, replacement);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _indexed_upto(self, conn) -> int:
+        row = conn.execute("SELECT value FROM knowledge_state WHERE key='history_id'").fetchone()
+        return row["value"] if row else 0
+
+    def refresh(self) -> int:
+        """Indexes history rows added since the last refresh; returns how many were read."""
+        conn = self._conn()
+        latest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+        if latest <= self._indexed_upto(conn):
+            return 0
+        # Write lock before re-reading the marker, so concurrent processes don't index a row twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            start = self._indexed_upto(conn)
+            rows = conn.execute(
+                "SELECT id, timestamp, tenant, test_file, failing_line, fix, status FROM history WHERE id > ? ORDER BY id",
+                (start,),
+            ).fetchall()
+            for row in rows:
+                self._index(conn, row)
+            if rows:
+                conn.execute(
+                    "INSERT OR REPLACE INTO knowledge_state (key, value) VALUES ('history_id', ?)", (rows[-1]["id"],)
+                )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return len(rows)
+
+    def _index(self, conn, row):
+        code_line = row["failing_line"]
+        if not code_line or code_line.strip().startswith("Line "):
+            # Only the line number was recorded; there is no locator to learn from
+            return
+        locator = find_locator(code_line, "")
+        if locator is None:
+            return
+        tenant = row["tenant"] or ""
+        test_file = row["test_file"] or ""
+        when = _epoch(row["timestamp"])
+
+        # Every recorded failure counts towards flakiness, whatever became of its fix
+        stats = conn.execute(
+            "SELECT score, last_failed FROM locator_stats WHERE tenant=? AND test_file=? AND locator=?",
+            (tenant, test_file, locator.value),
+        ).fetchone()
+        if stats is None:
+            conn.execute(
+                "INSERT INTO locator_stats (tenant, test_file, locator, failures, score, first_failed, last_failed) "
+                "VALUES (?, ?, ?, 1, 1.0, ?, ?)",
+                (tenant, test_file, locator.value, when, when),
+            )
+        else:
+            conn.execute(
+                "UPDATE locator_stats SET failures = failures + 1, score = ?, last_failed = ? "
+                "WHERE tenant=? AND test_file=? AND locator=?",
+                (_decayed(stats["score"], stats["last_failed"], when) + 1.0, max(when, stats["last_failed"]),
+                 tenant, test_file, locator.value),
+            )
+        # The locator that failed now was an earlier fix for this test: that fix didn't hold
+        conn.execute(
+            "UPDATE locator_fixes SET broke = broke + 1 WHERE tenant=? AND test_file=? AND replacement=?",
+            (tenant, test_file, locator.value),
+        )
+
+        if row["status"] not in LEARNED_STATUSES:
+            # Suggested, rejected or failed to apply: nothing says this fix works
+            return
+        fix = FixResult.parse(row["fix"])
+        if fix.source in UNLEARNED_SOURCES:
+            # A replay of something already learned (or a canned answer) is not another success
+            return
+        fixed = fix.code or ""
+        if not fixed or fixed.strip() == code_line.strip():
+            return
+        replacement = replacement_for(locator, fixed)
+        conn.execute(
+            "INSERT INTO locator_fixes "
+            "(tenant, test_file, locator, call, replacement, original_line, fixed_line, uses, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT (tenant, test_file, locator, replacement) DO UPDATE SET uses = uses + 1, "
+            "last_used = MAX(last_used, excluded.last_used), fixed_line = excluded.fixed_line, "
+            "original_line = excluded.original_line",
+            # Fixes that changed more than the literal are stored whole, keyed by the line they fixed
+            (tenant, test_file, locator.value, locator.call, replacement if replacement is not None else fixed.strip(),
+             code_line.strip(), fixed.strip(), when),
+        )
+
+    def candidates(self, test_file: str, locator, tenant: str = "") -> list:
+        """A tenant's known-good replacements for a locator: this test file's first, most recently used first."""
+        rows = self._conn().execute(
+            "SELECT * FROM locator_fixes WHERE tenant=? AND locator=? AND call=? AND uses > broke "
+            "ORDER BY test_file = ? DESC, last_used DESC LIMIT 10",
+            (tenant or "", locator.value, locator.call, test_file or ""),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def lookup(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None,
+               test_file: str = None, tenant: str = ""):
+        """
+        The tenant's last known-good fix for this failure as a FixResult, or None.
+        A replacement is only reused while the snapshot still contains what it points at.
+        `test_file` is the file the caller reported; otherwise it is guessed from the log.
+        """
+        self.refresh()
+        code_line, line_number = HeuristicHealer._code_line(error_log or "", failing_line, source_code)
+        if not code_line:
+            return None
+        locator = find_locator(code_line, error_log or "")
+        if locator is None:
+            return None
+        test_file = test_file or guess_test_file(error_log) or ""
+        candidates = self.candidates(test_file, locator, tenant)
+        if not candidates:
+            return None
+
+        index = None
+        for candidate in candidates:
+            same_file = candidate["test_file"] == test_file
+            if candidate["replacement"] == candidate["fixed_line"]:
+                # Whole-line fix: only valid for exactly the line it was made for
+                if candidate["original_line"] != code_line.strip():
+                    continue
+                code = candidate["fixed_line"]
+                present = None
+            else:
+                if index is None:
+                    index = DomIndex(html_snapshot or "")
+                code = locator.replace(candidate["replacement"]).strip()
+                present = self._present(index, locator, candidate["replacement"])
+            if present is False or (present is None and not same_file):
+                # Not on this page, or unverifiable and learned from another test
+                continue
+            return FixResult(
+                code=code,
+                line_number=line_number,
+                reason=f"'{locator.value}' was healed to '{candidate['replacement']}' before "
+                       f"({candidate['uses']} use(s), {candidate['broke']} regression(s))",
+                confidence=round(candidate["uses"] / (candidate["uses"] + candidate["broke"]), 3),
+                source="knowledge",
+            )
+        return None
+
+    @staticmethod
+    def _present(index: DomIndex, locator, value: str):
+        """True/False if the snapshot does/doesn't contain the target, None if the index can't tell."""
+        if not index.nodes:
+            return None
+        if locator.kind == "css":
+            matches = index.select(value)
+            return None if matches is None else len(matches) > 0
+        if locator.kind == "testid":
+            return any(key[1] == value for key in index.by_testid)
+        if locator.kind == "text":
+            return value in index.by_text
+        return None
+
+    def flakiest(self, limit: int = 20, test_file: str = None, tenant: str = None) -> list:
+        """
+        Locators ranked by decayed failure score, with the replacement currently reused for each.
+        `tenant=None` ranks every tenant's locators together.
+        """
+        self.refresh()
+        conn = self._conn()
+        clauses, params = [], []
+        if tenant is not None:
+            clauses.append("tenant = ?")
+            params.append(tenant)
+        if test_file:
+            clauses.append("test_file = ?")
+            params.append(test_file)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(f"SELECT * FROM locator_stats {where}", params).fetchall()
+        now = time.time()
+        ranked = sorted(
+            ({**dict(row), "score": round(_decayed(row["score"], row["last_failed"], now), 3)} for row in rows),
+            key=lambda entry: (-entry["score"], -entry["last_failed"]),
+        )[:limit]
+        for entry in ranked:
+            best = conn.execute(
+                "SELECT replacement, uses, broke FROM locator_fixes "
+                "WHERE tenant=? AND test_file=? AND locator=? AND uses > broke ORDER BY last_used DESC LIMIT 1",
+                (entry["tenant"], entry["test_file"], entry["locator"]),
+            ).fetchone()
+            entry["known_fix"] = dict(best) if best else None
+            entry["test_file"] = entry["test_file"] or None
+        return ranked
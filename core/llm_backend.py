@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+# Seconds before a single provider call is abandoned
+DEFAULT_TIMEOUT = float(os.getenv("DEFLAKE_LLM_TIMEOUT", 60))
+DEFAULT_MAX_RETRIES = int(os.getenv("DEFLAKE_LLM_MAX_RETRIES", 2))
+# Concurrent calls a provider may have in flight (per process)
+DEFAULT_CONCURRENCY = int(os.getenv("DEFLAKE_LLM_CONCURRENCY", 16))
+RETRY_BASE_DELAY = float(os.getenv("DEFLAKE_LLM_RETRY_DELAY", 1.0))
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Concurrency slots per (provider, model, key): shared by every client using that account
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def provider_slots(name: str, model: str, api_key: str, concurrency: int) -> threading.BoundedSemaphore:
+    account = hashlib.sha256((api_key or "").encode()).hexdigest()
+    with _slots_lock:
+        return _slots.setdefault((name, model, account), threading.BoundedSemaphore(concurrency))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, connection drops and 5xx are worth another try; bad requests aren't."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    name = type(error).__name__.lower()
+    return any(word in name for word in ("timeout", "connection", "ratelimit", "unavailable"))
+
+
+class Provider:
+    """
+    One OpenAI-compatible chat endpoint + model (OpenAI, Azure/OpenRouter/vLLM gateways,
+    or the local stand-in from core/llm_standin.py), with its own concurrency limit and retries.
+    """
+
+    def __init__(self, name: str, model: str, api_key: str = None, base_url: str = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, max_retries: int = DEFAULT_MAX_RETRIES,
+                 timeout: float = DEFAULT_TIMEOUT):
+        from langchain_openai import ChatOpenAI
+
+        self.name = name
+        self.model = model
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self._slots = provider_slots(name, model, api_key, concurrency)
+        # Retries are done here (with the concurrency slot released), not inside the SDK
+        self.llm = ChatOpenAI(
+            model=model, temperature=0, api_key=api_key or "not-needed", base_url=base_url,
+            timeout=timeout, max_retries=0, stream_usage=True,
+        )
+
+    def invoke(self, messages):
+        attempt = 0
+        while True:
+            try:
+                with self._slots:
+                    return self.llm.invoke(messages)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+
+    async def ainvoke(self, messages):
+        attempt = 0
+        while True:
+            try:
+                await self._acquire()
+                try:
+                    return await self.llm.ainvoke(messages)
+                finally:
+                    self._slots.release()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+
+    def stream(self, messages):
+        """Yields the answer in chunks; a failure is retried only while nothing has been yielded yet."""
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with self._slots:
+                    for chunk in self.llm.stream(messages):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+
+    async def astream(self, messages):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                await self._acquire()
+                try:
+                    async for chunk in self.llm.astream(messages):
+                        started = True
+                        yield chunk
+                finally:
+                    self._slots.release()
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+
+    async def _acquire(self):
+        # The same slots are shared with sync callers (batch/job threads), so poll instead of blocking the loop
+        wait = 0.005
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, 0.05)
+
+    @staticmethod
+    def _delay(attempt: int) -> float:
+        delay = RETRY_BASE_DELAY * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+
+class FallbackBackend:
+    """Tries each provider in order; the next one is used only when the previous one failed for good."""
+
+    def __init__(self, providers: list):
+        self.providers = providers
+
+    def invoke(self, messages):
+        for provider in self.providers[:-1]:
+            try:
+                return provider.invoke(messages)
+            except Exception as e:
+                print(f"⚠️  {provider.name} ({provider.model}) failed, falling back: {e}")
+        return self.providers[-1].invoke(messages)
+
+    async def ainvoke(self, messages):
+        for provider in self.providers[:-1]:
+            try:
+                return await provider.ainvoke(messages)
+            except Exception as e:
+                print(f"⚠️  {provider.name} ({provider.model}) failed, falling back: {e}")
+        return await self.providers[-1].ainvoke(messages)
+
+    def stream(self, messages):
+        # Falling back is only possible before the first chunk went out
+        for provider in self.providers[:-1]:
+            started = False
+            try:
+                for chunk in provider.stream(messages):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                print(f"⚠️  {provider.name} ({provider.model}) failed, falling back: {e}")
+        yield from self.providers[-1].stream(messages)
+
+    async def astream(self, messages):
+        for provider in self.providers[:-1]:
+            started = False
+            try:
+                async for chunk in provider.astream(messages):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                print(f"⚠️  {provider.name} ({provider.model}) failed, falling back: {e}")
+        async for chunk in self.providers[-1].astream(messages):
+            yield chunk
+
+
+def provider_specs(api_key: str = None) -> list:
+    """
+    Provider list from DEFLAKE_LLM_PROVIDERS (a JSON list, in fallback order), e.g.
+    [{"name": "openai", "model": "gpt-4o", "concurrency": 16},
+     {"name": "local", "model": "stand-in", "base_url": "http://127.0.0.1:8788/v1"}].
+    Keys: name, model, base_url, api_key_env, concurrency, max_retries, timeout.
+    Without it: OpenAI with DEFLAKE_LLM_MODEL (gpt-4o) then each of DEFLAKE_LLM_FALLBACK_MODELS.
+    Providers without api_key_env use `api_key` (BYOK or OPENAI_API_KEY).
+    """
+    raw = os.getenv("DEFLAKE_LLM_PROVIDERS")
+    if raw:
+        specs = json.loads(raw)
+    else:
+        base_url = os.getenv("DEFLAKE_LLM_BASE_URL")
+        models = [os.getenv("DEFLAKE_LLM_MODEL", "gpt-4o")]
+        models += [m.strip() for m in os.getenv("DEFLAKE_LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+        specs = [{"name": "openai" if not base_url else "custom", "model": model, "base_url": base_url} for model in models]
+
+    resolved = []
+    for spec in specs:
+        key = os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else api_key
+        # Endpoints we can't authenticate against are skipped (self-hosted base_urls may not need a key)
+        if not key and not spec.get("base_url"):
+            continue
+        resolved.append({**spec, "api_key": key})
+    return resolved
+
+
+def backend_from_env(api_key: str = None, timeout: float = None):
+    """The configured provider chain, or None if no provider is usable (callers fall back to mock)."""
+    specs = provider_specs(api_key)
+    if not specs:
+        return None
+    providers = [
+        Provider(
+            name=spec.get("name", spec["model"]),
+            model=spec["model"],
+            api_key=spec["api_key"],
+            base_url=spec.get("base_url"),
+            concurrency=int(spec.get("concurrency", DEFAULT_CONCURRENCY)),
+            max_retries=int(spec.get("max_retries", DEFAULT_MAX_RETRIES)),
+            timeout=float(spec.get("timeout", timeout or DEFAULT_TIMEOUT)),
+        )
+        for spec in specs
+    ]
+    return providers[0] if len(providers) == 1 else FallbackBackend(providers)
+
+
+class Coalescer:
+    """
+    Lets concurrent identical requests share one call: the first caller for a key runs it,
+    later callers wait for its result. Works for threads and coroutines alike.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, (asyncio.CancelledError, CancelledError)):
+            # The leader went away (client disconnect); followers retry on their own
+            future.cancel()
+        else:
+            future.set_exception(error)
+
+    def run(self, key, call):
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result()
+                except CancelledError:
+                    continue
+            try:
+                result = call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, result)
+            return result
+
+    async def arun(self, key, call):
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except (asyncio.CancelledError, CancelledError):
+                    if future.cancelled():
+                        continue
+                    raise
+            try:
+                result = await call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, result)
+            return result
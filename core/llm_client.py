@@ -1,39 +1,186 @@
+import asyncio
+import hashlib
 import os
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
+import threading
+from collections import OrderedDict
 
-# Load env variables from the parent directory
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+from core.cache import fingerprint
+from core.fix import FixResult, FixStreamParser
+from core.heuristics import HeuristicHealer
+from core.knowledge import KNOWLEDGE_ENABLED, LocatorKnowledge
+from core.llm_backend import Coalescer, backend_from_env
+from core.prompt_budget import PromptBudget
+
+# langchain (~1.5s) and dotenv are imported lazily: mock runs and cache hits never pay for them.
+_env_loaded = False
+
+def load_env():
+    """Loads env variables from the parent directory's .env (once)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+        _env_loaded = True
+
+# Set DEFLAKE_HEURISTICS=0 to always go to the LLM
+HEURISTICS_ENABLED = os.getenv("DEFLAKE_HEURISTICS", "1") != "0"
 
 class LLMClient:
-    def __init__(self, mock: bool = False, openai_api_key: str = None):
+    def __init__(self, mock: bool = False, openai_api_key: str = None, cache=None, timeout: float = None, on_usage=None,
+                 heuristics: bool = None, on_prompt=None, budget: PromptBudget = None, backend=None, knowledge=None,
+                 on_code=None):
         self.mock = mock
-        if not self.mock:
+        # Local rule-based healer tried before the LLM (and before mock answers); None disables it
+        self.heuristic = HeuristicHealer() if (HEURISTICS_ENABLED if heuristics is None else heuristics) else None
+        self.heuristic_hits = 0
+        # Fixes that worked before for the same test + locator (core/knowledge.py); tried first
+        self.knowledge = knowledge
+        if knowledge is None and KNOWLEDGE_ENABLED:
+            try:
+                self.knowledge = LocatorKnowledge()
+            except Exception as e:
+                print(f"⚠️  Locator knowledge base unavailable: {e}")
+        self.knowledge_hits = 0
+        # Optional FixCache (core/cache.py). Repeat failures are answered from it without an LLM call.
+        self.cache = cache
+        # Optional callback receiving the token usage of every LLM response (for metering/metrics)
+        self.on_usage = on_usage
+        # Optional callback receiving the fixed code as soon as the model has written it (the answer is streamed)
+        self.on_code = on_code
+        # Prompts are fitted to a token budget; on_prompt receives the size report of each one sent
+        self.budget = budget or PromptBudget()
+        self.on_prompt = on_prompt
+        # Concurrent identical heals share one LLM call
+        self.coalescer = Coalescer()
+        # Provider chain (core/llm_backend.py): anything with .invoke/.ainvoke(messages) (+ .stream/.astream)
+        self.backend = backend
+        if not self.mock and self.backend is None:
+            load_env()
             # Use provided key (BYOK) or fallback to env (SaaS Owner)
             api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
-            
-            if not api_key:
-                # raise ValueError("OPENAI_API_KEY not found in environment variables.")
-                print("⚠️  Warning: No OpenAI Key found. Switching to Mock Mode.")
+            try:
+                self.backend = backend_from_env(api_key, timeout)
+            except Exception as e:
+                # Fallback to mock if init fails
+                print(f"⚠️  Warning: Failed to initialize the LLM backend ({e}). Switching to Mock Mode.")
                 self.mock = True
             else:
-                try:
-                    self.llm = ChatOpenAI(model="gpt-4o", temperature=0, api_key=api_key)
-                except Exception:
-                    # Fallback to mock if init fails
-                    print("⚠️  Warning: Failed to initialize OpenAI. Switching to Mock Mode.")
+                if self.backend is None:
+                    print("⚠️  Warning: No OpenAI Key found. Switching to Mock Mode.")
                     self.mock = True
 
-    def heal(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None) -> str:
+    def heal(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None,
+             test_file: str = None, tenant: str = "") -> FixResult:
         """
         Sends the error, HTML, and optional source code to the LLM to ask for a fix.
+        `test_file` and `tenant` pick which past fixes may be reused.
+        """
+        fix, cache_key = self._local_fix(error_log, html_snapshot, failing_line, source_code, test_file, tenant)
+        if fix is not None:
+            return fix
+
+        def call():
+            messages = self._messages(error_log, html_snapshot, failing_line, source_code)
+            if not self._streaming():
+                return self._finish(self.backend.invoke(messages), cache_key)
+            parser, message = FixStreamParser(), None
+            for chunk in self.backend.stream(messages):
+                message = self._read_chunk(parser, message, chunk)
+            return self._finish(message, cache_key, parser)
+
+        return self.coalescer.run(cache_key or fingerprint(error_log, html_snapshot, failing_line, source_code), call)
+
+    async def aheal(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None,
+                    test_file: str = None, tenant: str = "") -> FixResult:
+        """
+        Async twin of heal(): awaits the LLM instead of blocking a worker thread.
+        Cancelling the awaiting task aborts the in-flight HTTP request. The SQLite lookups,
+        DOM work and cache write run in a worker thread, never on the event loop.
+        """
+        fix, cache_key = await asyncio.to_thread(
+            self._local_fix, error_log, html_snapshot, failing_line, source_code, test_file, tenant
+        )
+        if fix is not None:
+            return fix
+
+        async def call():
+            messages = await asyncio.to_thread(self._messages, error_log, html_snapshot, failing_line, source_code)
+            if not self._streaming():
+                return await asyncio.to_thread(self._finish, await self.backend.ainvoke(messages), cache_key)
+            parser, message = FixStreamParser(), None
+            async for chunk in self.backend.astream(messages):
+                message = self._read_chunk(parser, message, chunk)
+            return await asyncio.to_thread(self._finish, message, cache_key, parser)
+
+        return await self.coalescer.arun(cache_key or fingerprint(error_log, html_snapshot, failing_line, source_code), call)
+
+    @staticmethod
+    def _mock_fix(failing_line: str = None) -> FixResult:
+        # Mock output for testing
+        if failing_line:
+            return FixResult(code="page.locator('button[data-testid=\"submit-btn\"]').click();", source="mock")
+        return FixResult(code="// Selector update\npage.locator('.btn-primary-2026');", source="mock")
+
+    def _local_fix(self, error_log, html_snapshot, failing_line, source_code, test_file=None, tenant=""):
+        """
+        (fix, None) when no LLM call is needed (known fix, heuristics, mock or cache hit),
+        else (None, cache key to store the LLM's answer under).
         """
+        fix = self._known_fix(error_log, html_snapshot, failing_line, source_code, test_file, tenant)
+        if fix is None:
+            fix = self._heuristic_fix(error_log, html_snapshot, failing_line, source_code)
+        if fix is not None:
+            return fix, None
         if self.mock:
-                # Mock output for testing
-            if failing_line:
-                return "```javascript\npage.locator('button[data-testid=\"submit-btn\"]').click();\n```"
-            return "```javascript\n// Selector update\npage.locator('.btn-primary-2026');\n```"
+            return self._mock_fix(failing_line), None
+        cache_key, cached = self._cache_lookup(error_log, html_snapshot, failing_line, source_code)
+        return cached, cache_key
+
+    def _known_fix(self, error_log, html_snapshot, failing_line, source_code, test_file=None, tenant=""):
+        """Last known-good fix for this tenant, test and locator, or None."""
+        if not self.knowledge:
+            return None
+        try:
+            fix = self.knowledge.lookup(error_log, html_snapshot, failing_line, source_code, test_file, tenant)
+        except Exception as e:
+            print(f"⚠️  Knowledge lookup failed: {e}")
+            return None
+        if fix is not None:
+            self.knowledge_hits += 1
+        return fix
+
+    def _heuristic_fix(self, error_log, html_snapshot, failing_line, source_code):
+        """Confident local fix for common locator breakages, or None to ask the LLM."""
+        if self.heuristic is None:
+            return None
+        try:
+            fix = self.heuristic.heal(error_log, html_snapshot, failing_line, source_code)
+        except Exception as e:
+            print(f"⚠️  Heuristic healer failed, falling back to the LLM: {e}")
+            return None
+        if fix is not None:
+            self.heuristic_hits += 1
+        return fix
+
+    def _cache_lookup(self, error_log, html_snapshot, failing_line, source_code):
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.key_for(error_log, html_snapshot, failing_line, source_code)
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        fix = FixResult.parse(cached)
+        # Nothing was spent on this one
+        fix.source, fix.usage = "cache", None
+        return cache_key, fix
+
+    def _messages(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None):
+        prompt, inputs = self.build_prompt(error_log, html_snapshot, failing_line, source_code)
+        return prompt.format_messages(**inputs)
+
+    def build_prompt(self, error_log: str, html_snapshot: str, failing_line: str = None, source_code: str = None):
+        """Returns (ChatPromptTemplate, inputs) for a heal, without calling the LLM."""
+        from langchain_core.prompts import ChatPromptTemplate
 
         system_prompt = (
             "You are an expert Test Automation Engineer specializing in Playwright and Page Object Models (POM).\n"
@@ -49,26 +196,32 @@ class LLMClient:
             "{{\n"
             "  \"code\": \"fixed_code_line_here\",\n"
             "  \"line_number\": <integer_of_target_line_in_source_code>,\n"
-            "  \"reason\": \"Brief explanation\"\n"
+            "  \"reason\": \"Brief explanation\",\n"
+            "  \"alternatives\": [\"other_fixed_code_line\"]\n"
             "}}\n"
             "```\n"
+            "`alternatives` is optional: up to 3 other versions of the fixed line using different locators, best first.\n"
             "If you cannot fix it, set code to null."
         )
 
         user_content = "Error Log:\n{error_log}\n\nHTML Context:\n{html_snapshot}"
-        
-        inputs = {"error_log": error_log, "html_snapshot": html_snapshot}
-        
         if source_code:
-            # Add line numbers to source code for the LLM to reference
-            numbered_source = "\n".join([f"{i+1}: {line}" for i, line in enumerate(source_code.splitlines())])
-            # SAFE PASSING: Check if we are using f-string or literal concatenation in the previous bad version.
-            # We want to use a PLACEHOLDER in the prompt string, and data in inputs.
             user_content += "\n\nSource Code (with line numbers):\n{source_code}"
-            inputs["source_code"] = numbered_source
-
         if failing_line:
             user_content += "\n\nFailing Line:\n{failing_line}"
+
+        # Log, DOM and source share what the budget leaves after the fixed text. Source is sent
+        # line-numbered, cut to a window around the failing line plus the locators it uses.
+        fixed = system_prompt + user_content + (failing_line or "")
+        fitted, report = self.budget.fit(fixed, error_log, html_snapshot, failing_line, source_code)
+        if self.on_prompt is not None:
+            self.on_prompt(report)
+
+        # SAFE PASSING: data goes in inputs, never into the template string.
+        inputs = {"error_log": fitted["error_log"], "html_snapshot": fitted["html_snapshot"]}
+        if source_code:
+            inputs["source_code"] = fitted["source_code"]
+        if failing_line:
             inputs["failing_line"] = failing_line
 
         prompt = ChatPromptTemplate.from_messages([
@@ -76,14 +229,55 @@ class LLMClient:
             ("user", user_content)
         ])
 
-        chain = prompt | self.llm
-        response = chain.invoke(inputs)
-        
-        # Clean up Markdown code blocks if present in response
-        content = response.content.strip()
-        if content.startswith("```json"):
-            content = content[7:-3].strip()
-        elif content.startswith("```"):
-            content = content[3:-3].strip()
-            
-        return content
+        return prompt, inputs
+
+    def _streaming(self) -> bool:
+        # Streaming only pays off when someone wants the code early, and needs a backend that can
+        return self.on_code is not None and hasattr(self.backend, "stream")
+
+    def _read_chunk(self, parser: FixStreamParser, message, chunk):
+        """Feeds one streamed chunk to the parser (reporting the code once complete); returns the merged message."""
+        if isinstance(chunk.content, str):
+            code = parser.feed(chunk.content)
+            if code is not None:
+                self.on_code(code)
+        return chunk if message is None else message + chunk
+
+    def _finish(self, response, cache_key: str = None, parser: FixStreamParser = None) -> FixResult:
+        usage = getattr(response, "usage_metadata", None) or {}
+        if self.on_usage is not None:
+            self.on_usage(usage)
+
+        # The answer is parsed once (JSON, fenced or not, or bare code) into a FixResult
+        fix = parser.close("llm") if parser is not None else FixResult.parse(response.content, "llm")
+        if usage:
+            fix.usage = {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+
+        if cache_key is not None:
+            self.cache.set(cache_key, str(fix))
+
+        return fix
+
+
+# One long-lived client (and HTTP connection pool) per OpenAI key, shared by all requests.
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+MAX_POOLED_CLIENTS = int(os.getenv("DEFLAKE_MAX_POOLED_CLIENTS", 256))
+
+def get_client(openai_api_key: str = None, cache=None, on_usage=None, on_prompt=None) -> LLMClient:
+    """
+    Returns the shared LLMClient for this key, creating it on first use.
+    BYOK keys are pooled too; the least recently used client is dropped past MAX_POOLED_CLIENTS.
+    """
+    load_env()
+    api_key = openai_api_key or os.getenv("OPENAI_API_KEY") or ""
+    pool_key = hashlib.sha256(api_key.encode()).hexdigest()
+    with _clients_lock:
+        client = _clients.get(pool_key)
+        if client is None:
+            client = LLMClient(mock=False, openai_api_key=api_key or None, cache=cache, on_usage=on_usage, on_prompt=on_prompt)
+            _clients[pool_key] = client
+            while len(_clients) > MAX_POOLED_CLIENTS:
+                _clients.popitem(last=False)
+        _clients.move_to_end(pool_key)
+        return client
@@ -0,0 +1,229 @@
+"""
+Local OpenAI-compatible stand-in for the LLM, for load tests and offline runs.
+
+    python -m core.llm_standin --port 8788 --latency 0.8 --jitter 0.3 --error-rate 0.05
+    DEFLAKE_LLM_BASE_URL=http://127.0.0.1:8788/v1 python dashboard/server.py
+
+Latency and failures are scripted: either randomly (--latency/--jitter/--error-rate/--error-status)
+or as an exact sequence of steps from a JSON file (--script), e.g.
+    [{"latency": 0.2}, {"latency": 1.5}, {"status": 429, "latency": 0.05}]
+which is replayed in a loop. POST /_script swaps the script at runtime; GET /_stats reports counters.
+Streamed requests ("stream": true) get server-sent chunks: the first one after a quarter of the
+step's latency, the rest of it spread over the answer.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+FAILING_LINE_RE = re.compile(r"Failing Line:\n(.+)")
+SOURCE_LINE_RE = re.compile(r"^(\d+): ", re.MULTILINE)
+
+
+class Script:
+    """Decides latency/status per request: a fixed step sequence if given, else random draws."""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 500, steps: list = None, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.steps = itertools.cycle(steps) if steps else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Script":
+        return cls(
+            latency=float(config.get("latency", 0.5)),
+            jitter=float(config.get("jitter", 0.0)),
+            error_rate=float(config.get("error_rate", 0.0)),
+            error_status=int(config.get("error_status", 500)),
+            steps=config.get("steps"),
+            seed=config.get("seed"),
+        )
+
+    def next(self) -> dict:
+        with self._lock:
+            if self.steps is not None:
+                step = next(self.steps)
+                return {"latency": float(step.get("latency", self.latency)), "status": int(step.get("status", 200)),
+                        "content": step.get("content")}
+            latency = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            status = self.error_status if self._random.random() < self.error_rate else 200
+            return {"latency": latency, "status": status, "content": None}
+
+
+def fake_fix(messages: list) -> str:
+    """A well-formed heal answer derived from the prompt, so the pipeline after the LLM runs for real."""
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    match = FAILING_LINE_RE.search(user)
+    code = match.group(1).strip() if match else None
+    lines = [int(n) for n in SOURCE_LINE_RE.findall(user)]
+    return json.dumps({
+        "code": code,
+        "line_number": lines[len(lines) // 2] if lines else None,
+        "reason": "stand-in response",
+    })
+
+
+# Share of a step's latency spent before the first streamed chunk; chunk size in characters
+STREAM_FIRST_CHUNK = 0.25
+STREAM_CHUNK_CHARS = 16
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, script: Script, model: str = "stand-in"):
+        super().__init__(address, StandInHandler)
+        self.script = script
+        self.model = model
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, **changes):
+        with self.stats_lock:
+            for name, delta in changes.items():
+                self.stats[name] += delta
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown a load test
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/_stats":
+            with self.server.stats_lock:
+                return self._send(200, dict(self.server.stats))
+        if self.path.rstrip("/").endswith("/models"):
+            return self._send(200, {"object": "list", "data": [{"id": self.server.model, "object": "model"}]})
+        self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/_script":
+            self.server.script = Script.from_dict(self._body())
+            return self._send(200, {"status": "ok"})
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": "not found"}})
+
+        request = self._body()
+        step = self.server.script.next()
+        stream = bool(request.get("stream")) and step["status"] == 200
+        self.server.count(requests=1, in_flight=1)
+        try:
+            time.sleep(step["latency"] * (STREAM_FIRST_CHUNK if stream else 1))
+            if stream:
+                return self._stream(request, step)
+        finally:
+            self.server.count(in_flight=-1)
+        if step["status"] != 200:
+            self.server.count(errors=1)
+            return self._send(step["status"], {"error": {"message": f"stand-in scripted {step['status']}", "type": "stand_in"}})
+
+        content, usage = self._answer(request, step)
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", self.server.model),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    @staticmethod
+    def _answer(request: dict, step: dict) -> tuple:
+        messages = request.get("messages", [])
+        content = step["content"] or fake_fix(messages)
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        prompt_tokens, completion_tokens = prompt_chars // 4, len(content) // 4
+        return content, {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+
+    def _stream(self, request: dict, step: dict):
+        """Server-sent chat.completion.chunk events, ending with the usage chunk (if asked for) and [DONE]."""
+        content, usage = self._answer(request, step)
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+        pause = step["latency"] * (1 - STREAM_FIRST_CHUNK) / len(pieces)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": request.get("model", self.server.model)}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(body):
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode())
+            self.wfile.flush()
+
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(pause)
+            delta = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+            event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event({**base, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8788, script: Script = None) -> StandInServer:
+    """Starts the stand-in on a background thread and returns the server (port 0 picks a free one)."""
+    server = StandInServer((host, port), script or Script())
+    threading.Thread(target=server.serve_forever, name="deflake-llm-standin", daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=8788, show_default=True)
+@click.option('--latency', default=0.5, show_default=True, help='Mean seconds per completion.')
+@click.option('--jitter', default=0.0, show_default=True, help='Latency varies uniformly by +/- this much.')
+@click.option('--error-rate', default=0.0, show_default=True, help='Share of requests answered with --error-status.')
+@click.option('--error-status', default=500, show_default=True, help='HTTP status for scripted failures (e.g. 429).')
+@click.option('--script', 'script_file', type=click.Path(exists=True, dir_okay=False), help='JSON list of steps to replay.')
+@click.option('--seed', type=int, help='Seed for reproducible random latencies/failures.')
+def main(host, port, latency, jitter, error_rate, error_status, script_file, seed):
+    """Runs the OpenAI-compatible LLM stand-in."""
+    steps = None
+    if script_file:
+        with open(script_file) as f:
+            steps = json.load(f)
+    server = StandInServer((host, port), Script(latency, jitter, error_rate, error_status, steps, seed))
+    click.echo(f"🎭 LLM stand-in on http://{host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,591 @@
+"""
+Browser-free locator engine: evaluates CSS, XPath and Playwright / Cypress / WebdriverIO /
+Selenium locators against a captured snapshot.
+
+The snapshot is parsed with lxml. XPath is lxml's own (full XPath 1.0) and CSS is translated
+to it by cssselect. Only what browsers add on top is done here: Playwright's text and
+visibility pseudo-classes (:has-text, :text-is, :visible ...), its `css=` / `xpath=` / `text=`
+/ `>>` syntax and the getBy* family. Anything else raises Unsupported, so callers can tell
+"no match" from "can't tell".
+"""
+import re
+
+from core.dom_pruner import RAW_DROP_TAGS, get_etree
+
+# getByTestId() looks at this attribute (Playwright's default testIdAttribute)
+TEST_ID_ATTR = "data-testid"
+HIDDEN_CLASSES = {"hidden", "d-none", "invisible", "is-hidden", "visually-hidden", "sr-only"}
+HIDDEN_STYLE_RE = re.compile(r"display\s*:\s*none|visibility\s*:\s*(?:hidden|collapse)", re.IGNORECASE)
+NEVER_VISIBLE_TAGS = {"head", "title", "meta", "link", "base", "option", "datalist", "param", "source", "track"}
+# Namespace of the XPath functions the CSS pseudo-classes below are translated to
+FUNCTIONS_NS = "urn:deflake:locator-engine"
+
+# Implicit ARIA roles for getByRole (the common ones)
+INPUT_ROLES = {
+    "button": "button", "submit": "button", "reset": "button", "image": "button",
+    "checkbox": "checkbox", "radio": "radio", "range": "slider", "number": "spinbutton",
+    "search": "searchbox", "text": "textbox", "email": "textbox", "tel": "textbox", "url": "textbox",
+    "password": "textbox",
+}
+TAG_ROLES = {
+    "button": "button", "textarea": "textbox", "select": "combobox", "img": "img", "ul": "list", "ol": "list",
+    "li": "listitem", "nav": "navigation", "main": "main", "form": "form", "table": "table", "tr": "row",
+    "td": "cell", "th": "columnheader", "dialog": "dialog", "option": "option", "article": "article",
+    "h1": "heading", "h2": "heading", "h3": "heading", "h4": "heading", "h5": "heading", "h6": "heading",
+    "summary": "button", "progress": "progressbar", "aside": "complementary", "header": "banner",
+    "footer": "contentinfo", "hr": "separator",
+}
+
+
+class Unsupported(ValueError):
+    """The selector uses syntax this engine doesn't evaluate."""
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"`":
+        return re.sub(r"\\(.)", r"\1", value[1:-1])
+    return value
+
+
+class Document:
+    """
+    A snapshot parsed once by lxml (all attributes kept), with the lookups the engines share.
+    `root` is the document itself: pass it (or None) as the scope to search everything.
+    """
+
+    def __init__(self, html: str):
+        self.root, self.nodes, self.order, self.error = None, [], {}, None
+        self._text = {}
+        self._visible = {}
+        self._extensions = {
+            (FUNCTIONS_NS, "has-text"): lambda context, nodes, wanted, exact:
+                bool(nodes) and self._text_matches(self.text(nodes[0]), str(wanted), exact),
+            (FUNCTIONS_NS, "visible"): lambda context, nodes: bool(nodes) and self.is_visible(nodes[0]),
+        }
+        etree = get_etree()
+        if etree is None:
+            self.error = "lxml is not installed"
+            return
+        try:
+            top = etree.fromstring(html or "", etree.HTMLParser(remove_comments=True, remove_pis=True))
+        except (etree.XMLSyntaxError, ValueError):
+            top = None
+        if top is None:
+            return
+        # Content that is never rendered can't be a locator's target
+        etree.strip_elements(top, *RAW_DROP_TAGS, with_tail=False)
+        self.root = top.getroottree()
+        self.nodes = list(top.iter(etree.Element))
+        self.order = {node: position for position, node in enumerate(self.nodes)}
+
+    # -- tree helpers -------------------------------------------------------------------
+
+    def elements(self, node) -> list:
+        if node is self.root:
+            return [self.root.getroot()]
+        return [child for child in node if isinstance(child.tag, str)]
+
+    def descendants(self, node) -> list:
+        if node is None or node is self.root:
+            return self.nodes
+        return [child for child in node.iterdescendants() if isinstance(child.tag, str)]
+
+    def text(self, node) -> str:
+        """Whitespace-normalized text content."""
+        if node not in self._text:
+            parts = [node.text or ""]
+            for child in node:
+                if isinstance(child.tag, str):
+                    parts.append(self.text(child))
+                parts.append(child.tail or "")
+            self._text[node] = _normalize(" ".join(parts))
+        return self._text[node]
+
+    def sort(self, nodes) -> list:
+        return sorted(set(nodes), key=lambda node: self.order.get(node, -1))
+
+    def is_visible(self, node) -> bool:
+        """Best guess from markup alone: hidden attributes, inline styles and utility classes."""
+        if node not in self._visible:
+            attrs = node.attrib
+            hidden = (
+                node.tag in NEVER_VISIBLE_TAGS
+                or "hidden" in attrs
+                or (node.tag == "input" and attrs.get("type", "").lower() == "hidden")
+                or bool(HIDDEN_STYLE_RE.search(attrs.get("style", "")))
+                or bool(HIDDEN_CLASSES & set(attrs.get("class", "").split()))
+            )
+            parent = node.getparent()
+            if not hidden and parent is not None:
+                hidden = not self.is_visible(parent)
+            self._visible[node] = not hidden
+        return self._visible[node]
+
+    # -- entry points ---------------------------------------------------------------------
+
+    def css(self, selector: str, scope=None) -> list:
+        return self._evaluate(css_to_xpath(selector), scope, f"CSS '{selector}'")
+
+    def xpath(self, expression: str, scope=None) -> list:
+        expression = expression.strip()
+        if scope is not None and scope is not self.root and expression.startswith(("/", "(/")):
+            # Like Playwright, an absolute path inside a chain is taken relative to the scope
+            expression = expression.replace("/", "./", 1)
+        return self._evaluate(expression, scope, f"XPath '{expression}'")
+
+    def _evaluate(self, expression: str, scope, description: str) -> list:
+        context = self.root if scope is None else scope
+        if context is None:
+            return []
+        etree = get_etree()
+        try:
+            result = context.xpath(expression, namespaces={"dfk": FUNCTIONS_NS}, extensions=self._extensions)
+        except etree.XPathError as e:
+            raise Unsupported(f"{description}: {e}")
+        if not isinstance(result, list):
+            raise Unsupported(f"{description} is not a node set")
+        # Text and attribute results aren't elements anyone could act on
+        return self.sort(node for node in result if isinstance(node, etree._Element) and isinstance(node.tag, str))
+
+    def query(self, selector: str, scope=None) -> list:
+        """A Playwright selector string: css/xpath/text/id engines, `>>` chains, nth=."""
+        scopes = [self.root if scope is None else scope]
+        for part in _split_chain(selector):
+            part = part.strip()
+            if part.startswith("nth="):
+                index = int(part[4:])
+                scopes = scopes[index:index + 1] if index >= 0 else scopes[index:][:1]
+                continue
+            found = []
+            for current in scopes:
+                found.extend(self._query_part(part, current))
+            scopes = self.sort(found)
+        return scopes
+
+    def _query_part(self, part: str, scope) -> list:
+        engine, _, body = part.partition("=")
+        engine = engine.strip()
+        if "=" in part and re.fullmatch(r"[a-z][\w-]*", engine):
+            if engine == "css":
+                return self.css(body, scope)
+            if engine == "xpath":
+                return self.xpath(body, scope)
+            if engine == "text":
+                return self.by_text(_unquote(body), exact=body.strip()[:1] in "'\"", scope=scope)
+            if engine in ("id", TEST_ID_ATTR, "data-test", "data-test-id", "data-cy", "data-qa"):
+                attr = "id" if engine == "id" else engine
+                value = _unquote(body)
+                return [node for node in self.descendants(scope) if node.get(attr) == value]
+            if engine in ("role", "internal", "react", "vue", "alt", "placeholder", "label", "title"):
+                raise Unsupported(f"selector engine '{engine}'")
+        if part.startswith(("//", "..", "(//")):
+            return self.xpath(part, scope)
+        if part[:1] in "'\"":
+            return self.by_text(_unquote(part), exact=True, scope=scope)
+        return self.css(part, scope)
+
+    # -- getBy* ---------------------------------------------------------------------------
+
+    def _smallest(self, matches: list) -> list:
+        """Drops matches that merely contain another match (text lives in the innermost one)."""
+        # Text containment is inherited upwards, so checking direct children is enough
+        matched = set(matches)
+        return [node for node in matches if not any(child in matched for child in self.elements(node))]
+
+    @staticmethod
+    def _text_matches(actual: str, wanted, exact: bool) -> bool:
+        if isinstance(wanted, re.Pattern):
+            return bool(wanted.search(actual))
+        if exact:
+            return actual == _normalize(wanted)
+        return _normalize(wanted).lower() in actual.lower()
+
+    def by_text(self, text: str, exact: bool = False, scope=None) -> list:
+        matches = [node for node in self.descendants(scope)
+                   if node.tag not in ("html", "body", "head") and self._text_matches(self.text(node), text, exact)]
+        return self._smallest(matches)
+
+    def by_attr(self, attr: str, value: str, exact: bool = False, scope=None) -> list:
+        return [node for node in self.descendants(scope)
+                if attr in node.attrib and self._text_matches(_normalize(node.get(attr)), value, exact)]
+
+    def by_test_id(self, value: str, scope=None) -> list:
+        return [node for node in self.descendants(scope) if node.get(TEST_ID_ATTR) == value]
+
+    def by_label(self, label: str, exact: bool = False, scope=None) -> list:
+        nodes = self.descendants(scope)
+        found = [node for node in nodes
+                 if "aria-label" in node.attrib and self._text_matches(_normalize(node.get("aria-label")), label, exact)]
+        for node in nodes:
+            if node.tag != "label" or not self._text_matches(self.text(node), label, exact):
+                continue
+            target = node.get("for")
+            if target:
+                found.extend(n for n in self.nodes if n.get("id") == target)
+            else:
+                found.extend(n for n in self.descendants(node) if n.tag in ("input", "textarea", "select"))
+        return self.sort(found)
+
+    def role_of(self, node) -> str:
+        if node.get("role"):
+            return node.get("role").split()[0]
+        if node.tag == "input":
+            return INPUT_ROLES.get(node.get("type", "text").lower(), "textbox")
+        if node.tag == "a":
+            return "link" if "href" in node.attrib else ""
+        return TAG_ROLES.get(node.tag, "")
+
+    def accessible_name(self, node) -> str:
+        attrs = node.attrib
+        for attr in ("aria-label", "alt", "title"):
+            if attrs.get(attr):
+                return _normalize(attrs[attr])
+        if attrs.get("id"):
+            label = next((n for n in self.nodes if n.tag == "label" and n.get("for") == attrs["id"]), None)
+            if label is not None:
+                return self.text(label)
+        if node.tag == "input" and attrs.get("type", "").lower() in ("button", "submit", "reset"):
+            return _normalize(attrs.get("value", ""))
+        if node.tag in ("input", "textarea"):
+            return _normalize(attrs.get("placeholder", ""))
+        return self.text(node)
+
+    def by_role(self, role: str, name: str = None, exact: bool = False, scope=None, include_hidden: bool = False) -> list:
+        found = []
+        for node in self.descendants(scope):
+            if self.role_of(node) != role:
+                continue
+            if not include_hidden and not self.is_visible(node):
+                # Hidden elements aren't in the accessibility tree
+                continue
+            if name is not None and not self._text_matches(self.accessible_name(node), name, exact):
+                continue
+            found.append(node)
+        return found
+
+
+def _split_chain(selector: str) -> list:
+    """Splits a Playwright selector on `>>` outside quotes and brackets."""
+    parts, depth, quote, start = [], 0, None, 0
+    i = 0
+    while i < len(selector):
+        char = selector[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif selector.startswith(">>", i) and depth == 0:
+            parts.append(selector[start:i])
+            start = i + 2
+            i += 1
+        i += 1
+    parts.append(selector[start:])
+    return [part for part in parts if part.strip()]
+
+
+
+# ---------------------------------------------------------------------------------------
+# CSS: cssselect's translation to XPath, plus Playwright's pseudo-classes
+# ---------------------------------------------------------------------------------------
+
+_translator = None
+
+
+def _css_translator():
+    """cssselect is imported on first use; without it CSS locators are reported as unverifiable."""
+    global _translator
+    if _translator is None:
+        try:
+            from cssselect import HTMLTranslator
+        except ImportError:
+            raise Unsupported("CSS selectors need the cssselect package")
+
+        class PlaywrightTranslator(HTMLTranslator):
+            # Text and visibility are checked by the Document (dfk: functions), as getBy* sees them
+
+            def _text_condition(self, xpath, function, exact: bool):
+                if function.argument_types() not in (["STRING"], ["IDENT"]):
+                    raise Unsupported(f":{function.name}() without a literal argument")
+                value = self.xpath_literal(function.arguments[0].value)
+                return xpath.add_condition(f"dfk:has-text(., {value}, {'true()' if exact else 'false()'})")
+
+            def xpath_has_text_function(self, xpath, function):
+                return self._text_condition(xpath, function, exact=False)
+
+            xpath_text_function = xpath_contains_function = xpath_has_text_function
+
+            def xpath_text_is_function(self, xpath, function):
+                return self._text_condition(xpath, function, exact=True)
+
+            def xpath_visible_pseudo(self, xpath):
+                return xpath.add_condition("dfk:visible(.)")
+
+            def xpath_hidden_pseudo(self, xpath):
+                return xpath.add_condition("not(dfk:visible(.))")
+
+        _translator = PlaywrightTranslator()
+    return _translator
+
+
+def css_to_xpath(selector: str) -> str:
+    """XPath for a CSS selector list, matching the descendants of the context node."""
+    translator = _css_translator()
+    from cssselect import SelectorError
+
+    try:
+        return translator.css_to_xpath(selector.strip(), prefix="descendant::")
+    except SelectorError as e:
+        raise Unsupported(f"CSS '{selector}': {e}")
+
+
+
+# ---------------------------------------------------------------------------------------
+# Test code
+# ---------------------------------------------------------------------------------------
+
+CALL_NAME_RE = re.compile(r"(\$\$|\$|\b[A-Za-z_]\w*)\s*\(")
+LITERAL_RE = r"""(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`$]*`|/(?:\\.|[^/\\])+/[a-z]*|-?\d+|true|false|True|False)"""
+OPTION_RE = re.compile(r"""["']?(\w+)["']?\s*[:=]\s*(""" + LITERAL_RE + ")")
+BY_CALL_RE = re.compile(r"""By\.(\w+)\s*\(\s*(""" + LITERAL_RE + r")\s*\)")
+BY_CONST_RE = re.compile(r"""By\.([A-Z_]+)\s*,\s*(""" + LITERAL_RE + ")")
+
+# Playwright locators (strict: more than one match is an error)
+LOCATOR_CALLS = {"locator"}
+GET_BY_CALLS = {"getByTestId", "getByText", "getByRole", "getByLabel", "getByPlaceholder", "getByAltText", "getByTitle"}
+# Element handles / WebDriver / DOM lookups that act on the first match
+FIRST_MATCH_CALLS = {"$", "querySelector", "waitForSelector", "findElement", "find_element"}
+ALL_MATCH_CALLS = {"$$", "querySelectorAll", "findElements", "find_elements", "$$eval"}
+# page.click('#sel') and friends take a selector as their first argument
+PAGE_ACTIONS = {
+    "click", "dblclick", "fill", "type", "check", "uncheck", "hover", "focus", "press", "tap", "selectOption",
+    "setInputFiles", "textContent", "innerText", "innerHTML", "inputValue", "getAttribute", "isVisible",
+    "isHidden", "isEnabled", "isDisabled", "isChecked", "dispatchEvent", "$eval",
+}
+CYPRESS_CALLS = {"get", "find", "contains"}
+# Calls that work on every match, so several matches are fine
+MULTI_MATCH_CALLS = {"count", "toHaveCount", "all", "allTextContents", "allInnerTexts", "evaluateAll", "elementHandles"}
+SELENIUM_BY = {
+    "CSS_SELECTOR": "css", "cssSelector": "css", "css": "css", "XPATH": "xpath", "xpath": "xpath",
+    "ID": "id", "id": "id", "NAME": "name", "name": "name", "CLASS_NAME": "class", "className": "class",
+    "TAG_NAME": "tag", "tagName": "tag", "LINK_TEXT": "link", "linkText": "link",
+    "PARTIAL_LINK_TEXT": "partial_link", "partialLinkText": "partial_link",
+}
+
+
+def _camel(name: str) -> str:
+    """get_by_test_id -> getByTestId, so Python and JS spellings share one table."""
+    head, *rest = name.split("_")
+    return head + "".join(part[:1].upper() + part[1:] for part in rest) if rest and head else name
+
+
+def _literal(token: str):
+    token = token.strip()
+    if token[:1] in "'\"`":
+        return _unquote(token)
+    if token[:1] == "/":
+        body, _, flags = token[1:].rpartition("/")
+        return re.compile(body, re.IGNORECASE if "i" in flags else 0)
+    if token in ("true", "True"):
+        return True
+    if token in ("false", "False"):
+        return False
+    if re.fullmatch(r"-?\d+", token):
+        return int(token)
+    return None
+
+
+def _arguments(line: str, start: int):
+    """(positional literals, options, end) for the call whose '(' is at `start`."""
+    depth, quote, i = 0, None, start
+    while i < len(line):
+        char = line[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+            if depth == 0:
+                break
+        i += 1
+    inner = line[start + 1:i]
+    options = {key: _literal(value) for key, value in OPTION_RE.findall(inner)}
+    positional, depth, quote, piece = [], 0, None, ""
+    for char in inner + ",":
+        if quote:
+            quote = None if char == quote and not piece.endswith("\\") else quote
+        elif char in "'\"`":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            piece = piece.strip()
+            if piece and not OPTION_RE.fullmatch(piece) and not piece.startswith("{"):
+                positional.append(piece)
+            piece = ""
+            continue
+        piece += char
+    return positional, options, i + 1
+
+
+class Resolution:
+    """What a line of test code points at: the matched nodes and whether the action needs exactly one."""
+
+    def __init__(self, nodes: list, strict: bool, description: str):
+        self.nodes = nodes
+        self.strict = strict
+        self.description = description
+
+
+def resolve(document: Document, code_line: str) -> Resolution:
+    """
+    Evaluates the locator chain in one line of test code (Playwright, Cypress, WebdriverIO,
+    Selenium, DOM) against the document. Raises Unsupported if there is none to evaluate.
+    """
+    scopes, strict, found, consumed, parts = [document.root], True, False, 0, []
+    cypress = "cy." in code_line
+    for match in CALL_NAME_RE.finditer(code_line):
+        if match.start() < consumed:
+            continue
+        name = _camel(match.group(1))
+        args, options, end = _arguments(code_line, match.end() - 1)
+        literals = [_literal(arg) for arg in args]
+        first = literals[0] if literals else None
+
+        def each(lookup):
+            return document.sort(node for scope in scopes for node in lookup(scope))
+
+        if name in LOCATOR_CALLS | FIRST_MATCH_CALLS | ALL_MATCH_CALLS or (name in PAGE_ACTIONS and not found):
+            if name in PAGE_ACTIONS and not isinstance(first, str):
+                continue
+            if name in ("findElement", "findElements") or (not isinstance(first, str) and "By." in code_line[match.end():end]):
+                scopes = each(lambda scope: _selenium(document, code_line[match.end():end], scope))
+            elif isinstance(first, str):
+                scopes = each(lambda scope: _string_selector(document, first, scope))
+            else:
+                raise Unsupported(f"{name}() without a literal selector")
+            strict = name in LOCATOR_CALLS or name in PAGE_ACTIONS
+            if name in FIRST_MATCH_CALLS:
+                scopes, strict = scopes[:1] if scopes else scopes, False
+            elif name in ALL_MATCH_CALLS:
+                strict = False
+            if "hasText" in options or "has" in code_line[match.end():end]:
+                scopes = _filter(document, scopes, options, code_line[match.end():end])
+        elif name in GET_BY_CALLS:
+            scopes = each(lambda scope: _get_by(document, name, first, options, scope))
+            strict = True
+        elif name in CYPRESS_CALLS and cypress:
+            if name == "contains":
+                if len(literals) > 1:
+                    scopes = each(lambda scope: [n for n in document.css(literals[0], scope)
+                                                 if document._text_matches(document.text(n), literals[1], False)])
+                elif isinstance(first, (str, re.Pattern)):
+                    # The subject itself counts when none of its descendants holds the text
+                    scopes = each(lambda scope: document.by_text(first, scope=scope) or (
+                        [scope] if scope is not document.root and document._text_matches(document.text(scope), first, False)
+                        else []))
+                else:
+                    raise Unsupported("contains() without a literal")
+                scopes, strict = scopes[:1], False
+            elif isinstance(first, str):
+                scopes = each(lambda scope: document.css(first, scope))
+                strict = True
+        elif found and name in ("first", "last", "nth", "eq"):
+            index = 0 if name == "first" else -1 if name == "last" else first if isinstance(first, int) else None
+            if index is None:
+                raise Unsupported(f".{name}() without a literal index")
+            scopes = scopes[index:index + 1] if index >= 0 else scopes[index:][:1]
+            strict = False
+        elif found and name == "filter":
+            scopes = _filter(document, scopes, options, code_line[match.end():end])
+        elif found and name in MULTI_MATCH_CALLS:
+            strict = False
+            continue
+        else:
+            continue
+        found, consumed = True, end
+        parts.append(code_line[match.start(1):end])
+    if not found:
+        raise Unsupported(f"no locator to evaluate in: {code_line.strip()}")
+    return Resolution(scopes, strict, ".".join(parts))
+
+
+def _string_selector(document: Document, selector: str, scope) -> list:
+    # WebdriverIO: '=Sign in' is link text, '*=Sign' partial link text
+    if selector.startswith("*="):
+        return [n for n in document.descendants(scope) if n.tag == "a" and selector[2:] in document.text(n)]
+    if selector.startswith("="):
+        return [n for n in document.descendants(scope) if n.tag == "a" and document.text(n) == selector[1:]]
+    if selector.startswith(("aria/", "react=", "android=", "ios=", "~")):
+        raise Unsupported(f"selector '{selector}'")
+    return document.query(selector, scope)
+
+
+def _selenium(document: Document, arguments: str, scope) -> list:
+    match = BY_CALL_RE.search(arguments) or BY_CONST_RE.search(arguments)
+    if not match or match.group(1) not in SELENIUM_BY:
+        raise Unsupported(f"Selenium locator '{arguments}'")
+    how, value = SELENIUM_BY[match.group(1)], _literal(match.group(2))
+    nodes = document.descendants(scope)
+    if how == "css":
+        return document.css(value, scope)
+    if how == "xpath":
+        return document.xpath(value, scope)
+    if how in ("id", "name"):
+        return [n for n in nodes if n.get(how) == value]
+    if how == "class":
+        return [n for n in nodes if value in n.get("class", "").split()]
+    if how == "tag":
+        return [n for n in nodes if n.tag == value.lower()]
+    if how == "link":
+        return [n for n in nodes if n.tag == "a" and document.text(n) == _normalize(value)]
+    return [n for n in nodes if n.tag == "a" and value in document.text(n)]
+
+
+def _get_by(document: Document, name: str, value, options: dict, scope) -> list:
+    if not isinstance(value, (str, re.Pattern)):
+        raise Unsupported(f"{name}() without a literal argument")
+    exact = bool(options.get("exact"))
+    if name == "getByTestId":
+        return document.by_test_id(value, scope)
+    if name == "getByText":
+        return document.by_text(value, exact, scope)
+    if name == "getByRole":
+        label = options.get("name")
+        if "name" in options and not isinstance(label, (str, re.Pattern)):
+            raise Unsupported("getByRole() with a computed name")
+        include_hidden = bool(options.get("includeHidden") or options.get("include_hidden"))
+        return document.by_role(value, label, exact, scope, include_hidden)
+    if name == "getByLabel":
+        return document.by_label(value, exact, scope)
+    attr = {"getByPlaceholder": "placeholder", "getByAltText": "alt", "getByTitle": "title"}[name]
+    return document.by_attr(attr, value, exact, scope)
+
+
+def _filter(document: Document, nodes: list, options: dict, arguments: str) -> list:
+    if re.search(r"\bhas(?:Not)?\s*:|\bhas(?:_not)?\s*=", arguments):
+        raise Unsupported("filter by a nested locator")
+    for key, keep in (("hasText", True), ("hasNotText", False), ("has_text", True), ("has_not_text", False)):
+        if key in options:
+            wanted = options[key]
+            nodes = [n for n in nodes if document._text_matches(document.text(n), wanted, False) == keep]
+    return nodes
@@ -1,46 +1,169 @@
-import json
-import datetime
 import os
+import sys
 import click
-from analyzer import ErrorAnalyzer
-from llm_client import LLMClient
-from patcher import SourcePatcher
-
-def append_to_history(log_path, html_path, fix_content):
-    """Appends the fix result to history.json"""
-    history_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "history.json")
-    
-    entry = {
-        "timestamp": datetime.datetime.now().isoformat(),
-        "log_path": log_path,
-        "html_path": html_path,
-        "fix": fix_content,
-        "status": "Applied" # In a real app this might be 'Pending'
-    }
-    
-    history = []
-    if os.path.exists(history_file):
+
+# Add project root to sys.path so the CLI and the server share the `core` package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.analyzer import ErrorAnalyzer
+from core.llm_client import LLMClient
+from core.patcher import SourcePatcher, group_edits, fix_code
+from core.cache import FixCache, SQLiteBackend
+from core.batch import heal_batch, find_batch_artifacts, to_ndjson
+from core.history import HistoryStore
+from core.validator import VALIDATE_ENABLED, FixValidator, describe
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".deflake_cache.db")
+
+def append_to_history(log_path, html_path, fix_content, test_file=None, failing_line=None, status="Suggested"):
+    """
+    Appends the fix result to the history store (history.db), once its outcome is known:
+    Applied (written to the source), Rejected (refused by the validator), Failed (the patch
+    didn't go through) or Suggested (not applied). Only Applied fixes are reused later.
+    """
+    HistoryStore().append(
+        log_path=log_path,
+        html_path=html_path,
+        test_file=test_file,
+        failing_line=failing_line,
+        fix=fix_content,
+        status=status,
+    )
+
+def validated_code(validator, fix, error_log, html_snapshot, failing_line, raw_snapshot, knowledge=None, err=False,
+                   test_file=None):
+    """The code to write for a fix after replaying the candidates against the snapshot, or None."""
+    code, verdicts = validator.pick(fix, error_log, html_snapshot, failing_line, raw_snapshot, knowledge, test_file)
+    if code is None and verdicts and all(checked["status"] == "unverified" for checked in verdicts):
+        click.echo(f"🛑 Could not verify any candidate against the snapshot, not applying ({describe(verdicts)}). "
+                   "Set DEFLAKE_APPLY_UNVERIFIED=1 to apply anyway.", err=err)
+    elif code is None:
+        click.echo(f"🛑 No candidate fix resolves in the snapshot, not applying ({describe(verdicts)})", err=err)
+    elif code != fix_code(fix):
+        click.echo(f"🔁 The proposed fix doesn't resolve; applying an alternative that does: {code}", err=err)
+    elif verdicts[0]["status"] == "unverified":
+        click.echo(f"⚠️  Could not verify the fix against the snapshot ({verdicts[0]['reason']})", err=err)
+    else:
+        click.echo(f"🔬 Verified against the snapshot: {verdicts[0]['reason']}", err=err)
+    return code
+
+def run_batch(directory, client, apply, concurrency, cluster=True, validate=VALIDATE_ENABLED):
+    """
+    Heals every (log, html, source) triple found in `directory`.
+    Results are streamed to stdout as NDJSON, progress goes to stderr.
+    """
+    pairs = find_batch_artifacts(directory)
+    click.echo(f"📦 Batch mode: {len(pairs)} failures found in {directory}", err=True)
+
+    items = []
+    locations = {}
+    patcher = SourcePatcher()
+    for item_id, log_path, html_path in pairs:
+        analyzer = ErrorAnalyzer(log_path, html_path)
+        item = {
+            "id": item_id,
+            "error_log": analyzer.read_log(),
+            "html_snapshot": analyzer.read_html(),
+        }
+        file_path, line_number = analyzer.extract_location()
+        if file_path and line_number:
+            try:
+                item["failing_line"] = patcher.read_line(file_path, line_number)
+                item["test_file"] = file_path
+                locations[item_id] = (file_path, line_number)
+            except Exception as e:
+                click.echo(f"⚠️  [{item_id}] Could not read source file: {e}", err=True)
+        items.append(item)
+
+    paths = {item_id: (log_path, html_path) for item_id, log_path, html_path in pairs}
+    failing_lines = {item["id"]: item.get("failing_line") for item in items}
+    items_by_id = {item["id"]: item for item in items}
+    validator = FixValidator() if apply and validate else None
+    fixes = []
+    outcomes = []  # (item id, fix as written or proposed, status) for history, once the writes are done
+    root_causes = 0
+    for result in heal_batch(client, items, concurrency=concurrency, cluster=cluster):
+        if result["duplicate_of"] is None:
+            root_causes += 1
+        if result["status"] == "success":
+            location = locations.get(result["id"])
+            fix, status = result["fix"], "Suggested"
+            if apply and location and fix:
+                code = fix.code
+                if validator is not None:
+                    item = items_by_id[result["id"]]
+                    code = validated_code(validator, fix, item["error_log"], item["html_snapshot"], item.get("failing_line"),
+                                          ErrorAnalyzer(*paths[result["id"]]).read_snapshot(), client.knowledge, err=True,
+                                          test_file=location[0])
+                if code:
+                    fixes.append((location[0], location[1], code, failing_lines[result["id"]]))
+                    fix, status = fix.with_code(code), "Applied"
+                else:
+                    status = "Rejected"
+            outcomes.append((result["id"], fix, status))
+        click.echo(to_ndjson(result), nl=False)
+    click.echo(f"🧬 {len(items)} failures, {root_causes} root cause(s) sent to the healer", err=True)
+
+    # All fixes for a file land in one verified, atomic write
+    failed_files = apply_grouped(patcher, fixes) if fixes else set()
+    for item_id, fix, status in outcomes:
+        location = locations.get(item_id)
+        if status == "Applied" and location and location[0] in failed_files:
+            status = "Failed"
+        append_to_history(*paths[item_id], fix, location[0] if location else None, failing_lines[item_id], status)
+
+def apply_grouped(patcher, fixes) -> set:
+    """Applies batch fixes one file at a time, so a stale file doesn't block the others. Returns the files that failed."""
+    failed = set()
+    for file_path, edits in group_edits(fixes).items():
         try:
-            with open(history_file, 'r') as f:
-                history = json.load(f)
-        except json.JSONDecodeError:
-            pass # corrupted file, start over
-            
-    history.append(entry)
-    
-    with open(history_file, 'w') as f:
-        json.dump(history, f, indent=2)
+            result = patcher.apply_edits(file_path, edits)
+            click.echo(f"✅ Patched {file_path} ({len(edits)} edit(s))", err=True)
+            click.echo(result.diff, err=True, nl=False)
+        except Exception as e:
+            failed.add(file_path)
+            click.echo(f"❌ Failed to patch {file_path}: {e}", err=True)
+    return failed
+
+def print_startup_profile(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    from core.startup_profile import profile_startup
+    click.echo(profile_startup())
+    ctx.exit()
+
+def echo_prompt_size(report: dict):
+    trimmed = f", trimmed {'/'.join(report['trimmed'])}" if report["trimmed"] else ""
+    click.echo(f"📏 Prompt: {report['total']} tokens (log {report['error_log']}, DOM {report['html_snapshot']}, "
+               f"source {report['source_code']}; budget {report['budget']}{trimmed})")
 
 @click.command()
-@click.option('--log', required=True, help='Path to the error log file.')
-@click.option('--html', required=True, help='Path to the HTML snapshot file.')
+@click.option('--profile-startup', is_flag=True, is_eager=True, expose_value=False, callback=print_startup_profile,
+              help='Report the import cost of the CLI and its lazily loaded dependencies, then exit.')
+@click.option('--log', help='Path to the error log file.')
+@click.option('--html', help='Path to the HTML snapshot file.')
+@click.option('--batch', 'batch_dir', type=click.Path(exists=True, file_okay=False), help='Heal every log/snapshot pair in this directory (NDJSON output).')
+@click.option('--concurrency', default=8, show_default=True, help='Max concurrent LLM calls in batch mode.')
 @click.option('--mock', is_flag=True, help='Run in mock mode without consuming API credits.')
 @click.option('--apply', is_flag=True, help='Automatically apply the fix to the source code.')
-def main(log, html, mock, apply):
+@click.option('--no-cache', is_flag=True, help='Always consult the LLM, ignoring the local fix cache.')
+@click.option('--refresh-cache', is_flag=True, help='Drop the cached fix for this failure before healing.')
+@click.option('--no-heuristics', is_flag=True, help='Skip the local rule-based healer and always ask the LLM.')
+@click.option('--no-cluster', is_flag=True, help='In batch mode, only merge identical failures instead of clustering by root cause.')
+@click.option('--no-validate', is_flag=True, help='Apply fixes without replaying them against the HTML snapshot first.')
+def main(log, html, batch_dir, concurrency, mock, apply, no_cache, refresh_cache, no_heuristics, no_cluster, no_validate):
     """
     DeFlake Core CLI.
     Analyzes a failure and suggests a fix.
     """
+    if batch_dir:
+        cache = None if no_cache else FixCache(SQLiteBackend(os.getenv("DEFLAKE_CACHE_PATH", CACHE_FILE)))
+        run_batch(batch_dir, LLMClient(mock=mock, cache=cache, heuristics=False if no_heuristics else None), apply, concurrency,
+                  cluster=not no_cluster, validate=VALIDATE_ENABLED and not no_validate)
+        return
+    if not log or not html:
+        raise click.UsageError("--log and --html are required (or use --batch <dir>).")
+
     click.echo(f"🚑 DeFlake is examining the patient...")
     click.echo(f"   Log: {log}")
     click.echo(f"   HTML: {html}")
@@ -71,27 +194,50 @@ def main(log, html, mock, apply):
         click.echo("✅ Input files read successfully.")
 
         # Step 2: Consult the Oracle (LLM)
-        client = LLMClient(mock=mock)
-        click.echo("🧠 Consulting the AI brain...")
-        fix = client.heal(log_content, html_content, failing_line)
+        cache = None
+        if not no_cache:
+            cache = FixCache(SQLiteBackend(os.getenv("DEFLAKE_CACHE_PATH", CACHE_FILE)))
+            if refresh_cache:
+                cache.invalidate(cache.key_for(log_content, html_content, failing_line))
 
-        # Step 3: Record History
-        append_to_history(log, html, fix)
-        click.echo("📜 Added to history.")
+        # The answer is streamed; the fixed line is shown as soon as the model has written it
+        client = LLMClient(mock=mock, cache=cache, heuristics=False if no_heuristics else None, on_prompt=echo_prompt_size,
+                           on_code=lambda code: click.echo(f"💡 Proposed fix: {code}"))
+        click.echo("🧠 Consulting the AI brain...")
+        fix = client.heal(log_content, html_content, failing_line, test_file=file_path)
+        if client.knowledge_hits:
+            click.echo("📚 Reused a fix that worked before for this locator (no tokens spent).")
+        elif client.heuristic_hits:
+            click.echo("🧩 Solved by local heuristics (no tokens spent).")
+        elif cache is not None and cache.hits:
+            click.echo("⚡ Served from fix cache (no tokens spent).")
 
-        # Step 4: Apply Patch (if requested)
+        # Step 3: Apply Patch (if requested)
+        written, status = fix, "Suggested"
         if apply and file_path and line_number and failing_line:
             click.echo("💉 Auto-Applying Patch...")
             try:
                 # Basic safety check: ensure the fix looks like code
-                if len(fix.strip()) > 0:
-                    patcher.replace_line(file_path, line_number, fix)
-                    click.echo(f"✅ Successfully patched {file_path}")
-                else:
+                code = fix_code(fix)
+                if not code:
                     click.echo("⚠️  Fix was empty, skipping patch.")
+                elif VALIDATE_ENABLED and not no_validate:
+                    code = validated_code(FixValidator(), fix, log_content, html_content, failing_line,
+                                          analyzer.read_snapshot(), client.knowledge, test_file=file_path)
+                    if code is None:
+                        status = "Rejected"
+                if code:
+                    patcher.replace_line(file_path, line_number, code, expected=failing_line)
+                    written, status = fix.with_code(code), "Applied"
+                    click.echo(f"✅ Successfully patched {file_path}")
             except Exception as e:
+                status = "Failed"
                 click.echo(f"❌ Failed to apply patch: {e}")
 
+        # Step 4: Record History (what was actually written, and whether it was)
+        append_to_history(log, html, written, file_path, failing_line, status)
+        click.echo(f"📜 Added to history ({status}).")
+
         # Step 5: Prescribe
         click.echo("\n" + "="*40)
         click.echo("flake-fixer-1.0-result")
@@ -1,42 +1,209 @@
+import difflib
 import os
+import tempfile
+import textwrap
+
+from core.fix import FixResult
+
+
+class PatchConflict(Exception):
+    """The source changed since the failure was captured (or two edits touch the same line)."""
+
+
+class Edit:
+    """One line replacement. `expected` is the original line (stripped) and is verified before writing."""
+
+    def __init__(self, line_number: int, new_content: str, expected: str = None):
+        self.line_number = line_number
+        self.new_content = new_content
+        self.expected = expected
+
+    def __repr__(self):
+        return f"Edit(line={self.line_number})"
+
+
+class PatchResult:
+    """Outcome of patching one file: the diff, where each edit landed, and what is needed to roll back."""
+
+    def __init__(self, file_path: str, original: str, patched: str, line_map: dict):
+        self.file_path = file_path
+        self.original = original
+        self.patched = patched
+        # original line number -> (first, last) line number of the replacement in the patched file
+        self.line_map = line_map
+
+    @property
+    def diff(self) -> str:
+        return "".join(difflib.unified_diff(
+            self.original.splitlines(keepends=True),
+            self.patched.splitlines(keepends=True),
+            fromfile=f"a/{self.file_path.lstrip('/')}",
+            tofile=f"b/{self.file_path.lstrip('/')}",
+        ))
+
+    def rollback_record(self) -> dict:
+        return {"file_path": self.file_path, "original": self.original, "patched": self.patched}
+
+
+def fix_code(fix) -> str:
+    """
+    The code to write for a fix: a FixResult's `code`, or that of a stored/raw answer
+    (JSON {code, line_number, reason} or bare code, fenced or not) parsed the same way.
+    """
+    return FixResult.parse(fix).code or ""
+
+
+def group_edits(fixes: list) -> dict:
+    """
+    Groups (file_path, line_number, new_content[, expected]) tuples into {file_path: [Edit]}.
+    Identical fixes for the same line (e.g. several tests failing on one shared locator)
+    collapse into one edit.
+    """
+    grouped = {}
+    seen = {}
+    for fix in fixes:
+        file_path, line_number, new_content = fix[:3]
+        expected = fix[3] if len(fix) > 3 else None
+        new_content = fix_code(new_content)
+        if not new_content:
+            continue
+        previous = seen.get((file_path, line_number))
+        if previous is not None and previous.strip() == new_content.strip():
+            continue
+        seen[(file_path, line_number)] = new_content
+        grouped.setdefault(file_path, []).append(Edit(line_number, new_content, expected))
+    return grouped
+
+
+def atomic_write(file_path: str, content: str):
+    """Writes via a temp file in the same directory + rename, so readers never see a half-written file."""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".deflake-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, os.stat(file_path).st_mode)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 
 class SourcePatcher:
-    def read_line(self, file_path: str, line_number: int) -> str:
-        """Reads a specific line from a file (1-indexed)."""
+    def __init__(self):
+        # path -> (mtime_ns, size, lines); avoids rereading a file for every line lookup
+        self._files = {}
+
+    def _read_lines(self, file_path: str) -> list:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Source file not found: {file_path}")
-        
+        stat = os.stat(file_path)
+        cached = self._files.get(file_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
         with open(file_path, 'r') as f:
             lines = f.readlines()
-            
+        self._files[file_path] = (stat.st_mtime_ns, stat.st_size, lines)
+        return lines
+
+    def read_line(self, file_path: str, line_number: int) -> str:
+        """Reads a specific line from a file (1-indexed)."""
+        lines = self._read_lines(file_path)
+
         if line_number < 1 or line_number > len(lines):
             raise IndexError(f"Line {line_number} is out of range for file {file_path}")
-            
+
         return lines[line_number - 1].strip()
 
-    def replace_line(self, file_path: str, line_number: int, new_content: str) -> bool:
+    def replace_line(self, file_path: str, line_number: int, new_content: str, expected: str = None) -> bool:
         """
-        Replaces a specific line in a file with new content.
-        Backs up the original line implicitly by rewriting the file.
+        Replaces a specific line in a file with new content (atomically).
+        If `expected` is given, the current line must still match it.
         Returns True if successful.
         """
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"Source file not found: {file_path}")
-            
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            
-        if line_number < 1 or line_number > len(lines):
-            raise IndexError(f"Line {line_number} out of range")
-        
-        # Preserve indentation of the original line
-        original_line = lines[line_number - 1]
-        indentation = original_line[:len(original_line) - len(original_line.lstrip())]
-        
-        # Construct the new line: indentation + new code + newline
-        lines[line_number - 1] = f"{indentation}{new_content.strip()}\n"
-        
-        with open(file_path, 'w') as f:
-            f.writelines(lines)
-            
+        self.apply_edits(file_path, [Edit(line_number, new_content, expected)])
+        return True
+
+    def plan_edits(self, file_path: str, edits: list) -> PatchResult:
+        """
+        Computes the patched content for `edits` without touching the disk.
+        Line numbers refer to the original file; multi-line replacements shift
+        the lines below them, which line_map records.
+        """
+        lines = self._read_lines(file_path)
+        original = "".join(lines)
+
+        by_line = {}
+        for edit in edits:
+            if edit.line_number < 1 or edit.line_number > len(lines):
+                raise IndexError(f"Line {edit.line_number} out of range")
+            if edit.line_number in by_line:
+                raise PatchConflict(f"{file_path}:{edit.line_number} has more than one edit")
+            current = lines[edit.line_number - 1].strip()
+            if edit.expected is not None and current != edit.expected.strip():
+                raise PatchConflict(
+                    f"{file_path}:{edit.line_number} changed since the failure was captured "
+                    f"(expected {edit.expected.strip()!r}, found {current!r})"
+                )
+            by_line[edit.line_number] = edit
+
+        patched_lines = []
+        line_map = {}
+        for number, line in enumerate(lines, start=1):
+            edit = by_line.get(number)
+            if edit is None:
+                patched_lines.append(line)
+                continue
+            # Preserve indentation of the original line (relative indentation of multi-line fixes is kept)
+            indentation = line[:len(line) - len(line.lstrip())]
+            replacement = textwrap.dedent(edit.new_content.strip("\n")).strip().splitlines() or [""]
+            first = len(patched_lines) + 1
+            for new_line in replacement:
+                patched_lines.append(f"{indentation}{new_line}\n" if new_line.strip() else "\n")
+            line_map[number] = (first, len(patched_lines))
+
+        return PatchResult(file_path, original, "".join(patched_lines), line_map)
+
+    def apply_edits(self, file_path: str, edits: list, dry_run: bool = False) -> PatchResult:
+        """Applies all edits for one file in a single read and a single atomic write."""
+        result = self.plan_edits(file_path, edits)
+        if not dry_run:
+            atomic_write(file_path, result.patched)
+            self._files.pop(file_path, None)
+        return result
+
+    def apply_many(self, fixes: list, dry_run: bool = False) -> list:
+        """
+        Applies fixes across many files as one transaction.
+        `fixes` is a list of (file_path, line_number, new_content[, expected]).
+        Every file is planned (and verified) before anything is written; if a write
+        fails, files already written are rolled back.
+        """
+        plans = [self.plan_edits(file_path, edits) for file_path, edits in group_edits(fixes).items()]
+        if dry_run:
+            return plans
+
+        written = []
+        try:
+            for plan in plans:
+                atomic_write(plan.file_path, plan.patched)
+                self._files.pop(plan.file_path, None)
+                written.append(plan)
+        except Exception:
+            for plan in written:
+                self.rollback(plan)
+            raise
+        return plans
+
+    def rollback(self, result: PatchResult) -> bool:
+        """Restores the original content, unless the file was edited again after the patch."""
+        with open(result.file_path, 'r') as f:
+            if f.read() != result.patched:
+                raise PatchConflict(f"{result.file_path} was modified after patching; not rolling back")
+        atomic_write(result.file_path, result.original)
+        self._files.pop(result.file_path, None)
         return True
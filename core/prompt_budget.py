@@ -0,0 +1,278 @@
+import hashlib
+import os
+import re
+import threading
+
+from core.dom_pruner import DomPruner
+
+# Total prompt size (system + user message) a heal may use
+PROMPT_TOKENS = int(os.getenv("DEFLAKE_PROMPT_TOKENS", 6000))
+# Source lines kept on each side of the failing line before the window has to shrink
+SOURCE_WINDOW = int(os.getenv("DEFLAKE_SOURCE_WINDOW", 25))
+# Starting split of the budget left after the fixed parts; whatever a section doesn't need goes to the others
+SHARES = {"html_snapshot": 0.55, "source_code": 0.3, "error_log": 0.15}
+# tiktoken encoding for gpt-4o; "estimate" skips tiktoken entirely
+TOKENIZER = os.getenv("DEFLAKE_TOKENIZER", "o200k_base")
+# tiktoken fetches encodings from this URL (no timeout) unless a good copy is in its cache dir;
+# only a cached file whose hash matches is used, so nothing is ever downloaded at heal time
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken"
+ENCODING_SHA256 = {
+    "o200k_base": "446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d",
+    "cl100k_base": "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7",
+}
+
+# Roughly how GPT tokenizers pre-split text: words, numbers, punctuation runs, whitespace
+PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]+|\s+")
+LINE_REF_RE = re.compile(r"^Line (\d+)$")
+LOCATION_RE = re.compile(r"Location: .+:(\d+)")
+IDENT_RE = re.compile(r"\b[A-Za-z_$][\w$]*\b")
+KEYWORDS = {
+    "await", "async", "const", "let", "var", "this", "self", "page", "return", "new", "function",
+    "expect", "def", "if", "else", "for", "while", "true", "false", "null", "None", "True", "False",
+}
+
+
+def cached_encoding_file(name: str):
+    """
+    Path of a verified copy of tiktoken encoding `name` in TIKTOKEN_CACHE_DIR, or None.
+    Fill it ahead of time (e.g. at image build) with:
+    TIKTOKEN_CACHE_DIR=dir python -c "import tiktoken; tiktoken.get_encoding('o200k_base')"
+    """
+    cache_dir = os.getenv("TIKTOKEN_CACHE_DIR")
+    if not cache_dir or name not in ENCODING_SHA256:
+        return None
+    path = os.path.join(cache_dir, hashlib.sha1(ENCODING_URL.format(name).encode()).hexdigest())
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # A stale or corrupt copy would make tiktoken download the file again
+    return path if hashlib.sha256(data).hexdigest() == ENCODING_SHA256[name] else None
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken when its encoding file is already in TIKTOKEN_CACHE_DIR, otherwise
+    with a regex estimate that tracks it closely for code, logs and HTML. Nothing is downloaded.
+    """
+
+    _encoding = None
+    _loaded = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def encoding(cls):
+        if not cls._loaded:
+            with cls._lock:
+                if not cls._loaded:
+                    if TOKENIZER != "estimate":
+                        try:
+                            import tiktoken
+                            if cached_encoding_file(TOKENIZER) is None:
+                                raise FileNotFoundError(f"{TOKENIZER} is not in TIKTOKEN_CACHE_DIR")
+                            cls._encoding = tiktoken.get_encoding(TOKENIZER)
+                        except Exception as e:
+                            print(f"⚠️  tiktoken unavailable ({e}); estimating token counts.")
+                    cls._loaded = True
+        return cls._encoding
+
+    def count(self, text: str, limit: int = None) -> int:
+        """Token count of `text`; with `limit`, counting may stop at the first value above it."""
+        if not text:
+            return 0
+        encoding = self.encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        tokens = 0
+        for match in PIECE_RE.finditer(text):
+            if limit is not None and tokens > limit:
+                break
+            piece = match.group()
+            if piece.isspace():
+                # Single spaces merge into the next word; newlines and indentation cost a token
+                tokens += 1 if "\n" in piece or len(piece) > 1 else 0
+            elif piece[0].isalpha():
+                tokens += (len(piece) + 3) // 4
+            elif piece[0].isdigit():
+                tokens += 1
+            else:
+                tokens += len(piece)
+        return tokens
+
+
+class PromptBudget:
+    """
+    Fits a heal's error log, DOM and source into a fixed token budget.
+    Source is cut to a window around the failing line, plus the lines defining locators
+    that line refers to; original line numbers are kept so the LLM's answer still applies.
+    """
+
+    def __init__(self, max_tokens: int = PROMPT_TOKENS, window: int = SOURCE_WINDOW, counter: TokenCounter = None):
+        self.max_tokens = max_tokens
+        self.window = window
+        self.counter = counter or TokenCounter()
+
+    def fit(self, fixed: str, error_log: str, html_snapshot: str, failing_line: str = None,
+            source_code: str = None) -> tuple:
+        """
+        Returns ({error_log, html_snapshot, source_code}, report). `fixed` is the text sent
+        regardless (system prompt, labels, failing line); the report has token counts per section.
+        """
+        count = self.counter.count
+        fixed_tokens = count(fixed)
+        available = max(0, self.max_tokens - fixed_tokens)
+        target = self.target_line(error_log, failing_line, source_code)
+        source_lines = source_code.splitlines() if source_code else []
+        full = {
+            "error_log": error_log or "",
+            "html_snapshot": html_snapshot or "",
+            "source_code": number_lines(source_lines, range(1, len(source_lines) + 1)),
+        }
+        # Past `available` the exact size doesn't matter, only that the section must be cut
+        needs = {name: count(text, limit=available) for name, text in full.items()}
+        budgets = self.allocate(needs, available)
+
+        fitted = {
+            "error_log": self.fit_log(full["error_log"], needs["error_log"], budgets["error_log"]),
+            "html_snapshot": self.fit_dom(full["html_snapshot"], error_log, needs["html_snapshot"], budgets["html_snapshot"]),
+            "source_code": self.fit_source(source_code, full["source_code"], needs["source_code"], budgets["source_code"],
+                                           target, failing_line) if source_code else "",
+        }
+        sections = {name: count(text) for name, text in fitted.items()}
+        report = {
+            "budget": self.max_tokens,
+            "fixed": fixed_tokens,
+            **sections,
+            "total": fixed_tokens + sum(sections.values()),
+            "trimmed": [name for name in fitted if sections[name] < needs[name]],
+        }
+        return fitted, report
+
+    @staticmethod
+    def allocate(needs: dict, available: int) -> dict:
+        """Splits `available` by SHARES, then hands what small sections leave over to the larger ones."""
+        budgets = {name: 0 for name in needs}
+        remaining = available
+        pending = [name for name in SHARES if needs[name]]
+        while pending and remaining > 0:
+            share_total = sum(SHARES[name] for name in pending)
+            grants = {name: int(remaining * SHARES[name] / share_total) for name in pending}
+            satisfied = [name for name in pending if needs[name] - budgets[name] <= grants[name]]
+            if not satisfied:
+                for name in pending:
+                    budgets[name] += grants[name]
+                break
+            for name in satisfied:
+                remaining -= needs[name] - budgets[name]
+                budgets[name] = needs[name]
+                pending.remove(name)
+        return budgets
+
+    def fit_log(self, log: str, need: int, budget: int) -> str:
+        """Keeps the head (error message) and tail (innermost frames / Location) of the log."""
+        if need <= budget:
+            return log
+        lines = log.splitlines()
+        head, tail = [], []
+        used = self.counter.count("... [log trimmed] ...\n")
+        # Two thirds of the budget for the head, the rest for the tail
+        while lines and used < budget * 2 // 3:
+            cost = self.counter.count(lines[0] + "\n")
+            if used + cost > budget * 2 // 3 and head:
+                break
+            head.append(lines.pop(0))
+            used += cost
+        while lines:
+            cost = self.counter.count(lines[-1] + "\n")
+            if used + cost > budget:
+                break
+            tail.insert(0, lines.pop())
+            used += cost
+        text = "\n".join(head + ["... [log trimmed] ..."] + tail)
+        return self.truncate(text, budget)
+
+    def fit_dom(self, html: str, error_log: str, need: int, budget: int) -> str:
+        if need <= budget:
+            return html
+        # Prune again around the failing selector at the smaller budget, then hard-cap
+        pruned = DomPruner(max_tokens=max(1, budget)).prune(html, error_log or "")
+        return self.truncate(pruned, budget)
+
+    def fit_source(self, source: str, numbered: str, need: int, budget: int, target: int, failing_line: str) -> str:
+        if need <= budget:
+            return numbered
+        lines = source.splitlines()
+        if not target:
+            # Nowhere to center the window: keep the top of the file (imports, class, locators)
+            return self.truncate(numbered, budget)
+
+        definitions = locator_definitions(lines, lines[target - 1] + "\n" + (failing_line or ""))
+        radius = self.window
+        while True:
+            keep = set(range(max(1, target - radius), min(len(lines), target + radius) + 1)) | definitions
+            text = number_lines(lines, sorted(keep))
+            if radius == 0 or self.counter.count(text) <= budget:
+                return self.truncate(text, budget)
+            radius //= 2
+
+    def truncate(self, text: str, budget: int) -> str:
+        if self.counter.count(text) <= budget:
+            return text
+        # Cut proportionally (a couple of passes converge for any tokenizer)
+        marker = "...[TRUNCATED]"
+        for _ in range(4):
+            keep = max(0, int(len(text) * budget / max(1, self.counter.count(text))) - len(marker))
+            text = text[:keep] + marker
+            if self.counter.count(text) <= budget:
+                break
+        return text
+
+    @staticmethod
+    def target_line(error_log: str, failing_line: str, source_code: str):
+        """1-based line of the failure in source_code, or None."""
+        if not source_code:
+            return None
+        lines = source_code.splitlines()
+        candidates = []
+        if failing_line:
+            ref = LINE_REF_RE.match(failing_line.strip())
+            if ref:
+                candidates.append(int(ref.group(1)))
+            else:
+                wanted = failing_line.strip()
+                candidates.extend(i + 1 for i, line in enumerate(lines) if wanted and line.strip() == wanted)
+        location = LOCATION_RE.search(error_log or "")
+        if location:
+            candidates.append(int(location.group(1)))
+        for line_number in candidates:
+            if 1 <= line_number <= len(lines):
+                return line_number
+        return None
+
+
+def number_lines(lines: list, numbers: list) -> str:
+    """'N: code' for the given 1-based line numbers, with '...' where lines were skipped."""
+    out = []
+    previous = 0
+    for number in numbers:
+        if number > previous + 1:
+            out.append("...")
+        out.append(f"{number}: {lines[number - 1]}")
+        previous = number
+    if previous and previous < len(lines):
+        out.append("...")
+    return "\n".join(out)
+
+
+def locator_definitions(lines: list, code: str) -> set:
+    """Line numbers where identifiers used in `code` are defined (`this.x =`, `x:`, `get x()`, `def x(`)."""
+    names = {name for name in IDENT_RE.findall(code) if name not in KEYWORDS}
+    if not names:
+        return set()
+    alternation = "|".join(re.escape(name) for name in sorted(names))
+    definition = re.compile(
+        rf"(?:\b(?:this|self)\.|\b(?:const|let|var)\s+|^\s*(?:readonly\s+|private\s+|public\s+)*)(?:{alternation})\s*(?:=(?!=)|:)"
+        rf"|\bget\s+(?:{alternation})\s*\(|\bdef\s+(?:{alternation})\s*\("
+    )
+    return {i + 1 for i, line in enumerate(lines) if definition.search(line)}
@@ -0,0 +1,416 @@
+"""
+Multi-framework failure scanner.
+
+    python -m core.scanner demo-project/test-results            # NDJSON, one record per failure
+    python -m core.scanner results/ --workers 8 --summary
+
+Walks a results tree (Playwright test-results/ with error-context.md, runner stdout logs,
+Cypress / WebdriverIO / Selenium logs, Python tracebacks, JUnit XML, deflake_context/)
+and emits one normalized record per failure:
+    {id, framework, file, line, column, selector, error_kind, message, code, test,
+     log_path, html_path, context_path}
+Directories are listed on a thread pool and files parsed on a process pool; every file is
+read once, line by line, so memory stays flat whatever the log size.
+"""
+import gzip
+import json
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import click
+
+# Below this many files, forking workers costs more than it saves
+PARALLEL_THRESHOLD = int(os.getenv("DEFLAKE_SCAN_PARALLEL_THRESHOLD", 64))
+SKIP_DIRS = {"node_modules", ".git", "__pycache__", ".venv", "venv", "playwright-report", "screenshots", "videos"}
+LOG_SUFFIXES = (".log", ".log.gz", ".txt", ".out")
+CONTEXT_FILE = "error-context.md"
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# "  1) [chromium] › tests/login.spec.ts:12:5 › Login › rejects bad password" starts a Playwright failure
+PW_HEADER_RE = re.compile(r"^\s*\d+\) \[[^\]]+\] › (\S+?):(\d+):\d+ › (.+?)[\s─]*$")
+CONTEXT_RE = re.compile(r"^\s*Error Context: (\S+)")
+# Explicit location: the pytest plugin's "Location: f:l", error-context.md's "- Location: f:l:c"
+LOCATION_RE = re.compile(r"^\s*(?:- )?Location: (.+?):(\d+)(?::(\d+))?\s*$")
+JS_FRAME_RE = re.compile(r"^\s*at (?:.*? \()?(?:webpack://[^/]*/|file://)?(?:\./)?([^\s()]+?\.[cm]?[jt]sx?):(\d+):(\d+)\)?\s*$")
+PY_FRAME_RE = re.compile(r'^\s*File "(.+?\.py)", line (\d+)')
+PYTEST_FRAME_RE = re.compile(r"^(\S+?\.py):(\d+): \w")
+# Playwright's code frame: ">  27 |     await page.fill('input[name=user]', 'me');"
+CODE_FRAME_RE = re.compile(r"^\s*>\s*(\d+) \| (.*)$")
+# Source lines around it, and the caret line under it
+CODE_CONTEXT_RE = re.compile(r"^\s*(?:\d+ )?\|")
+TEST_NAME_RE = re.compile(r"^\s*(?:- Name|Test Failed): (.+?)\s*$")
+MESSAGE_RE = re.compile(r"^\s*(?:E\s+)?((?:[\w.]+\.)?\w*(?:Error|Exception)\b:?.*|Error: .+|[A-Za-z]\w*\.\w+: .+)$")
+LIBRARY_PATH_RE = re.compile(r"node_modules|site-packages|dist-packages|<frozen|/lib/python\d|^internal/|^node:|__cypress/runner")
+
+# What the step was looking for; the first pattern that matches in a record wins
+SELECTOR_PATTERNS = [
+    ("playwright", re.compile(r"waiting for (?:[\w.]+\.)?locator\((['\"`])(?P<sel>.+?)\1\)")),
+    ("playwright", re.compile(r"waiting for (?P<sel>(?:get_by|getBy)\w+\(.+?\))(?:\[\d+m)?\s*$")),
+    ("cypress", re.compile(r"Expected to find element: `(?P<sel>.+?)`")),
+    ("webdriverio", re.compile(r"element \((['\"])(?P<sel>.+?)\1\)")),
+    ("webdriverio", re.compile(r"element with selector (['\"])(?P<sel>.+?)\1")),
+    ("selenium", re.compile(r"\"selector\":\s*\"(?P<sel>(?:\\.|[^\"\\])+)\"")),
+    (None, re.compile(r"waitForSelector\((['\"`])(?P<sel>.+?)\1")),
+]
+SELECTOR_KEYS = ("waiting for", "element", "selector", "waitForSelector")
+# Error kinds, most specific first: a record takes the earliest kind any of its lines matches
+ERROR_KINDS = [
+    ("strict_mode", r"strict mode violation|resolved to \d+ elements"),
+    ("detached", r"not attached to the DOM|detached from (?:the )?DOM|StaleElementReference|element is not attached"),
+    ("not_visible", r"not visible|not displayed|outside of the viewport|intercepts pointer events|is being covered|"
+                    r"ElementNotInteractable|ElementClickIntercepted|not interactable"),
+    ("not_found", r"never found it|NoSuchElement|Unable to locate element|wasn't found|no such element|"
+                  r"still not existing|resolved to 0 elements"),
+    ("assertion", r"AssertionError|expect\(|\.to(?:Have|Be|Equal|Contain)\w*\(|\bassert "),
+    ("timeout", r"Timeout \d+ms exceeded|TimeoutError|TimeoutException|Timed out retrying|timed out"),
+    ("navigation", r"net::ERR_|NS_ERROR_|page\.goto:"),
+]
+ERROR_KIND_RE = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in ERROR_KINDS))
+KIND_RANK = {name: rank for rank, (name, _) in enumerate(ERROR_KINDS)}
+FRAMEWORK_SIGNS = [
+    ("cypress", re.compile(r"\bcy\.\w+\(|Timed out retrying|\.cy\.[jt]sx?\b|[Cc]ypress")),
+    ("webdriverio", re.compile(r"webdriverio|wdio|\.e2e\.[jt]s\b|element \(\"")),
+    ("playwright", re.compile(r"waiting for (?:[\w.]+\.)?(?:locator|get_?[bB]y)|\bpage\.\w+: |playwright")),
+    ("selenium", re.compile(r"selenium|NoSuchElementException|WebDriverException")),
+]
+
+
+def iter_lines(path: str):
+    """Lines of a (possibly gzipped) text file, read incrementally."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield line.rstrip("\r\n")
+
+
+class FailureParser:
+    """
+    Line-at-a-time parser for failure output. Feed every line, then close() for the records:
+    one per Playwright failure header, or a single one for the whole text.
+    """
+
+    def __init__(self, source: str = None, framework: str = None):
+        self.source = source
+        self.framework = framework
+        self.records = []
+        self.current = None
+        self.in_snapshot = False
+
+    def _start(self, test: str = None):
+        self.current = {
+            "framework": self.framework, "file": None, "line": None, "column": None, "selector": None,
+            "error_kind": None, "message": None, "code": None, "test": test, "context_path": None,
+            "_location": None, "_header": None, "_js_frame": None, "_py_frame": None, "_signs": set(),
+        }
+        self.records.append(self.current)
+
+    def feed(self, line: str):
+        if "\x1b" in line:
+            line = ANSI_RE.sub("", line)
+        if line.startswith("```"):
+            # error-context.md: the aria page snapshot is long and never holds the error
+            if self.in_snapshot or line.startswith("```yaml"):
+                self.in_snapshot = not self.in_snapshot
+                return
+        if self.in_snapshot or not line.strip():
+            return
+
+        text = line.lstrip()
+        first = text[0]
+        if first.isdigit():
+            header = PW_HEADER_RE.match(line)
+            if header:
+                self._start(header.group(3))
+                self.current["_header"] = (header.group(1), int(header.group(2)), None)
+                self.current["_signs"].add("playwright")
+                return
+        if self.current is None:
+            self._start()
+        record = self.current
+
+        # Structural lines, told apart by how they start so most lines cost one or two checks
+        if first == ">":
+            code = CODE_FRAME_RE.match(line)
+            if code:
+                if record["code"] is None:
+                    record["code"] = code.group(2).strip()
+                return
+        elif first == "|" or (first.isdigit() and CODE_CONTEXT_RE.match(line)):
+            return
+        elif text.startswith("at "):
+            frame = JS_FRAME_RE.match(line)
+            if frame:
+                self._sign(record, frame.group(1))
+                # JS stacks list the innermost frame first
+                if record["_js_frame"] is None and not LIBRARY_PATH_RE.search(frame.group(1)):
+                    record["_js_frame"] = (frame.group(1), int(frame.group(2)), int(frame.group(3)))
+                return
+        elif text.startswith(("Location: ", "- Location: ")):
+            location = LOCATION_RE.match(line)
+            if location:
+                if record["_location"] is None:
+                    record["_location"] = (location.group(1), int(location.group(2)),
+                                           int(location.group(3)) if location.group(3) else None)
+                return
+        elif text.startswith("Error Context: "):
+            record["context_path"] = CONTEXT_RE.match(line).group(1)
+            return
+        elif text.startswith(("- Name: ", "Test Failed: ")):
+            if record["test"] is None:
+                record["test"] = TEST_NAME_RE.match(line).group(1)
+            return
+        if ".py" in text:
+            frame = PY_FRAME_RE.match(line) or PYTEST_FRAME_RE.match(line)
+            if frame:
+                self._sign(record, frame.group(1))
+                # Python tracebacks list the innermost frame last
+                if not LIBRARY_PATH_RE.search(frame.group(1)):
+                    record["_py_frame"] = (frame.group(1), int(frame.group(2)), None)
+                return
+
+        if first == "E" and text.startswith("E "):
+            text = text[1:].lstrip()  # pytest's error lines
+        message = MESSAGE_RE.match(text)
+        if message:
+            if record["message"] is None:
+                record["message"] = message.group(1).strip()
+            self._sign(record, text)
+        if record["selector"] is None and any(key in text for key in SELECTOR_KEYS):
+            for framework, pattern in SELECTOR_PATTERNS:
+                match = pattern.search(text)
+                if match:
+                    record["selector"] = match.group("sel")
+                    if framework:
+                        record["_signs"].add(framework)
+                    break
+        # Kinds show up in the message and in Playwright's call log ("- element is not visible")
+        if (message or first == "-") and record["error_kind"] != "strict_mode":
+            for match in ERROR_KIND_RE.finditer(text):
+                if record["error_kind"] is None or KIND_RANK[match.lastgroup] < KIND_RANK[record["error_kind"]]:
+                    record["error_kind"] = match.lastgroup
+
+    @staticmethod
+    def _sign(record: dict, text: str):
+        for framework, pattern in FRAMEWORK_SIGNS:
+            if framework not in record["_signs"] and pattern.search(text):
+                record["_signs"].add(framework)
+
+    def close(self) -> list:
+        records = []
+        for record in self.records:
+            # Explicit location first, then the innermost user frame, then the test's own declaration
+            where = record["_location"] or record["_js_frame"] or record["_py_frame"] or record["_header"]
+            if where:
+                record["file"], record["line"], record["column"] = where
+            if record["selector"] is None and record["code"]:
+                from core.heuristics import find_locator
+                locator = find_locator(record["code"], "")
+                record["selector"] = locator.value if locator else None
+            if record["framework"] is None:
+                signs = record["_signs"]
+                record["framework"] = next((name for name in ("playwright", "cypress", "webdriverio", "selenium") if name in signs), None)
+                if record["framework"] is None:
+                    record["framework"] = "python" if record["_py_frame"] else ("deflake" if record["_location"] else "unknown")
+            if (record["message"] is None and record["error_kind"] is None and where is None
+                    and record["context_path"] is None and not (self.source or "").endswith(CONTEXT_FILE)):
+                # Nothing that looks like a failure (e.g. a runner banner before the first header)
+                continue
+            if record["message"] or record["error_kind"]:
+                record["error_kind"] = record["error_kind"] or "error"
+            for key in [key for key in record if key.startswith("_")]:
+                del record[key]
+            records.append(record)
+        return records
+
+
+def parse_log(path: str, framework: str = None) -> list:
+    """Failure records from one log / error-context.md file."""
+    parser = FailureParser(path, framework)
+    for line in iter_lines(path):
+        parser.feed(line)
+    return parser.close()
+
+
+def parse_text(text: str, framework: str = None) -> list:
+    parser = FailureParser(framework=framework)
+    for line in (text or "").splitlines():
+        parser.feed(line)
+    return parser.close()
+
+
+def parse_junit(path: str) -> list:
+    """Failed/errored <testcase>s of a JUnit XML report (Cypress, WDIO, pytest and Playwright all emit it)."""
+    records = []
+    try:
+        for _, element in ElementTree.iterparse(path, events=("end",)):
+            if element.tag != "testcase":
+                continue
+            problem = element.find("failure")
+            if problem is None:
+                problem = element.find("error")
+            if problem is not None:
+                parser = FailureParser(path)
+                for line in f"{problem.get('message') or ''}\n{problem.text or ''}".splitlines():
+                    parser.feed(line)
+                for record in parser.close() or [{}]:
+                    record.setdefault("error_kind", "error")
+                    record["test"] = record.get("test") or element.get("name")
+                    record["file"] = record.get("file") or element.get("file")
+                    records.append(record)
+            element.clear()
+    except ElementTree.ParseError:
+        return []
+    return records
+
+
+def parse_artifact(task: tuple) -> list:
+    """Parses one (kind, path, html_path) task; runs in a worker process."""
+    kind, path, html_path = task
+    try:
+        if kind == "junit":
+            records = parse_junit(path)
+        else:
+            records = parse_log(path, "playwright" if kind == "context" else None)
+    except OSError as e:
+        print(f"⚠️  Could not read {path}: {e}", file=sys.stderr)
+        return []
+    for index, record in enumerate(records):
+        record["id"] = path if len(records) == 1 else f"{path}#{index + 1}"
+        record["log_path"] = path
+        record["html_path"] = html_path
+        if kind == "context":
+            record["context_path"] = path
+    return records
+
+
+def _list_dir(directory: str) -> tuple:
+    """(tasks, subdirectories) for one directory."""
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return [], []
+    names = {entry.name for entry in entries if entry.is_file()}
+    subdirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False) and entry.name not in SKIP_DIRS]
+    tasks = []
+    if "manifest.db" in names:
+        # A DeFlake artifact store: its blobs are listed by the manifest, not by walking objects/
+        from core.artifact_store import OBJECTS_DIR, ArtifactStore
+        subdirs = [path for path in subdirs if os.path.basename(path) != OBJECTS_DIR]
+        tasks.extend(("log", entry["log_path"], entry["html_path"]) for entry in ArtifactStore(directory).list())
+    htmls = sorted(name for name in names if name.endswith((".html", ".html.gz")) and name != "index.html")
+    for name in sorted(names):
+        path = os.path.join(directory, name)
+        if name == CONTEXT_FILE:
+            tasks.append(("context", path, os.path.join(directory, htmls[0]) if htmls else None))
+        elif name.endswith(LOG_SUFFIXES):
+            tasks.append(("log", path, _snapshot_for(directory, name, names)))
+        elif name.endswith(".xml"):
+            tasks.append(("junit", path, None))
+    return tasks, subdirs
+
+
+def _snapshot_for(directory: str, name: str, names: set):
+    """The HTML snapshot saved next to a log (error_<id>.log + snapshot_<id>.html[.gz], or <stem>.html)."""
+    stem = name[:-len(".gz")] if name.endswith(".gz") else name
+    stem = os.path.splitext(stem)[0]
+    candidates = [f"{stem}.html", f"{stem}.html.gz"]
+    if stem.startswith("error_"):
+        snapshot = f"snapshot_{stem[len('error_'):]}"
+        candidates[:0] = [f"{snapshot}.html.gz", f"{snapshot}.html"]
+    for candidate in candidates:
+        if candidate in names:
+            return os.path.join(directory, candidate)
+    return None
+
+
+def find_artifacts(root: str, workers: int = None) -> list:
+    """Every parseable artifact under `root`, listing directories concurrently; sorted by path."""
+    if os.path.isfile(root):
+        kind = "context" if os.path.basename(root) == CONTEXT_FILE else "junit" if root.endswith(".xml") else "log"
+        return [(kind, root, None)]
+    tasks = []
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        pending = {pool.submit(_list_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, subdirs = future.result()
+                tasks.extend(found)
+                pending |= {pool.submit(_list_dir, path) for path in subdirs}
+    return sorted(tasks, key=lambda task: task[1])
+
+
+def scan(root: str, workers: int = None):
+    """
+    Yields normalized failure records for everything under `root`, in path order.
+    Runner logs that point at an error-context.md (Playwright) are merged with it, so each
+    failure comes out once with its location, selector and page snapshot together.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = find_artifacts(root)
+    if workers > 1 and len(tasks) >= PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse_artifact, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+    else:
+        results = [parse_artifact(task) for task in tasks]
+
+    records = [record for batch in results for record in batch]
+    contexts = {os.path.abspath(r["log_path"]): r for r in records if r["log_path"].endswith(CONTEXT_FILE)}
+    merged = set()
+    for record in records:
+        context_path = record["context_path"]
+        if not context_path or record["log_path"].endswith(CONTEXT_FILE):
+            continue
+        # Playwright prints the context path relative to the project root; try the log's directory and above
+        base = os.path.dirname(os.path.abspath(record["log_path"]))
+        for directory in (base, os.path.dirname(base), os.getcwd()):
+            context = contexts.get(os.path.normpath(os.path.join(directory, context_path)))
+            if context is not None:
+                for key, value in context.items():
+                    if record.get(key) is None:
+                        record[key] = value
+                record["context_path"] = context["log_path"]
+                merged.add(context["log_path"])
+                break
+    for record in records:
+        if record["log_path"] in merged:
+            continue
+        yield record
+
+
+def locate(log_path: str):
+    """(file, line) the log's first failure points at, or (None, None)."""
+    for record in parse_log(log_path):
+        if record["file"] and record["line"]:
+            return record["file"], record["line"]
+    return None, None
+
+
+@click.command()
+@click.argument('root', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=0, help='Parser processes (0 = one per CPU).')
+@click.option('--summary', is_flag=True, help='Print counts per framework and error kind instead of records.')
+def main(root, workers, summary):
+    """Scans a test results directory and prints one normalized failure record per line (NDJSON)."""
+    started = time.perf_counter()
+    counts = {}
+    total = 0
+    for record in scan(root, workers or None):
+        total += 1
+        key = (record["framework"], record["error_kind"])
+        counts[key] = counts.get(key, 0) + 1
+        if not summary:
+            click.echo(json.dumps(record))
+    elapsed = time.perf_counter() - started
+    if summary:
+        for (framework, kind), count in sorted(counts.items(), key=lambda item: -item[1]):
+            click.echo(f"{count:6d}  {framework:<12} {kind}")
+    click.echo(f"🔎 {total} failure(s) found in {root} in {elapsed:.2f}s", err=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies the CLI only loads when a real LLM call / HTML parse needs them
+LAZY_DEPENDENCIES = ["dotenv", "lxml.etree", "langchain_core.prompts", "langchain_openai"]
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(statement: str) -> list:
+    """
+    Runs `statement` in a fresh interpreter with -X importtime.
+    Returns [(module, self_us, cumulative_us, depth)] in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def profile_startup(top: int = 10) -> str:
+    """Builds the --profile-startup report: cost of the fast-start path and of each lazy dependency."""
+    lines = []
+    startup = measure_imports("import core.main")
+    top_level = [row for row in startup if row[3] == 0]
+    total_ms = sum(row[2] for row in top_level) / 1000
+    lines.append(f"⏱️  Fast-start import of core.main: {total_ms:.1f} ms")
+    lines.append(f"   Slowest imports (cumulative):")
+    for module, _, cumulative_us, _ in sorted(startup, key=lambda r: -r[2])[:top]:
+        lines.append(f"   {cumulative_us / 1000:8.1f} ms  {module}")
+
+    lines.append("")
+    lines.append("💤 Deferred until needed (not paid by mock runs or cache hits):")
+    for dependency in LAZY_DEPENDENCIES:
+        rows = measure_imports(f"import {dependency}")
+        own = [row for row in rows if row[0] == dependency]
+        if own:
+            lines.append(f"   {own[-1][2] / 1000:8.1f} ms  {dependency}")
+        else:
+            lines.append(f"   {'n/a':>8}     {dependency} (not installed)")
+    return "\n".join(lines)
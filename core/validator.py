@@ -0,0 +1,152 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from core.heuristics import HeuristicHealer, find_locator
+from core.history import guess_test_file
+from core.fix import FixResult
+from core.locator_engine import Document, Unsupported, resolve
+
+# Set DEFLAKE_VALIDATE=0 to apply fixes without replaying them against the snapshot
+VALIDATE_ENABLED = os.getenv("DEFLAKE_VALIDATE", "1") != "0"
+VALIDATE_WORKERS = int(os.getenv("DEFLAKE_VALIDATE_WORKERS", 4))
+# Set DEFLAKE_APPLY_UNVERIFIED=1 to still write a fix when no candidate could be evaluated at all
+APPLY_UNVERIFIED = os.getenv("DEFLAKE_APPLY_UNVERIFIED", "0") == "1"
+# Lines that expect the element to be gone, where "no visible match" is the success case
+EXPECTS_HIDDEN_RE = re.compile(
+    r"toBeHidden|not\.toBeVisible|not_to_be_visible|to_be_hidden|toHaveCount\(\s*0\s*\)|to_have_count\(\s*0\s*\)"
+    r"|should\(\s*['\"](?:not\.exist|not\.be\.visible|be\.hidden)|isHidden|is_hidden|waitForDisplayed\([^)]*reverse"
+    r"|state\s*[:=]\s*['\"](?:hidden|detached)"
+)
+
+
+def verdict(code: str, status: str, reason: str, matches: int = 0, visible: bool = None) -> dict:
+    return {"code": code, "status": status, "matches": matches, "visible": visible, "reason": reason}
+
+
+class FixValidator:
+    """
+    Replays candidate fixes against the captured snapshot before anything is written: the
+    locator in each fixed line is evaluated by core/locator_engine.py (no browser) and must
+    match exactly one visible element (or several, for actions that take all matches).
+    """
+
+    def __init__(self, workers: int = VALIDATE_WORKERS):
+        self.workers = max(1, workers)
+
+    def validate(self, code: str, document: Document, failing_line: str = None) -> dict:
+        """
+        Status of one candidate: ok, ambiguous (strict locator, several matches), hidden,
+        missing, unchanged (same as the failing line) or unverified (nothing this engine can evaluate).
+        """
+        code = (code or "").strip()
+        if not code:
+            return verdict(code, "missing", "empty fix")
+        if failing_line and code == failing_line.strip():
+            return verdict(code, "unchanged", "the fix is the failing line itself")
+        if not document.nodes:
+            return verdict(code, "unverified", document.error or "empty snapshot")
+
+        checked = None
+        for line in code.splitlines():
+            try:
+                resolution = resolve(document, line)
+            except Unsupported as e:
+                checked = checked or verdict(code, "unverified", str(e))
+                continue
+            checked = self._judge(code, line, document, resolution)
+            if checked["status"] != "ok":
+                return checked
+        return checked
+
+    @staticmethod
+    def _judge(code: str, line: str, document: Document, resolution) -> dict:
+        nodes = resolution.nodes
+        visible = [node for node in nodes if document.is_visible(node)]
+        if EXPECTS_HIDDEN_RE.search(line):
+            if visible:
+                return verdict(code, "ambiguous" if len(visible) > 1 else "hidden",
+                               f"{resolution.description} is expected hidden but matches a visible element",
+                               len(nodes), True)
+            return verdict(code, "ok", f"{resolution.description} is not visible, as expected", len(nodes), False)
+        if not nodes:
+            return verdict(code, "missing", f"{resolution.description} matches nothing in the snapshot")
+        if resolution.strict and len(nodes) > 1:
+            return verdict(code, "ambiguous", f"{resolution.description} matches {len(nodes)} elements",
+                           len(nodes), bool(visible))
+        target = nodes[0]
+        if not document.is_visible(target):
+            return verdict(code, "hidden", f"{resolution.description} matches <{target.tag}>, which looks hidden",
+                           len(nodes), False)
+        return verdict(code, "ok", f"{resolution.description} matches <{target.tag}>", len(nodes), True)
+
+    def choose(self, candidates: list, html_snapshot: str, failing_line: str = None):
+        """
+        Validates the candidates (in preference order) in parallel against one parse of the
+        snapshot. Returns (code to apply or None, verdicts): the first candidate that resolves.
+        When none could be evaluated at all, nothing is applied unless DEFLAKE_APPLY_UNVERIFIED=1.
+        """
+        if not candidates:
+            return None, []
+        document = Document(html_snapshot or "")
+        if len(candidates) == 1 or self.workers == 1:
+            verdicts = [self.validate(code, document, failing_line) for code in candidates]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(candidates))) as pool:
+                verdicts = list(pool.map(lambda code: self.validate(code, document, failing_line), candidates))
+        for checked in verdicts:
+            if checked["status"] == "ok":
+                return checked["code"], verdicts
+        if APPLY_UNVERIFIED and all(checked["status"] == "unverified" for checked in verdicts):
+            return verdicts[0]["code"], verdicts
+        return None, verdicts
+
+    def pick(self, fix, error_log: str, html_snapshot: str, failing_line: str = None,
+             raw_snapshot: str = None, knowledge=None, test_file: str = None, tenant: str = ""):
+        """choose() over the candidates for a heal result, validated against the raw snapshot if given."""
+        candidates = candidate_fixes(fix, error_log, html_snapshot, failing_line, knowledge, test_file, tenant)
+        return self.choose(candidates, raw_snapshot if raw_snapshot is not None else html_snapshot, failing_line)
+
+
+def candidate_fixes(fix, error_log: str, html_snapshot: str, failing_line: str = None, knowledge=None,
+                    test_file: str = None, tenant: str = "") -> list:
+    """
+    Every fixed line worth trying, best first: the fix itself, the alternatives the LLM offered,
+    the heuristic healer's proposal and the replacements that healed this locator before
+    (for this tenant; `test_file` defaults to the one named in the log).
+    """
+    result = FixResult.parse(fix)
+    candidates = [result.code] + result.alternatives
+
+    if failing_line:
+        proposal = HeuristicHealer().propose(error_log, html_snapshot, failing_line)
+        if proposal:
+            candidates.append(proposal["code"])
+        locator = find_locator(failing_line, error_log or "")
+        if knowledge is not None and locator is not None:
+            for known in knowledge.candidates(test_file or guess_test_file(error_log) or "", locator, tenant):
+                if known["replacement"] == known["fixed_line"]:
+                    if known["original_line"] == failing_line.strip():
+                        candidates.append(known["fixed_line"])
+                else:
+                    candidates.append(locator.replace(known["replacement"]).strip())
+
+    unique = []
+    for code in candidates:
+        code = (code or "").strip()
+        if code and code not in unique:
+            unique.append(code)
+    return unique
+
+
+def suggestion_status(fix, html_snapshot: str, failing_line: str = None) -> str:
+    """
+    History status for a fix that is returned to the caller rather than written:
+    Verified if it resolves in the snapshot it was made for, else Suggested.
+    """
+    checked = FixValidator().validate(FixResult.parse(fix).code, Document(html_snapshot or ""), failing_line)
+    return "Verified" if checked["status"] == "ok" else "Suggested"
+
+
+def describe(verdicts: list) -> str:
+    return "; ".join(f"{checked['status']}: {checked['reason']}" for checked in verdicts)
@@ -1,13 +1,52 @@
 import sqlite3
 import hashlib
 import secrets
+import threading
+import atexit
+import time
+from functools import lru_cache
 from datetime import datetime
 import os
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "users.db")
+from dashboard.metrics import span
+
+DB_PATH = os.getenv("DEFLAKE_USERS_DB_PATH", os.path.join(os.path.dirname(__file__), "users.db"))
+
+# Resolved API keys are trusted for this many seconds before going back to SQLite
+KEY_CACHE_TTL = float(os.getenv("DEFLAKE_KEY_CACHE_TTL", 5))
+# Usage increments are buffered in memory and written out at this interval (and on shutdown)
+USAGE_FLUSH_INTERVAL = float(os.getenv("DEFLAKE_USAGE_FLUSH_INTERVAL", 2))
+# By default usage is reserved atomically in SQLite (a conditional UPDATE), which holds however
+# many processes share users.db. DEFLAKE_USAGE_WRITE_BEHIND=1 buffers increments in memory
+# instead: faster, but only correct when a single process serves every request.
+USAGE_WRITE_BEHIND = os.getenv("DEFLAKE_USAGE_WRITE_BEHIND", "0") != "0"
+
+_local = threading.local()
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_user_cache = {}       # api_key_hash -> (row dict, expires_at)
+_pending_usage = {}    # api_key_hash -> increments not yet written to disk (negative after refunds)
+_usage_counts = {}     # api_key_hash -> usage including pending (write-behind: this process owns the counter)
+_flusher = None
+
+def get_conn():
+    """Returns this thread's connection (opened once, WAL mode)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+@lru_cache(maxsize=4096)
+def hash_key(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_conn()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS users (
                     api_key_hash TEXT PRIMARY KEY,
@@ -17,47 +56,178 @@ def init_db():
                     created_at TEXT
                 )''')
     conn.commit()
-    conn.close()
 
 def create_user(tier="free"):
     """Creates a new user and returns their raw API Key."""
     api_key = secrets.token_urlsafe(32)
-    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-    
+    api_key_hash = hash_key(api_key)
+
     # Pricing Tier Logic
     limit = 20 if tier == "free" else 1000
     if tier == "enterprise":
         limit = 999999
-        
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO users VALUES (?, ?, 0, ?, ?)", 
-              (api_key_hash, tier, limit, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+
+    with span("db"):
+        conn = get_conn()
+        conn.execute("INSERT INTO users VALUES (?, ?, 0, ?, ?)",
+                     (api_key_hash, tier, limit, datetime.now().isoformat()))
+        conn.commit()
     return api_key
 
+def _load_user(api_key_hash):
+    """Returns the user row from the short-TTL cache, hitting SQLite only on miss/expiry."""
+    now = time.monotonic()
+    cached = _user_cache.get(api_key_hash)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    with span("db"):
+        row = get_conn().execute("SELECT * FROM users WHERE api_key_hash=?", (api_key_hash,)).fetchone()
+    user = dict(row) if row else None
+    # Unknown keys are cached too, so bad keys can't hammer the DB
+    _user_cache[api_key_hash] = (user, now + KEY_CACHE_TTL)
+    return user
+
 def get_user(api_key):
-    """Returns user dict if key is valid, else None."""
-    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE api_key_hash=?", (api_key_hash,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return dict(row)
-    return None
+    """Returns user dict if key is valid, else None. usage_count includes unflushed increments."""
+    api_key_hash = hash_key(api_key)
+    user = _load_user(api_key_hash)
+    if user is None:
+        return None
+    if USAGE_WRITE_BEHIND:
+        with _lock:
+            usage = _usage_counts.get(api_key_hash)
+        if usage is not None:
+            return {**user, "usage_count": usage}
+    return user
 
 def increment_usage(api_key):
-    """Increments the usage count for the given key."""
-    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET usage_count = usage_count + 1 WHERE api_key_hash=?", (api_key_hash,))
-    conn.commit()
-    conn.close()
+    """Records one unit of usage for the given key. Returns False if the quota is exhausted."""
+    return reserve_usage(hash_key(api_key))
+
+def reserve_usage(api_key_hash, units=1):
+    """
+    Takes `units` of quota before the work is done (refund_usage gives them back if it fails).
+    All or nothing: returns False, reserving nothing, if they don't all fit under limit_count.
+    """
+    if not USAGE_WRITE_BEHIND:
+        return _reserve_in_db(api_key_hash, units)
+    usage = _write_behind_usage(api_key_hash)
+    if usage is None:
+        return False
+    user = _load_user(api_key_hash)
+    with _lock:
+        usage = _usage_counts[api_key_hash]
+        if user is None or usage + units > user["limit_count"]:
+            return False
+        _usage_counts[api_key_hash] = usage + units
+        _pending_usage[api_key_hash] = _pending_usage.get(api_key_hash, 0) + units
+    _ensure_flusher()
+    return True
+
+def refund_usage(api_key_hash, units=1):
+    """Gives back reserved quota for work that failed or was never done."""
+    if units <= 0:
+        return
+    if not USAGE_WRITE_BEHIND:
+        with span("db"):
+            conn = get_conn()
+            conn.execute("UPDATE users SET usage_count = MAX(usage_count - ?, 0) WHERE api_key_hash=?",
+                         (units, api_key_hash))
+            conn.commit()
+        _user_cache.pop(api_key_hash, None)
+        return
+    # The reservation may have been made by another process (e.g. a job submitted to the API)
+    if _write_behind_usage(api_key_hash) is None:
+        return
+    with _lock:
+        _usage_counts[api_key_hash] = max(_usage_counts[api_key_hash] - units, 0)
+        _pending_usage[api_key_hash] = _pending_usage.get(api_key_hash, 0) - units
+    _ensure_flusher()
+
+def _write_behind_usage(api_key_hash):
+    """
+    Single-process mode: the in-memory counter is authoritative once loaded, so quota checks
+    never see a stale cached row. It is read from SQLite only the first time a key is used.
+    """
+    with _lock:
+        usage = _usage_counts.get(api_key_hash)
+    if usage is not None:
+        return usage
+    with span("db"):
+        row = get_conn().execute("SELECT usage_count FROM users WHERE api_key_hash=?", (api_key_hash,)).fetchone()
+    if row is None:
+        return None
+    with _lock:
+        return _usage_counts.setdefault(api_key_hash, row["usage_count"] + _pending_usage.get(api_key_hash, 0))
+
+def _reserve_in_db(api_key_hash, units=1):
+    """Multi-process mode: one conditional UPDATE, so concurrent workers can't overrun the limit."""
+    with span("db"):
+        conn = get_conn()
+        cur = conn.execute(
+            "UPDATE users SET usage_count = usage_count + ? WHERE api_key_hash=? AND usage_count + ? <= limit_count",
+            (units, api_key_hash, units)
+        )
+        conn.commit()
+    _user_cache.pop(api_key_hash, None)
+    return cur.rowcount == 1
+
+def flush_usage():
+    """Writes buffered usage increments (and refunds) to SQLite in one transaction, clamped to 0..limit_count."""
+    with _flush_lock:
+        return _flush_pending()
+
+def _flush_pending():
+    with _lock:
+        batch = list(_pending_usage.items())
+    if not batch:
+        return 0
+
+    conn = get_conn()
+    try:
+        with span("db"):
+            conn.executemany(
+                "UPDATE users SET usage_count = MAX(MIN(usage_count + ?, limit_count), 0) WHERE api_key_hash=?",
+                [(count, api_key_hash) for api_key_hash, count in batch]
+            )
+            conn.commit()
+    except sqlite3.Error:
+        # Increments stay pending and are retried on the next flush
+        conn.rollback()
+        raise
+
+    # Only now retire the flushed increments (new ones may have arrived meanwhile),
+    # and drop the cached rows so the next read sees the committed count.
+    with _lock:
+        for api_key_hash, count in batch:
+            remaining = _pending_usage.get(api_key_hash, 0) - count
+            if remaining:
+                _pending_usage[api_key_hash] = remaining
+            else:
+                _pending_usage.pop(api_key_hash, None)
+            _user_cache.pop(api_key_hash, None)
+    return len(batch)
+
+def _flush_loop():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        try:
+            flush_usage()
+        except sqlite3.Error as e:
+            print(f"Failed to flush usage counters: {e}")
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="deflake-usage-flusher", daemon=True)
+                _flusher.start()
+
+# Never lose buffered usage on a clean shutdown
+atexit.register(flush_usage)
 
-# Initialize DB on module load
-init_db()
+# Initialize DB on module load (a multi-worker server does it once, before starting its workers)
+if os.getenv("DEFLAKE_DB_INITIALIZED") != "1":
+    init_db()
@@ -0,0 +1,384 @@
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Allow `python dashboard/jobs.py` (standalone worker process) as well as package imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+JOBS_DB = os.getenv("DEFLAKE_JOBS_PATH", os.path.join(os.path.dirname(__file__), "jobs.db"))
+# Threads per process draining the queue (0 = this process only accepts jobs)
+JOB_WORKERS = int(os.getenv("DEFLAKE_JOB_WORKERS", 4))
+# Max jobs of one tenant running at once, so a big CI run can't starve everyone else
+TENANT_CONCURRENCY = int(os.getenv("DEFLAKE_JOB_TENANT_CONCURRENCY", 2))
+MAX_ATTEMPTS = int(os.getenv("DEFLAKE_JOB_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("DEFLAKE_JOB_RETRY_DELAY", 2))
+# A running job whose worker hasn't finished within this many seconds is handed to another worker
+LEASE_SECONDS = float(os.getenv("DEFLAKE_JOB_LEASE", 300))
+POLL_INTERVAL = 0.5
+WEBHOOK_TIMEOUT = 10
+# Threads per process delivering webhooks (retries sleep there, not in the job workers)
+WEBHOOK_WORKERS = int(os.getenv("DEFLAKE_WEBHOOK_WORKERS", 2))
+# Webhook hosts exempt from the private-address check (comma-separated), e.g. an internal CI bridge
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("DEFLAKE_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    Durable heal queue in SQLite (WAL), shared by every worker thread and process
+    that opens the same file. Claims are atomic (BEGIN IMMEDIATE) and leased.
+    """
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                tenant TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                webhook_url TEXT,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_tenant ON jobs (tenant, status);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, tenant: str, payload: dict, webhook_url: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, tenant, status, payload, webhook_url, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, tenant, QUEUED, json.dumps(payload), webhook_url, now, now, now),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, lease: float = LEASE_SECONDS) -> dict:
+        """
+        Takes the next runnable job, fairly across tenants: tenants with the fewest
+        running jobs go first (FIFO among them), and tenants at TENANT_CONCURRENCY wait.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                '''SELECT q.*, COALESCE(r.running, 0) AS running FROM jobs q
+                   LEFT JOIN (SELECT tenant, COUNT(*) AS running FROM jobs WHERE status=? GROUP BY tenant) r
+                          ON r.tenant = q.tenant
+                   WHERE q.status=? AND q.available_at <= ? AND COALESCE(r.running, 0) < ?
+                   ORDER BY running, q.seq LIMIT 1''',
+                (RUNNING, QUEUED, now, TENANT_CONCURRENCY),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status=?, attempts=attempts+1, lease_until=?, updated_at=? WHERE id=?",
+                (RUNNING, now + lease, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def reclaim_expired(self) -> list:
+        """
+        Jobs whose worker died mid-heal (lease expired) go back to the queue while attempts remain;
+        the rest are marked failed and returned, so the caller can refund them and notify webhooks.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE status=? AND lease_until < ?", (RUNNING, now)
+            ).fetchall()
+            failed = []
+            for row in expired:
+                if row["attempts"] < MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status=?, lease_until=NULL, updated_at=? WHERE id=?", (QUEUED, now, row["id"])
+                    )
+                else:
+                    self._finish(row["id"], FAILED, result=None,
+                                 error=f"Worker lease expired on attempt {row['attempts']}; giving up")
+                    failed.append(row["id"])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [self.get(job_id) for job_id in failed]
+
+    def complete(self, job_id: str, result: dict):
+        self._finish(job_id, DONE, result=json.dumps(result), error=None)
+
+    def fail(self, job_id: str, error: str, retry: bool, attempts: int):
+        """Requeues with exponential backoff while attempts remain, otherwise marks the job failed."""
+        if retry and attempts < MAX_ATTEMPTS:
+            now = time.time()
+            self._conn().execute(
+                "UPDATE jobs SET status=?, error=?, lease_until=NULL, available_at=?, updated_at=? WHERE id=?",
+                (QUEUED, error, now + RETRY_BASE_DELAY * (2 ** (attempts - 1)), now, job_id),
+            )
+            return
+        self._finish(job_id, FAILED, result=None, error=error)
+
+    def _finish(self, job_id: str, status: str, result: str, error: str):
+        conn = self._conn()
+        row = conn.execute("SELECT payload FROM jobs WHERE id=?", (job_id,)).fetchone()
+        payload = json.loads(row["payload"]) if row else {}
+        # Jobs queued by older versions carried raw keys; don't keep them around
+        payload.pop("key", None)
+        payload.pop("byok", None)
+        conn.execute(
+            "UPDATE jobs SET status=?, result=?, error=?, payload=?, lease_until=NULL, updated_at=? WHERE id=?",
+            (status, result, error, json.dumps(payload), time.time(), job_id),
+        )
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+def job_view(job: dict) -> dict:
+    """Public representation of a job (never includes the payload or keys)."""
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["result"]:
+        view["fix"] = json.loads(job["result"]).get("fix")
+    if job["error"] and job["status"] != DONE:
+        view["error"] = job["error"]
+    return view
+
+
+def webhook_error(url: str):
+    """
+    Why the server must not POST to `url`, or None if it may: only http(s), and (unless the
+    host is in DEFLAKE_WEBHOOK_ALLOWED_HOSTS) never to loopback, private, link-local or other
+    non-public addresses, so tenants can't reach the metadata service or internal hosts.
+    """
+    parsed = urllib.parse.urlsplit(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "webhook_url must be an http(s) URL"
+    host = parsed.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTS:
+        return None
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        return f"webhook host {host} does not resolve"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            return f"webhook host {host} resolves to a non-public address ({ip})"
+    return None
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could point anywhere, including the addresses webhook_error() refuses
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def send_webhook(url: str, body: dict, attempts: int = 3):
+    """POSTs the finished job to the caller's webhook (best effort, a few tries)."""
+    data = json.dumps(body).encode()
+    for attempt in range(attempts):
+        # Checked again before every try: DNS may have changed since the job was accepted
+        error = webhook_error(url)
+        if error:
+            print(f"⚠️  Webhook {url} refused: {error}")
+            return False
+        try:
+            request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+            with _webhook_opener.open(request, timeout=WEBHOOK_TIMEOUT):
+                return True
+        except Exception as e:
+            print(f"⚠️  Webhook {url} failed (attempt {attempt + 1}): {e}")
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+    return False
+
+
+class JobWorkerPool:
+    """
+    Threads that drain the queue with `handler(job) -> result dict`.
+    Run several processes against the same jobs.db to scale LLM work independently of ingest.
+    """
+
+    def __init__(self, queue: JobQueue, handler, workers: int = JOB_WORKERS, on_failed=None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        # Called with the job once it has failed for good (e.g. refund_failed_job)
+        self.on_failed = on_failed
+        self._stop = threading.Event()
+        self._threads = []
+        self._webhooks = ThreadPoolExecutor(max_workers=max(1, WEBHOOK_WORKERS), thread_name_prefix="deflake-webhook")
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"deflake-job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._webhooks.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for expired in self.queue.reclaim_expired():
+                    print(f"❌ Job {expired['id']} failed: {expired['error']}")
+                    self._finished(expired)
+                job = self.queue.claim()
+            except sqlite3.Error as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(POLL_INTERVAL)
+                continue
+            self.run_one(job)
+
+    def run_one(self, job: dict):
+        try:
+            result = self.handler(job)
+        except Exception as e:
+            print(f"❌ Job {job['id']} attempt {job['attempts']} failed: {e}")
+            # Rate limits and other transient provider errors are retried with backoff
+            self.queue.fail(job["id"], str(e), retry=True, attempts=job["attempts"])
+        else:
+            self.queue.complete(job["id"], result)
+        finished = self.queue.get(job["id"])
+        if finished:
+            self._finished(finished)
+
+    def _finished(self, job: dict):
+        """Refunds a job that failed for good and hands finished jobs to the webhook threads."""
+        if job["status"] == FAILED and self.on_failed is not None:
+            try:
+                self.on_failed(job)
+            except Exception as e:
+                print(f"⚠️  Job {job['id']} failure hook failed: {e}")
+        if job["webhook_url"] and job["status"] in (DONE, FAILED):
+            try:
+                self._webhooks.submit(send_webhook, job["webhook_url"], job_view(job))
+            except RuntimeError:
+                # Pool already stopped (shutdown): deliver from this thread rather than drop it
+                send_webhook(job["webhook_url"], job_view(job))
+
+
+def refund_failed_job(job: dict):
+    """Gives back the quota unit reserved when a standard-tier job was accepted."""
+    from dashboard.database import refund_usage
+
+    payload = json.loads(job["payload"])
+    if payload.get("tier") == "standard" and payload.get("key_hash"):
+        refund_usage(payload["key_hash"])
+
+
+def make_heal_handler(cache=None, save_history=None, on_usage=None, on_prompt=None):
+    """
+    Job handler doing what the synchronous /api/deflake endpoint does: heal and record history.
+    Quota is reserved when the job is accepted (see refund_failed_job).
+    `save_history(failing_line, fix, tier, test_file, tenant, html_snapshot)` defaults to a local HistoryStore.
+    """
+    from core.history import HistoryStore, guess_test_file
+    from core.knowledge import failing_code
+    from core.llm_client import get_client
+    from core.validator import suggestion_status
+
+    if save_history is None:
+        history = HistoryStore()
+
+        def save_history(failing_line, fix, tier, test_file=None, tenant=None, html_snapshot=None):
+            try:
+                status = suggestion_status(fix, html_snapshot, failing_line) if html_snapshot else "Suggested"
+                history.append(failing_line=failing_line, fix=fix, tier=tier, test_file=test_file,
+                               tenant=tenant, status=status)
+            except Exception as e:
+                print(f"Failed to save history: {e}")
+
+    def handle(job: dict) -> dict:
+        payload = json.loads(job["payload"])
+        test_file = payload.get("test_file") or guess_test_file(payload["error_log"])
+        # Queued jobs never carry a BYOK key (the API refuses them), so the server's key is used
+        client = get_client(None, cache=cache, on_usage=on_usage, on_prompt=on_prompt)
+        fix = client.heal(payload["error_log"], payload["html_snapshot"], payload.get("failing_line"), payload.get("source_code"),
+                          test_file, job["tenant"])
+        save_history(
+            failing_code(payload["error_log"], payload.get("failing_line"), payload.get("source_code")), fix, payload["tier"],
+            test_file, job["tenant"], payload["html_snapshot"],
+        )
+        return {"fix": str(fix)}
+
+    return handle
+
+
+if __name__ == "__main__":
+    # Standalone worker process: `python dashboard/jobs.py` drains the same jobs.db as the API
+    from core.cache import cache_from_env
+    from dashboard.database import init_db, flush_usage
+
+    init_db()
+    pool = JobWorkerPool(
+        JobQueue(),
+        make_heal_handler(cache=cache_from_env(default_path=os.path.join(os.path.dirname(__file__), "fix_cache.db"))),
+        workers=max(1, JOB_WORKERS),
+        on_failed=refund_failed_job,
+    ).start()
+    print(f"👷 DeFlake job worker running with {pool.workers} thread(s) on {JOBS_DB}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+        flush_usage()
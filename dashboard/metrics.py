@@ -0,0 +1,187 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers everything from a cached key lookup to a slow LLM completion
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-request list of (stage, seconds), turned into the Server-Timing header by the middleware
+_request_timings = contextvars.ContextVar("deflake_request_timings", default=None)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.kind = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.kind = "histogram"
+        self.buckets = buckets
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = []
+        with self._lock:
+            for key, series in self._series.items():
+                for i, bound in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {series[i]}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Minimal Prometheus text-format registry (no client library needed)."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` is called before every scrape, to refresh gauges derived from other state."""
+        self.collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("deflake_stage_duration_seconds", "Time spent per pipeline stage.")
+REQUEST_SECONDS = registry.histogram("deflake_request_duration_seconds", "HTTP request latency.")
+REQUESTS_TOTAL = registry.counter("deflake_requests_total", "HTTP requests by route and status.")
+IN_FLIGHT = registry.gauge("deflake_requests_in_flight", "HTTP requests currently being served.")
+LLM_TOKENS = registry.counter("deflake_llm_tokens_total", "LLM tokens consumed, by kind (prompt/completion).")
+PROMPT_TOKENS = registry.histogram(
+    "deflake_prompt_tokens", "Tokens per heal prompt, by section, after budgeting.",
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 32000),
+)
+PROMPTS_TRIMMED = registry.counter("deflake_prompt_trimmed_total", "Prompt sections cut down to fit the token budget.")
+CACHE_LOOKUPS = registry.gauge("deflake_fix_cache_lookups", "Fix cache lookups by result (hit/miss).")
+CACHE_HIT_RATIO = registry.gauge("deflake_fix_cache_hit_ratio", "Share of fix cache lookups served from cache.")
+
+
+@contextmanager
+def span(stage: str):
+    """Times a block: feeds the stage histogram and this request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def start_request_timings() -> list:
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: list, total: float) -> str:
+    """Server-Timing value; repeated stages (e.g. several DB calls) are summed."""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def record_token_usage(usage: dict):
+    """Listener for LLMClient: counts prompt/completion tokens from the response's usage metadata."""
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), kind="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), kind="completion")
+
+
+def record_prompt_size(report: dict):
+    """Listener for LLMClient: records the budgeted size of each prompt sent to the LLM."""
+    for section in ("error_log", "html_snapshot", "source_code", "total"):
+        PROMPT_TOKENS.observe(report[section], section=section)
+    for section in report["trimmed"]:
+        PROMPTS_TRIMMED.inc(section=section)
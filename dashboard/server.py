@@ -1,17 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, Header
+from fastapi import FastAPI, HTTPException, Depends, Security, Header, Request, Response, Query
 from fastapi.security.api_key import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+import asyncio
 import json
 import os
 import sys
+import time
 
 # Add project root to sys.path to import from core
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.analyzer import ErrorAnalyzer
-from core.llm_client import LLMClient
+from core.llm_client import get_client
 from core.patcher import SourcePatcher
+from core.cache import cache_from_env
+from core.batch import heal_batch, group_failures, to_ndjson
+from core.history import HistoryStore, guess_test_file
+from core.knowledge import LocatorKnowledge, failing_code
+from core.validator import suggestion_status
+from core.dom_pruner import DomPruner
+from dashboard.uploads import receive_upload
+from dashboard.jobs import JobQueue, JobWorkerPool, make_heal_handler, refund_failed_job, webhook_error, job_view, DONE, FAILED
+from dashboard.metrics import (
+    registry, span, start_request_timings, server_timing_header, record_token_usage, record_prompt_size,
+    REQUEST_SECONDS, REQUESTS_TOTAL, IN_FLIGHT, CACHE_LOOKUPS, CACHE_HIT_RATIO,
+)
 
 app = FastAPI()
 
@@ -22,8 +38,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Records request latency/status per route and reports per-stage timings in Server-Timing."""
+    timings = start_request_timings()
+    IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - start
+        # Label by route template, not raw path, so metric cardinality stays bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.observe(elapsed, route=path)
+        REQUESTS_TOTAL.inc(route=path, status=status)
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
+
 # Security
 # Security & Middleware
 API_KEY_NAME = "X-API-KEY"
@@ -33,7 +71,26 @@ api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 # Load master key from env for backward compatibility/admin
 MASTER_KEY = os.getenv("DEFLAKE_API_KEY", "test-secret-key")
 
-from dashboard.database import get_user, increment_usage, create_user
+from dashboard.database import get_user, reserve_usage, refund_usage, create_user, flush_usage, hash_key
+
+history_store = HistoryStore()
+locator_knowledge = LocatorKnowledge()
+
+# Shared fix cache: identical failures across shards/retries skip the LLM round trip.
+fix_cache = cache_from_env(default_path=os.path.join(os.path.dirname(__file__), "fix_cache.db"))
+
+# Optional bearer token for /metrics; unset means the endpoint is open (scrapers usually sit on a private network)
+METRICS_TOKEN = os.getenv("DEFLAKE_METRICS_TOKEN")
+
+def collect_cache_metrics():
+    if fix_cache is None:
+        return
+    stats = fix_cache.stats()
+    CACHE_LOOKUPS.set(stats["hits"], result="hit")
+    CACHE_LOOKUPS.set(stats["misses"], result="miss")
+    CACHE_HIT_RATIO.set(stats["hit_rate"])
+
+registry.add_collector(collect_cache_metrics)
 
 async def verify_quota_and_key(
     api_key: str = Security(api_key_header), 
@@ -45,35 +102,82 @@ async def verify_quota_and_key(
     1. If X-OPENAI-KEY is present -> BYOK Mode (Skip quota, validate DeFlake key exists).
     2. If normal request -> Check quota in DB.
     """
-    if not api_key:
-        raise HTTPException(status_code=403, detail="Missing API Key")
+    with span("auth"):
+        if not api_key:
+            raise HTTPException(status_code=403, detail="Missing API Key")
 
-    # Master Key Bypass (Admin)
-    if api_key == MASTER_KEY:
-        return {"type": "master", "key": api_key, "byok": openai_key}
+        # Master Key Bypass (Admin)
+        if api_key == MASTER_KEY:
+            return {"type": "master", "key": api_key, "byok": openai_key}
 
-    user = get_user(api_key)
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid API Key")
+        user = get_user(api_key)
+        if not user:
+            raise HTTPException(status_code=403, detail="Invalid API Key")
 
-    # BYOK Mode: Unlimited usage, but must have valid account
-    if openai_key:
-        return {"type": "byok", "key": api_key, "byok": openai_key}
+        # BYOK Mode: Unlimited usage, but must have valid account
+        if openai_key:
+            return {"type": "byok", "key": api_key, "byok": openai_key}
 
-    # Standard Mode: Check Quota
-    if user["usage_count"] >= user["limit_count"]:
-        raise HTTPException(
-            status_code=402, 
-            detail=f"Quota Exceeded ({user['usage_count']}/{user['limit_count']}). Upgrade to Pro or use BYOK."
-        )
+        # Standard Mode: Check Quota
+        if user["usage_count"] >= user["limit_count"]:
+            raise HTTPException(
+                status_code=402, 
+                detail=f"Quota Exceeded ({user['usage_count']}/{user['limit_count']}). Upgrade to Pro or use BYOK."
+            )
 
-    return {"type": "standard", "key": api_key, "byok": None}
+        return {"type": "standard", "key": api_key, "byok": None}
 
 class HealRequest(BaseModel):
     error_log: str
     html_snapshot: str
     failing_line: str = None
     source_code: str = None
+    test_file: str = None
+
+class JobRequest(HealRequest):
+    webhook_url: str = None
+
+class BatchItem(HealRequest):
+    id: str = None
+
+class BatchHealRequest(BaseModel):
+    items: list[BatchItem]
+    concurrency: int = None
+
+# Seconds a single heal may take before the request is answered with 504
+HEAL_TIMEOUT = float(os.getenv("DEFLAKE_HEAL_TIMEOUT", 90))
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Upper bound on concurrent LLM calls a single batch request may use
+BATCH_CONCURRENCY = int(os.getenv("DEFLAKE_BATCH_CONCURRENCY", 8))
+
+# Snapshots are pruned to ~15k chars around the failing selector to avoid 429 errors
+SNAPSHOT_TOKENS = 15000 // DomPruner.CHARS_PER_TOKEN
+
+def prune_snapshot(html_snapshot: str, error_log: str) -> str:
+    with span("prune"):
+        return DomPruner(max_tokens=SNAPSHOT_TOKENS).prune(html_snapshot, error_log)
+
+# Async heals: accepted jobs are drained by a worker pool (here and/or `python dashboard/jobs.py`)
+job_queue = JobQueue()
+job_pool = None
+JOB_EVENTS_INTERVAL = 1.0
+
+@app.on_event("startup")
+def start_job_workers():
+    global job_pool
+    job_pool = JobWorkerPool(
+        job_queue,
+        make_heal_handler(cache=fix_cache, save_history=save_history, on_usage=record_token_usage, on_prompt=record_prompt_size),
+        on_failed=refund_failed_job,
+    ).start()
+
+@app.on_event("shutdown")
+def flush_usage_on_shutdown():
+    """Usage increments are write-behind; persist whatever is still buffered."""
+    if job_pool is not None:
+        job_pool.stop()
+    flush_usage()
 
 @app.get("/")
 def health_check():
@@ -99,80 +203,342 @@ def get_usage(creds: dict = Security(verify_quota_and_key)):
     }
 
 @app.post("/api/deflake")
-def deflake_endpoint(request: HealRequest, creds: dict = Security(verify_quota_and_key)):
+async def deflake_endpoint(request: HealRequest, http_request: Request, creds: dict = Security(verify_quota_and_key)):
     """
     SaaS Endpoint: Accepts context, returns fix.
+    The LLM call is awaited, so a worker can hold many heals in flight; it is
+    cancelled if the caller disconnects or HEAL_TIMEOUT elapses.
     """
     print(f"🚑 Received healing request. Type: {creds['type']}")
-    
-    # Initialize Client
+
+    # Pruning is CPU-bound, so keep it off the event loop
+    trimmed_html = await run_in_threadpool(prune_snapshot, request.html_snapshot, request.error_log)
+    return await heal_and_record(
+        creds, http_request, request.error_log, trimmed_html,
+        request.failing_line, request.source_code, request.test_file,
+    )
+
+@app.post("/api/deflake/upload")
+async def deflake_upload_endpoint(http_request: Request, creds: dict = Security(verify_quota_and_key)):
+    """
+    Streaming variant of /api/deflake for large snapshots.
+    Takes multipart/form-data (error_log, html_snapshot, optional failing_line / source_code / test_file),
+    compressed with gzip or zstd as a whole (Content-Encoding) or per part. The snapshot is pruned
+    while it streams in, so memory per request doesn't grow with the DOM.
+    """
+    print(f"🚑 Received streamed healing request. Type: {creds['type']}")
+
+    with span("upload"):
+        fields = await receive_upload(http_request, SNAPSHOT_TOKENS)
+    return await heal_and_record(
+        creds, http_request, fields["error_log"], fields["html_snapshot"],
+        fields.get("failing_line"), fields.get("source_code"), fields.get("test_file"),
+    )
+
+def job_tenant(creds: dict) -> str:
+    """Jobs are owned (and scheduled fairly) per DeFlake key; the raw key is never used as an id."""
+    return "master" if creds["type"] == "master" else hash_key(creds["key"])
+
+def owned_job(job_id: str, creds: dict) -> dict:
+    job = job_queue.get(job_id)
+    if job is None or (creds["type"] != "master" and job["tenant"] != job_tenant(creds)):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/deflake/jobs", status_code=202)
+async def submit_job(request: JobRequest, creds: dict = Security(verify_quota_and_key)):
+    """
+    Queues a heal and returns at once. Poll GET /api/deflake/jobs/{id}, follow
+    /api/deflake/jobs/{id}/events (SSE), or pass webhook_url to have the result POSTed.
+    Standard-tier quota is reserved here and refunded if the job fails for good.
+    """
+    if creds.get("byok"):
+        # Keys are never written to jobs.db, and a worker process elsewhere couldn't use one held in memory
+        raise HTTPException(status_code=400, detail="BYOK keys are not accepted for queued jobs; use /api/deflake instead.")
+    if request.webhook_url:
+        error = await run_in_threadpool(webhook_error, request.webhook_url)
+        if error:
+            raise HTTPException(status_code=422, detail=error)
+    print(f"📬 Received healing job. Type: {creds['type']}")
+
+    # Prune at ingest so the queue only ever holds small payloads
+    trimmed_html = await run_in_threadpool(prune_snapshot, request.html_snapshot, request.error_log)
+    key_hash = hash_key(creds["key"])
+    if creds["type"] == "standard" and not await run_in_threadpool(reserve_usage, key_hash):
+        raise HTTPException(status_code=429, detail="Quota Exceeded. Upgrade to Pro or use BYOK.")
+    payload = {
+        "tier": creds["type"],
+        # Only the hash is stored: enough to refund the reservation, useless as a credential
+        "key_hash": key_hash,
+        "error_log": request.error_log,
+        "html_snapshot": trimmed_html,
+        "failing_line": request.failing_line,
+        "source_code": request.source_code,
+        "test_file": request.test_file,
+    }
+    try:
+        job_id = await run_in_threadpool(job_queue.submit, job_tenant(creds), payload, request.webhook_url)
+    except Exception:
+        if creds["type"] == "standard":
+            await run_in_threadpool(refund_usage, key_hash)
+        raise
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "poll_url": f"/api/deflake/jobs/{job_id}",
+        "events_url": f"/api/deflake/jobs/{job_id}/events",
+    }
+
+@app.get("/api/deflake/jobs/{job_id}")
+def get_job(job_id: str, creds: dict = Security(verify_quota_and_key)):
+    """Current state of a job; `fix` is included once it is done."""
+    return job_view(owned_job(job_id, creds))
+
+@app.get("/api/deflake/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request, creds: dict = Security(verify_quota_and_key)):
+    """Server-Sent Events: one `status` event per state change, ending with `done` or `failed`."""
+    await run_in_threadpool(owned_job, job_id, creds)
+
+    async def events():
+        last = None
+        while not await http_request.is_disconnected():
+            view = job_view(await run_in_threadpool(job_queue.get, job_id))
+            state = (view["status"], view["attempts"])
+            if state != last:
+                last = state
+                event = view["status"] if view["status"] in (DONE, FAILED) else "status"
+                yield f"event: {event}\ndata: {json.dumps(view)}\n\n"
+                if event != "status":
+                    return
+            else:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def reserve_quota(creds: dict, units: int = 1):
+    """
+    Takes `units` of the caller's quota before any LLM work (standard tier only), so concurrent
+    requests can't all pass the quota check and overrun the limit. 429 if they don't fit.
+    """
+    if creds["type"] == "standard" and not reserve_usage(hash_key(creds["key"]), units):
+        raise HTTPException(status_code=429, detail="Quota Exceeded. Upgrade to Pro or use BYOK.")
+
+def refund_quota(creds: dict, units: int = 1):
+    if creds["type"] == "standard":
+        refund_usage(hash_key(creds["key"]), units)
+
+async def heal_and_record(creds: dict, http_request: Request, error_log: str, trimmed_html: str,
+                          failing_line: str = None, source_code: str = None, test_file: str = None) -> dict:
+    """Reserves quota, runs the heal for an already-pruned snapshot and saves history; failed heals are refunded."""
+    # Shared client per key (reuses the HTTP connection pool)
     # If BYOK, we pass the user's OpenAI Key
     # If Standard, we rely on server's env key (LLMClient handles this)
-    openai_key = creds.get("byok")
-    
-    # We use mock=True for the demo unless OpenAI key is present (real or BYOK)
-    # Real AI Mode
-    client = LLMClient(mock=False, openai_api_key=openai_key)
-    
+    client = get_client(creds.get("byok"), cache=fix_cache, on_usage=record_token_usage, on_prompt=record_prompt_size)
+
+    await run_in_threadpool(reserve_quota, creds)
     try:
-        # NAIVE MVP TRIMMING: Limit HTML to 15k chars to avoid 429 errors
-        # In a real version, we'd use BeautifulSoup to extract only the body or relevant div.
-        trimmed_html = request.html_snapshot[:15000] + "\n...[TRUNCATED]..." if len(request.html_snapshot) > 15000 else request.html_snapshot
-        
-        fix = client.heal(request.error_log, trimmed_html, request.failing_line, request.source_code)
-        
-        # Increment usage ONLY if it wasn't a BYOK request and wasn't Master
-        if creds["type"] == "standard":
-            increment_usage(creds["key"])
-
-        # Save to History
-        import datetime
-        history_entry = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "failing_line": request.failing_line,
-            "fix": fix,
-            "tier": creds["type"]
-        }
-        
-        try:
-            history_data = []
-            if os.path.exists(HISTORY_FILE):
-                with open(HISTORY_FILE, "r") as f:
-                    history_data = json.load(f)
-            
-            history_data.insert(0, history_entry) # Prepend
-            history_data = history_data[:50] # Keep last 50
-            
-            with open(HISTORY_FILE, "w") as f:
-                json.dump(history_data, f, indent=2)
-        except Exception as e:
-            print(f"Failed to save history: {e}")
-            
-        return {"fix": fix, "status": "success"}
-    except Exception as e:
+        test_file = test_file or guess_test_file(error_log)
+
+        with span("llm"):
+            fix = await run_until_disconnect(
+                client.aheal(error_log, trimmed_html, failing_line, source_code, test_file, job_tenant(creds)),
+                http_request,
+                HEAL_TIMEOUT,
+            )
+    except BaseException as e:
+        # Disconnects (499), timeouts (504), cancellation and LLM errors don't cost quota
+        await asyncio.shield(run_in_threadpool(refund_quota, creds))
+        if not isinstance(e, Exception) or isinstance(e, HTTPException):
+            raise
         print(f"Error during healing: {e}")
         return {"fix": str(e), "status": "error"}
 
-HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "history.json")
+    # Save to History
+    await run_in_threadpool(
+        save_history, failing_code(error_log, failing_line, source_code), fix, creds["type"], test_file,
+        job_tenant(creds), trimmed_html,
+    )
+    return {"fix": str(fix), "status": "success"}
 
-@app.get("/api/history")
-def get_history():
-    """Returns the list of healed tests."""
-    if not os.path.exists(HISTORY_FILE):
-        return []
-    
-    with open(HISTORY_FILE, "r") as f:
+async def run_until_disconnect(coro, http_request: Request, timeout: float):
+    """
+    Awaits `coro`, cancelling it when the client goes away (499) or `timeout` passes (504).
+    """
+    task = asyncio.ensure_future(coro)
+    deadline = asyncio.get_running_loop().time() + timeout
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("🔌 Client disconnected, cancelling heal.")
+                raise HTTPException(status_code=499, detail="Client closed request")
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(status_code=504, detail=f"Healing timed out after {timeout:.0f}s")
+    finally:
+        if not task.done():
+            task.cancel()
+
+class TimedClient:
+    """Wraps a client so heals run by heal_batch's worker threads are recorded as the llm stage."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def heal(self, *args, **kwargs):
+        with span("llm"):
+            return self.client.heal(*args, **kwargs)
+
+@app.post("/api/deflake/batch")
+def deflake_batch_endpoint(request: BatchHealRequest, creds: dict = Security(verify_quota_and_key)):
+    """
+    Batch SaaS Endpoint: heals many failures in one request.
+    Identical failures are healed once; per-item results are streamed back as NDJSON
+    in completion order.
+    """
+    print(f"📦 Received batch healing request ({len(request.items)} items). Type: {creds['type']}")
+
+    items = []
+    for index, item in enumerate(request.items):
+        items.append({
+            "id": item.id or str(index),
+            "error_log": item.error_log,
+            "html_snapshot": prune_snapshot(item.html_snapshot, item.error_log),
+            "failing_line": item.failing_line,
+            "source_code": item.source_code,
+            "test_file": item.test_file or guess_test_file(item.error_log),
+            "tenant": job_tenant(creds),
+        })
+
+    # Standard tier pays per root cause: the whole batch is reserved up front, unused units are refunded
+    reserved = 0
+    if creds["type"] == "standard":
+        reserved = len(group_failures(items))
+        if not reserve_usage(hash_key(creds["key"]), reserved):
+            user = get_user(creds["key"])
+            remaining = max(user["limit_count"] - user["usage_count"], 0)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Batch needs {reserved} heals but only {remaining} remain in your quota. Upgrade to Pro or use BYOK."
+            )
+
+    client = TimedClient(get_client(creds.get("byok"), cache=fix_cache, on_usage=record_token_usage, on_prompt=record_prompt_size))
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+
+    failing_lines = {i["id"]: failing_code(i["error_log"], i["failing_line"], i["source_code"]) for i in items}
+    items_by_id = {item["id"]: item for item in items}
+
+    def stream():
+        charged = 0
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+            for result in heal_batch(client, items, concurrency=concurrency):
+                if result["status"] == "success" and result["duplicate_of"] is None:
+                    charged += 1
+                    item = items_by_id[result["id"]]
+                    save_history(failing_lines[result["id"]], result["fix"], creds["type"], item["test_file"],
+                                 item["tenant"], item["html_snapshot"])
+                yield to_ndjson(result)
+        finally:
+            # Failed root causes, and any left unhealed if the client went away, are given back
+            refund_quota(creds, reserved - charged)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def save_history(failing_line, fix, tier, test_file=None, tenant=None, html_snapshot=None):
+    """
+    Appends a healed test to the history store. The fix is only returned, never written,
+    so it is recorded as Verified when it resolves in the snapshot and as Suggested otherwise.
+    """
+    try:
+        with span("history"):
+            status = suggestion_status(fix, html_snapshot, failing_line) if html_snapshot else "Suggested"
+            history_store.append(failing_line=failing_line, fix=fix, tier=tier, test_file=test_file,
+                                 tenant=tenant, status=status)
+    except Exception as e:
+        print(f"Failed to save history: {e}")
+
+@app.get("/api/cache/stats")
+def cache_stats(creds: dict = Security(verify_quota_and_key)):
+    """Hit/miss counters for the fix cache."""
+    if fix_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **fix_cache.stats()}
+
+@app.delete("/api/cache")
+def invalidate_cache(fingerprint: str = None, creds: dict = Security(verify_quota_and_key)):
+    """Drops one cached fix (by fingerprint) or the whole cache. Admin only."""
+    if creds["type"] != "master":
+        raise HTTPException(status_code=403, detail="Cache invalidation requires the master key")
+    if fix_cache is None:
+        return {"invalidated": 0}
+    return {"invalidated": fix_cache.invalidate(fingerprint)}
+
+@app.get("/metrics")
+def metrics(authorization: str = Header(None)):
+    """Prometheus text exposition: request latency, per-stage timings, LLM tokens, cache hit ratio."""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/history")
+def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: int = None,
+    tier: str = None,
+    test_file: str = None,
+    since: str = None,
+    until: str = None,
+):
+    """
+    Returns the list of healed tests, newest first.
+    Filter by tier / test_file / ISO timestamps; the next page's cursor is sent in X-Next-Cursor.
+    """
+    entries, next_cursor = history_store.query(limit, cursor, tier, test_file, since, until)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return entries
+
+@app.get("/api/locators/flaky")
+def flaky_locators(limit: int = Query(20, ge=1, le=500), test_file: str = None,
+                   creds: dict = Security(verify_quota_and_key)):
+    """
+    Locators that keep breaking, by decayed failure score, with the fix currently reused for each.
+    Each key sees its own locators; the master key sees every tenant's.
+    """
+    tenant = None if creds["type"] == "master" else job_tenant(creds)
+    return locator_knowledge.flakiest(limit, test_file, tenant)
+
+def worker_count(value: str) -> int:
+    """`auto` (or 0) means one worker per CPU core."""
+    if value in ("auto", "0"):
+        return os.cpu_count() or 1
+    return max(1, int(value))
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    # Init DB on startup
+
+    parser = argparse.ArgumentParser(description="DeFlake API server")
+    parser.add_argument("--workers", default=os.environ.get("WEB_CONCURRENCY", "1"),
+                        help="Worker processes (`auto` = one per CPU core). Default: $WEB_CONCURRENCY or 1.")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    args = parser.parse_args()
+    workers = worker_count(args.workers)
+
+    # Init DB on startup, once: workers inherit the flag and skip it
     from dashboard.database import init_db
     init_db()
-    
-    port = int(os.environ.get("PORT", 8000))
-    print(f"🚀 Starting DeFlake API on 0.0.0.0:{port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    os.environ["DEFLAKE_DB_INITIALIZED"] = "1"
+
+    print(f"🚀 Starting DeFlake API on 0.0.0.0:{args.port} ({workers} worker(s))")
+    if workers == 1:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
+    else:
+        # Each worker is its own process: quota is reserved atomically in SQLite instead of
+        # buffered per process; history, jobs and users already live in shared WAL databases.
+        os.environ["DEFLAKE_USAGE_WRITE_BEHIND"] = "0"
+        uvicorn.run("dashboard.server:app", host="0.0.0.0", port=args.port, workers=workers)
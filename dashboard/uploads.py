@@ -0,0 +1,220 @@
+import os
+import zlib
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from core.dom_pruner import DomPruner
+
+# Text fields are small and kept whole; anything bigger than this is rejected
+MAX_FIELD_BYTES = int(os.getenv("DEFLAKE_MAX_FIELD_BYTES", 1024 * 1024))
+# Decompressed snapshot size limit (guards against compression bombs; memory is bounded either way)
+MAX_SNAPSHOT_BYTES = int(os.getenv("DEFLAKE_MAX_SNAPSHOT_BYTES", 200 * 1024 * 1024))
+# Largest piece a single decompress call may produce
+DECOMPRESS_CHUNK = 256 * 1024
+# zstandard's streaming decompressor takes no output limit, so input is fed in slices this small:
+# a 256-byte slice can't inflate past a few MB, and the running total is checked after each one
+ZSTD_INPUT_SLICE = 256
+
+TEXT_FIELDS = {"error_log", "failing_line", "source_code", "test_file"}
+SNAPSHOT_FIELD = "html_snapshot"
+COMPRESSED_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+COMPRESSED_TYPES = {"application/gzip": "gzip", "application/x-gzip": "gzip", "application/zstd": "zstd"}
+# Most any one decompressor may produce. Whole-body encoding also covers the text fields (each capped
+# at MAX_FIELD_BYTES) and the parts that are skipped unread, so those count towards it too.
+MAX_DECOMPRESSED_BYTES = MAX_SNAPSHOT_BYTES + len(TEXT_FIELDS) * MAX_FIELD_BYTES + DECOMPRESS_CHUNK
+
+
+class _Identity:
+    def decompress(self, data: bytes):
+        yield data
+
+
+class _Inflater:
+    """Keeps a running total of what a decompressor produced; 413 once it passes the limit."""
+
+    def __init__(self):
+        self._total = 0
+
+    def _counted(self, piece: bytes) -> bytes:
+        self._total += len(piece)
+        if self._total > MAX_DECOMPRESSED_BYTES:
+            raise HTTPException(status_code=413, detail=f"Decompressed upload exceeds {MAX_DECOMPRESSED_BYTES} bytes")
+        return piece
+
+
+class _Gzip(_Inflater):
+    def __init__(self):
+        super().__init__()
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes):
+        try:
+            yield self._counted(self._inflater.decompress(data, DECOMPRESS_CHUNK))
+            while self._inflater.unconsumed_tail:
+                yield self._counted(self._inflater.decompress(self._inflater.unconsumed_tail, DECOMPRESS_CHUNK))
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid gzip data: {e}")
+
+
+class _Zstd(_Inflater):
+    def __init__(self):
+        super().__init__()
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=415, detail="zstd uploads need the zstandard package on the server; use gzip")
+        self._error = zstandard.ZstdError
+        self._inflater = zstandard.ZstdDecompressor().decompressobj(write_size=DECOMPRESS_CHUNK)
+
+    def decompress(self, data: bytes):
+        view = memoryview(data)
+        for start in range(0, len(view), ZSTD_INPUT_SLICE):
+            try:
+                piece = self._inflater.decompress(view[start:start + ZSTD_INPUT_SLICE])
+            except self._error as e:
+                raise HTTPException(status_code=400, detail=f"Invalid zstd data: {e}")
+            yield self._counted(piece)
+
+
+def decompressor(encoding: str):
+    """Returns a streaming decompressor for a Content-Encoding value (identity if empty)."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("identity", ""):
+        return _Identity()
+    if encoding in ("gzip", "x-gzip"):
+        return _Gzip()
+    if encoding == "zstd":
+        return _Zstd()
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+
+class StreamingUpload:
+    """
+    Incremental multipart/form-data reader for heal requests.
+    The html_snapshot part is decompressed and fed to the DOM pruner as it arrives;
+    only the small text fields are buffered. Send error_log before html_snapshot so
+    the pruner can also discard irrelevant markup on the fly.
+    """
+
+    def __init__(self, boundary: bytes, pruner: DomPruner, content_encoding: str = None):
+        self.pruner = pruner
+        self.snapshot = pruner.stream()
+        self.snapshot_bytes = 0
+        self.has_snapshot = False
+        self.fields = {}
+        self._body = decompressor(content_encoding)
+        self._part = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def write(self, chunk: bytes):
+        for data in self._body.decompress(chunk):
+            if data:
+                self._parser.write(data)
+
+    def finish(self) -> dict:
+        """Closes the upload and returns the heal fields, with html_snapshot already pruned."""
+        self._parser.finalize()
+        if not self.has_snapshot or "error_log" not in self.fields:
+            raise HTTPException(status_code=422, detail="Upload must include error_log and html_snapshot parts")
+        return {**self.fields, SNAPSHOT_FIELD: self.pruner.prune_stream((), self.fields["error_log"], self.snapshot)}
+
+    def _on_part_begin(self):
+        self._part = {"headers": {}, "field": b"", "value": b"", "name": None, "sink": None}
+
+    def _on_header_field(self, data, start, end):
+        self._part["field"] += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._part["value"] += data[start:end]
+
+    def _on_header_end(self):
+        part = self._part
+        part["headers"][part["field"].decode("latin-1").lower()] = part["value"].decode("latin-1")
+        part["field"], part["value"] = b"", b""
+
+    def _on_headers_finished(self):
+        part = self._part
+        _, options = parse_options_header(part["headers"].get("content-disposition", ""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        if part["name"] == SNAPSHOT_FIELD:
+            part["sink"] = decompressor(part_encoding(part["headers"], filename))
+            self.has_snapshot = True
+            if "error_log" in self.fields:
+                # Log already known: irrelevant subtrees can be dropped while the DOM streams in
+                self.pruner.watch(self.snapshot, self.fields["error_log"])
+        elif part["name"] in TEXT_FIELDS:
+            part["buffer"] = bytearray()
+
+    def _on_part_data(self, data, start, end):
+        part = self._part
+        if part["sink"] is not None:
+            for chunk in part["sink"].decompress(data[start:end]):
+                self.snapshot_bytes += len(chunk)
+                if self.snapshot_bytes > MAX_SNAPSHOT_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Snapshot exceeds {MAX_SNAPSHOT_BYTES} bytes")
+                self.snapshot.feed(chunk)
+        elif "buffer" in part:
+            part["buffer"] += data[start:end]
+            if len(part["buffer"]) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Field {part['name']} exceeds {MAX_FIELD_BYTES} bytes")
+        # Unknown parts are skipped without buffering
+
+    def _on_part_end(self):
+        part = self._part
+        if "buffer" in part:
+            raw = bytearray()
+            for chunk in decompressor(part_encoding(part["headers"], "")).decompress(bytes(part["buffer"])):
+                raw += chunk
+                if len(raw) > MAX_FIELD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Field {part['name']} exceeds {MAX_FIELD_BYTES} bytes")
+            self.fields[part["name"]] = raw.decode("utf-8", "replace")
+        self._part = None
+
+
+def part_encoding(headers: dict, filename: str) -> str:
+    """A part is compressed if it says so (Content-Encoding / Content-Type) or its filename ends in .gz/.zst."""
+    if headers.get("content-encoding"):
+        return headers["content-encoding"]
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in COMPRESSED_TYPES:
+        return COMPRESSED_TYPES[content_type]
+    for suffix, encoding in COMPRESSED_SUFFIXES.items():
+        if filename.lower().endswith(suffix):
+            return encoding
+    return None
+
+
+async def receive_upload(request: Request, max_tokens: int) -> dict:
+    """
+    Reads a streamed multipart heal request (optionally gzip/zstd compressed as a whole
+    via Content-Encoding, or per part) and prunes the snapshot while it streams in.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data")
+
+    upload = StreamingUpload(
+        options[b"boundary"],
+        DomPruner(max_tokens=max_tokens),
+        request.headers.get("content-encoding"),
+    )
+    async for chunk in request.stream():
+        if chunk:
+            # Decompressing + parsing is CPU-bound; keep it off the event loop
+            await run_in_threadpool(upload.write, chunk)
+    return await run_in_threadpool(upload.finish)
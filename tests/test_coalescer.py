@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.llm_backend import Coalescer
+
+CALLERS = 8
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrent_threads_share_one_call():
+    coalescer, release, calls = Coalescer(), threading.Event(), []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return "fix"
+
+    with ThreadPoolExecutor(CALLERS) as pool:
+        futures = [pool.submit(coalescer.run, "key", call) for _ in range(CALLERS)]
+        # Hold the leader until every other caller has joined it
+        wait_for(lambda: coalescer.coalesced == CALLERS - 1)
+        release.set()
+        results = [future.result(5) for future in futures]
+    assert results == ["fix"] * CALLERS
+    assert len(calls) == 1
+
+
+def test_followers_see_the_leaders_error_and_the_key_is_freed():
+    coalescer, release = Coalescer(), threading.Event()
+
+    def call():
+        release.wait(5)
+        raise RuntimeError("429")
+
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(coalescer.run, "key", call) for _ in range(3)]
+        wait_for(lambda: coalescer.coalesced == 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(5)
+    assert coalescer.run("key", lambda: "retried") == "retried"
+
+
+def test_distinct_keys_are_not_coalesced():
+    coalescer = Coalescer()
+    assert [coalescer.run(key, lambda key=key: key) for key in ("a", "b")] == ["a", "b"]
+    assert coalescer.coalesced == 0
+
+
+def test_concurrent_coroutines_share_one_call():
+    coalescer, calls = Coalescer(), []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "fix"
+
+    async def main():
+        return await asyncio.gather(*(coalescer.arun("key", call) for _ in range(CALLERS)))
+
+    assert asyncio.run(main()) == ["fix"] * CALLERS
+    assert len(calls) == 1
+    assert coalescer.coalesced == CALLERS - 1
+
+
+def test_follower_runs_the_call_itself_when_the_leader_is_cancelled():
+    coalescer, calls = Coalescer(), []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "fix"
+
+    async def main():
+        leader = asyncio.create_task(coalescer.arun("key", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(coalescer.arun("key", call))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "fix"
+    assert len(calls) == 2
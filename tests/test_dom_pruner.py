@@ -0,0 +1,29 @@
+from core.dom_pruner import DomPruner
+
+ROWS = "".join(f"<tr><td>row {i}</td><td><a href='/r/{i}'>open</a></td></tr>" for i in range(3000))
+PAGE = (
+    f"<html><body><table>{ROWS}</table>"
+    "<form><div class='actions'><button id='auth-submit'>Login</button></div></form>"
+    "<p>Sign in with <span>SSO portal</span></p></body></html>"
+)
+
+
+def test_target_after_node_cap_is_kept():
+    # 3000 rows are ~12000 elements, far past the cap; the button comes after all of them
+    out = DomPruner(max_nodes=1000).prune(PAGE, 'TimeoutError: waiting for locator("#auth-submit")')
+    assert 'id="auth-submit"' in out
+    assert "Login" in out
+
+
+def test_text_target_after_node_cap_is_kept():
+    out = DomPruner(max_nodes=1000).prune(PAGE, 'waiting for getByText("SSO portal")')
+    assert "SSO portal" in out
+
+
+def test_streamed_target_after_node_cap_is_kept():
+    error_log = 'TimeoutError: waiting for locator("#auth-submit")'
+    pruner = DomPruner(max_nodes=1000)
+    parser = pruner.stream(error_log)
+    for start in range(0, len(PAGE), 4096):
+        parser.feed(PAGE[start:start + 4096])
+    assert 'id="auth-submit"' in pruner.prune_stream([], error_log, parser)
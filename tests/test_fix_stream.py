@@ -0,0 +1,43 @@
+from core.fix import FixResult, FixStreamParser
+
+ANSWER = (
+    '```json\n{"reason": "the id is now \\"login-submit\\"", "alternatives": [{"code": "nested"}],'
+    ' "code": "await page.click(\\"#login-submit\\");", "line_number": 12}\n```'
+)
+CODE = 'await page.click("#login-submit");'
+
+
+def stream(chunks):
+    parser = FixStreamParser()
+    reported = [code for code in (parser.feed(chunk) for chunk in chunks) if code is not None]
+    return reported, parser.close("llm")
+
+
+def test_code_is_reported_once_wherever_the_answer_is_split():
+    for size in (1, 2, 3, 7, 16):
+        chunks = [ANSWER[i:i + size] for i in range(0, len(ANSWER), size)]
+        reported, result = stream(chunks)
+        assert reported == [CODE], size
+        assert result.code == CODE
+        assert result.line_number == 12
+        assert result.source == "llm"
+
+
+def test_split_inside_an_escape_sequence():
+    cut = ANSWER.index('\\"#login') + 1  # between the backslash and the quote it escapes
+    reported, result = stream([ANSWER[:cut], ANSWER[cut:]])
+    assert reported == [CODE]
+    assert result == FixResult.parse(ANSWER, "llm")
+
+
+def test_truncated_answer_keeps_the_code_that_arrived():
+    truncated = ANSWER[:ANSWER.index('"line_number"')]
+    reported, result = stream([truncated[:40], truncated[40:]])
+    assert reported == [CODE]
+    assert result.code == CODE
+
+
+def test_bare_code_answer_is_parsed_on_close():
+    reported, result = stream(["await page.click(", "'#ok');"])
+    assert reported == []
+    assert result.code == "await page.click('#ok');"
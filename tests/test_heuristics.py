@@ -0,0 +1,24 @@
+from core.heuristics import HeuristicHealer
+
+FORM = (
+    '<form><input name="user"><button class="btn">Sign in</button>'
+    '<a href="/help">Help</a></form>'
+)
+
+
+def test_partial_locator_match_defers_to_llm():
+    # Only "btn" is found on the page; "login" matches nothing
+    healer = HeuristicHealer()
+    error_log = 'waiting for locator("#login-btn")'
+    failing_line = 'await page.click("#login-btn");'
+
+    proposal = healer.propose(error_log, FORM, failing_line)
+    assert proposal["confidence"] < healer.threshold
+    assert healer.heal(error_log, FORM, failing_line) is None
+
+
+def test_renamed_id_is_healed_locally():
+    html = '<button id="submit-btn">Submit</button><button id="cancel">Cancel</button>'
+    fix = HeuristicHealer().heal('waiting for locator("#submit-btn-123")', html, 'await page.click("#submit-btn-123");')
+    assert fix.code == 'await page.click("#submit-btn");'
+    assert fix.source == "heuristic"
@@ -0,0 +1,68 @@
+import pytest
+
+from core.locator_engine import Document, Unsupported, resolve
+
+PAGE = """
+<html><head><script>document.write("<button id='fake'>")</script></head><body>
+<nav><a href="/home" class="nav-link">Home</a><a href="/about" class="nav-link">About us</a></nav>
+<form id="login">
+  <label for="user">Username</label><input id="user" name="user" placeholder="Your name">
+  <button type="submit" class="btn btn-primary" data-testid="login-submit">Sign <b>in</b></button>
+  <button type="button" class="btn" style="display: none">Cancel</button>
+  <div hidden><button id="ghost">Ghost</button></div>
+</form>
+<ul class="items"><li>One</li><li class="x">Two</li><li>Three</li></ul>
+</body></html>
+"""
+DOCUMENT = Document(PAGE)
+
+
+def ids(line: str) -> list:
+    return [node.get("id") or DOCUMENT.text(node) for node in resolve(DOCUMENT, line).nodes]
+
+
+def test_css_goes_through_cssselect():
+    assert ids("await page.locator('form#login button.btn-primary').click()") == ["Sign in"]
+    assert ids("await page.locator('ul.items > li:nth-child(2)').click()") == ["Two"]
+    assert ids("await page.locator('li.x ~ li').count()") == ["Three"]
+    assert ids("await page.locator('form:has(#ghost)').click()") == ["login"]
+
+
+def test_playwright_pseudo_classes():
+    assert ids("await page.locator('button:has-text(\"SIGN IN\")').click()") == ["Sign in"]
+    assert ids("await page.locator('button:text-is(\"Sign in\")').click()") == ["Sign in"]
+    assert ids("await page.locator('.btn:visible').click()") == ["Sign in"]
+    assert ids("await page.locator('button:hidden').count()") == ["Cancel", "ghost"]
+
+
+def test_xpath_is_evaluated_by_lxml():
+    assert ids("await page.locator('//button[@data-testid=\"login-submit\"]').click()") == ["Sign in"]
+    assert ids("await page.locator('xpath=(//li)[last()]').click()") == ["Three"]
+    # Inside a chain an absolute path is relative to the scope, as in Playwright
+    assert ids("await page.locator('nav').locator('//a').count()") == ["Home", "About us"]
+
+
+def test_playwright_chains_and_get_by():
+    assert ids("await page.locator('form >> text=Sign in').click()") == ["Sign in"]
+    assert ids("await page.getByRole('button', { name: 'Sign in' }).click()") == ["Sign in"]
+    assert ids("await page.getByLabel('Username').fill('x')") == ["user"]
+    assert ids("await page.locator('li').filter({ hasText: 'Tw' }).click()") == ["Two"]
+
+
+def test_script_content_is_not_a_target():
+    assert ids("await page.locator('#fake').click()") == []
+
+
+def test_strictness_follows_the_call():
+    assert resolve(DOCUMENT, "await page.locator('li').click()").strict
+    assert not resolve(DOCUMENT, "await page.locator('li').first().click()").strict
+
+
+@pytest.mark.parametrize("line", [
+    "await page.locator('button::after').click()",
+    "await page.locator('count(//li)').click()",
+    "const total = items.length;",
+])
+def test_unsupported_is_reported(line):
+    with pytest.raises(Unsupported):
+        resolve(DOCUMENT, line)
@@ -0,0 +1,72 @@
+import pytest
+
+import core.patcher as patcher
+from core.patcher import Edit, PatchConflict, SourcePatcher
+
+SPEC = "test('login', async () => {\n    await page.click('#old');\n    await page.fill('#user', 'x');\n});\n"
+
+
+def write(tmp_path, name, content=SPEC):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_plan_edits_keeps_indentation_and_maps_shifted_lines(tmp_path):
+    path = write(tmp_path, "a.spec.ts")
+    plan = SourcePatcher().plan_edits(path, [
+        Edit(2, "await page.waitForLoadState();\nawait page.click('#new');", "await page.click('#old');"),
+        Edit(3, "await page.fill('#username', 'x');"),
+    ])
+    assert plan.patched.splitlines()[1:4] == [
+        "    await page.waitForLoadState();",
+        "    await page.click('#new');",
+        "    await page.fill('#username', 'x');",
+    ]
+    assert plan.line_map == {2: (2, 3), 3: (4, 4)}
+    assert open(path).read() == SPEC  # planning never writes
+
+
+def test_expected_line_mismatch_is_a_conflict(tmp_path):
+    path = write(tmp_path, "a.spec.ts")
+    with pytest.raises(PatchConflict):
+        SourcePatcher().plan_edits(path, [Edit(2, "await page.click('#new');", "await page.click('#other');")])
+
+
+def test_apply_many_writes_nothing_when_any_file_conflicts(tmp_path):
+    first, second = write(tmp_path, "a.spec.ts"), write(tmp_path, "b.spec.ts")
+    with pytest.raises(PatchConflict):
+        SourcePatcher().apply_many([
+            (first, 2, "await page.click('#new');", "await page.click('#old');"),
+            (second, 2, "await page.click('#new');", "await page.click('#stale');"),
+        ])
+    assert open(first).read() == SPEC
+    assert open(second).read() == SPEC
+
+
+def test_apply_many_rolls_back_written_files_when_a_write_fails(tmp_path, monkeypatch):
+    first, second = write(tmp_path, "a.spec.ts"), write(tmp_path, "b.spec.ts")
+    real_write = patcher.atomic_write
+
+    def failing_write(file_path, content):
+        if file_path == second:
+            raise OSError("disk full")
+        real_write(file_path, content)
+
+    monkeypatch.setattr(patcher, "atomic_write", failing_write)
+    with pytest.raises(OSError):
+        SourcePatcher().apply_many([
+            (first, 2, "await page.click('#new');", "await page.click('#old');"),
+            (second, 2, "await page.click('#new');", "await page.click('#old');"),
+        ])
+    assert open(first).read() == SPEC
+
+
+def test_rollback_refuses_when_the_file_changed_after_patching(tmp_path):
+    path = write(tmp_path, "a.spec.ts")
+    source = SourcePatcher()
+    result = source.apply_edits(path, [Edit(2, "await page.click('#new');")])
+    with open(path, "a") as f:
+        f.write("// edited by hand\n")
+    with pytest.raises(PatchConflict):
+        source.rollback(result)
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+# Each test initializes its own database below; don't create dashboard/users.db on import
+os.environ.setdefault("DEFLAKE_DB_INITIALIZED", "1")
+
+from dashboard import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "users.db"))
+    monkeypatch.setattr(database, "_user_cache", {})
+    monkeypatch.setattr(database, "_pending_usage", {})
+    monkeypatch.setattr(database, "_usage_counts", {})
+    # Flushes are driven by the tests, not the background thread
+    monkeypatch.setattr(database, "_ensure_flusher", lambda: None)
+    database.init_db()
+    return database
+
+
+def stored_usage(db, key_hash):
+    return db.get_conn().execute("SELECT usage_count FROM users WHERE api_key_hash=?", (key_hash,)).fetchone()[0]
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_reserve_fail_refund_round_trip(db, monkeypatch, write_behind):
+    monkeypatch.setattr(db, "USAGE_WRITE_BEHIND", write_behind)
+    api_key = db.create_user("free")
+    key_hash = db.hash_key(api_key)
+
+    assert db.reserve_usage(key_hash, 5)
+    assert db.get_user(api_key)["usage_count"] == 5
+    # The heal failed: the reservation goes back
+    db.refund_usage(key_hash, 5)
+    assert db.get_user(api_key)["usage_count"] == 0
+
+    db.flush_usage()
+    assert stored_usage(db, key_hash) == 0
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_reservation_past_the_limit_takes_nothing(db, monkeypatch, write_behind):
+    monkeypatch.setattr(db, "USAGE_WRITE_BEHIND", write_behind)
+    api_key = db.create_user("free")
+    key_hash = db.hash_key(api_key)
+
+    assert db.reserve_usage(key_hash, 18)
+    assert not db.reserve_usage(key_hash, 3)
+    assert db.get_user(api_key)["usage_count"] == 18
+    assert db.reserve_usage(key_hash, 2)
+    assert not db.increment_usage(api_key)
+
+    db.flush_usage()
+    assert stored_usage(db, key_hash) == 20
+
+
+def test_refund_frees_quota_for_the_next_request(db):
+    api_key = db.create_user("free")
+    key_hash = db.hash_key(api_key)
+    assert db.reserve_usage(key_hash, 20)
+    assert not db.increment_usage(api_key)
+    db.refund_usage(key_hash)
+    assert db.increment_usage(api_key)
+
+
+def test_unknown_key_reserves_nothing(db):
+    assert not db.reserve_usage(db.hash_key("nope"))
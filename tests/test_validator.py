@@ -0,0 +1,35 @@
+from core.fix import FixResult
+from core.validator import FixValidator
+
+SNAPSHOT = (
+    '<form><button id="sign-in">Sign in</button><button class="btn">A</button><button class="btn">B</button>'
+    '<button id="gone" style="display:none">Gone</button></form>'
+)
+FAILING = 'await page.click("#login-btn");'
+
+
+def test_pick_prefers_the_fix_when_it_resolves():
+    fix = FixResult(code='await page.click("#sign-in");', alternatives=['await page.click(".btn");'])
+    code, verdicts = FixValidator().pick(fix, 'waiting for locator("#login-btn")', SNAPSHOT, FAILING)
+    assert code == 'await page.click("#sign-in");'
+    assert verdicts[0]["status"] == "ok"
+
+
+def test_pick_falls_back_to_an_alternative_that_resolves():
+    fix = FixResult(code='await page.click(".btn");', alternatives=['await page.click("#gone");',
+                                                                    'await page.click("#sign-in");'])
+    code, verdicts = FixValidator().pick(fix, 'waiting for locator("#login-btn")', SNAPSHOT, FAILING)
+    assert code == 'await page.click("#sign-in");'
+    assert [checked["status"] for checked in verdicts[:3]] == ["ambiguous", "hidden", "ok"]
+
+
+def test_nothing_is_applied_when_no_candidate_resolves():
+    code, verdicts = FixValidator().choose(['await page.click("#nope");', 'await page.click(".btn");'], SNAPSHOT)
+    assert code is None
+    assert [checked["status"] for checked in verdicts] == ["missing", "ambiguous"]
+
+
+def test_unverifiable_fix_is_not_applied_by_default():
+    code, verdicts = FixValidator().choose(['await page.locator("role=button[name=\\"Go\\"]").click();'], SNAPSHOT)
+    assert code is None
+    assert verdicts[0]["status"] == "unverified"